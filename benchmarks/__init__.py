@@ -0,0 +1,5 @@
+"""
+Benchmarks for the ingestion pipeline and the chat service.
+
+Run them from the repository root, e.g. ``python -m benchmarks.ingestion_throughput``.
+"""
@@ -0,0 +1,17 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_app(name):
+    """
+    Puts one of the application directories (``chat`` or ``download_data``) on sys.path.
+
+    The two applications are separate Docker build contexts with clashing top-level
+    module names (both ship a ``utils.py``), so a benchmark process only ever imports one of them.
+    """
+    path = os.path.join(ROOT, name)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return path
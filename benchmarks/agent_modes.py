@@ -0,0 +1,102 @@
+"""
+Compares the ReAct agent with plan-and-execute (AGENT_MODE=plan, chat/planner.py) on a fixed set of
+multi-part questions: LLM calls and prompt tokens per turn, per-turn latency percentiles and wall time.
+
+Every question needs two or three lookups: some independent (the books of an author and a genre
+recommendation), some where the second lookup needs the first (a plot search, then the other books
+of its author). The scripted chat model (benchmarks/chat_fakes.py) answers in both modes with one tool
+call per part, so the modes make the same lookups; ReAct spends an LLM call on every step and runs the
+lookups in turn, plan-and-execute plans once, runs independent lookups together and writes the answer
+in one call. The fast-path router is bypassed so that every question reaches the mode being measured,
+and the response cache is off.
+
+Runs offline over an in-process Neo4j stand-in and a synthetic catalogue; each LLM call waits
+--llm-latency seconds.
+
+    python -m benchmarks.agent_modes --sessions 5 --turns 4 --llm-latency 0.3
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+
+from benchmarks.catalogue import catalogue_size, synthetic_books
+from benchmarks.chat_latency import run_load, summarize
+from benchmarks.report import add_output_argument, emit
+
+# Parts are separated by semicolons; 'its' and 'it' make a part depend on the one before.
+TEMPLATES = [
+    "Find the book where {summary_words}; which other books did its author write",
+    "Which books did {author} write; recommend a {genre} book",
+    "Tell me about the book where {summary_words}; why do readers love {genre} books",
+    "Which books did {author} write; find the book where {summary_words}; why do readers love {genre} books",
+    "Tell me about {title}; recommend books similar to it",
+]
+
+
+def question_set(books, count, seed=5):
+    rng = random.Random(seed)
+    questions = []
+    for i in range(count):
+        book = rng.choice(books)
+        words = book["Summary"].rstrip(".").lower().split()
+        questions.append(TEMPLATES[i % len(TEMPLATES)].format(
+            title=book["Title"], author=book["Author"], genre=book["Genre"].split(",")[0],
+            summary_words=" ".join(words[5:15]),
+        ))
+    return questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=4, help="questions per session")
+    parser.add_argument("--books", type=catalogue_size, default=1000, help="size of the synthetic catalogue")
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds before the first token of an LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per further token")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--query-latency", type=float, default=0.005, help="seconds per Neo4j query of the stand-in")
+    add_output_argument(parser)
+    args = parser.parse_args()
+
+    from benchmarks._paths import use_app
+    from benchmarks.chat_fakes import install_offline_backends
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("OPENAI_GEN_MODEL", "gpt-3.5-turbo")
+    os.environ.setdefault("EMBEDDING_MODEL", "text-embedding-3-small")
+    os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    books = list(synthetic_books(args.books))
+    install_offline_backends(llm_latency=args.llm_latency, token_latency=args.token_latency,
+                             embedding_latency=args.embedding_latency, query_latency=args.query_latency,
+                             books=books, dimensions=args.dimensions)
+    use_app("chat")
+    import agent
+
+    agent.get_router().intent = lambda question: None
+    questions = question_set(books, args.sessions * args.turns)
+
+    results = {}
+    for mode in ("react", "plan"):
+        os.environ["AGENT_MODE"] = mode
+        # The agent executor is verbose; its trace goes to stderr so stdout stays JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            turns, wall_seconds = asyncio.run(
+                run_load(agent, questions, args.sessions, args.turns, 0.0, f"__bench_{mode}__"))
+        results[mode] = summarize(turns, wall_seconds)
+
+    react, plan = results["react"], results["plan"]
+    if react["llm_calls_per_turn"] and plan["llm_calls_per_turn"]:
+        results["llm_calls_saved_per_turn"] = round(react["llm_calls_per_turn"] - plan["llm_calls_per_turn"], 2)
+        results["p50_speedup"] = round(react["latency"]["p50_ms"] / plan["latency"]["p50_ms"], 2)
+        results["wall_speedup"] = round(react["wall_seconds"] / plan["wall_seconds"], 2)
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    config["plan_max_steps"] = int(os.getenv("PLAN_MAX_STEPS", 4))
+    emit("agent_modes", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
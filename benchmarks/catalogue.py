@@ -0,0 +1,81 @@
+"""
+Writes synthetic book catalogues in the CSV layout the ingestion pipeline reads.
+
+    python -m benchmarks.catalogue --rows 100k --output /tmp/books_100k.csv
+
+Sizes are row counts or one of the presets 1k, 100k and 1M.
+"""
+import argparse
+import csv
+import random
+
+GENRES = ["Fiction", "Fantasy", "Science Fiction", "Mystery", "Thriller", "Romance", "Historical",
+          "Horror", "Biography", "Poetry", "Adventure", "Young Adult", "Classics", "Humor"]
+WORDS = ("dog lost home journey city war love river ship island secret family king queen detective "
+         "murder letter garden winter summer forest mountain village stranger dream memory child "
+         "storm house road friend enemy magic dragon sea star machine empire rebel").split()
+SIZES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+COLUMNS = ["Title", "Author", "Genre", "Language", "Ratings", "Publication Year", "Summary"]
+
+
+def catalogue_size(value):
+    """
+    Parses a catalogue size for argparse: a number of rows or a preset name of SIZES.
+    """
+    if value in SIZES:
+        return SIZES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number of rows or one of {', '.join(SIZES)}")
+
+
+def summary(words, sentence_words=12):
+    """
+    Joins words into sentences of sentence_words words.
+    """
+    return " ".join(" ".join(words[i:i + sentence_words]).capitalize() + "."
+                    for i in range(0, len(words), sentence_words))
+
+
+def synthetic_books(rows, seed=42, summary_words=60):
+    """
+    Yields deterministic synthetic book records as dictionaries keyed by the CSV column names.
+    """
+    rng = random.Random(seed)
+    authors = max(rows // 20, 1)
+    for i in range(rows):
+        title_words = rng.sample(WORDS, 3)
+        yield {
+            "Title": f"The {title_words[0].title()} of the {title_words[1].title()} {i}",
+            "Author": f"Author {i % authors}",
+            "Genre": ", ".join(rng.sample(GENRES, rng.randint(1, 3))),
+            "Language": "English",
+            "Ratings": round(rng.uniform(1, 5), 2),
+            "Publication Year": rng.randint(1850, 2024),
+            "Summary": summary([rng.choice(WORDS) for _ in range(summary_words)]),
+        }
+
+
+def write_catalogue(path, rows, seed=42):
+    """
+    Streams a synthetic catalogue of the given size to a CSV file.
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(synthetic_books(rows, seed))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=catalogue_size, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+    write_catalogue(args.output, args.rows, args.seed)
+
+
+if __name__ == "__main__":
+    main()
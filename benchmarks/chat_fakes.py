@@ -0,0 +1,565 @@
+"""
+Stand-ins for the OpenAI, Neo4j and vector-store backends of the chat app, built on the LangChain interfaces
+the app expects. Each backend call sleeps for a configurable latency and is counted, so benchmarks can
+show which calls happen at import time and which on first use.
+
+The stubs only let the app start. For whole chat turns without OpenAI or Neo4j, install_offline_backends
+replaces them with a scripted ReAct chat model, deterministic embeddings and an in-process graph that
+answers the queries of the app from a synthetic catalogue.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import ClassVar
+
+import numpy as np
+from langchain_community.graphs.graph_store import GraphStore
+from langchain_core.embeddings import Embeddings, FakeEmbeddings
+from langchain_core.language_models import BaseChatModel, FakeListChatModel
+from langchain_core.language_models.chat_models import agenerate_from_stream, generate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.retrievers import BaseRetriever
+
+backend_calls = Counter()
+_lock = threading.Lock()
+
+# The backend calls of the chat turn running in the current context, if a benchmark tracks them.
+turn_calls = contextvars.ContextVar("turn_calls", default=None)
+
+
+def count(name, amount=1):
+    with _lock:
+        backend_calls[name] += amount
+        calls = turn_calls.get()
+        if calls is not None:
+            calls[name] += amount
+
+
+def backend_call(name, latency):
+    count(name)
+    if latency:
+        time.sleep(latency)
+
+
+async def abackend_call(name, latency):
+    count(name)
+    if latency:
+        await asyncio.sleep(latency)
+
+
+class StubChatModel(FakeListChatModel):
+    """
+    Accepts the ChatOpenAI constructor arguments and always answers directly.
+    """
+
+    def __init__(self, **kwargs):
+        backend_call("llm.create", 0)
+        super().__init__(responses=["Thought: Do I need to use a tool? No\nFinal Answer: A stub answer."])
+
+
+class StubEmbeddings(FakeEmbeddings):
+    def __init__(self, **kwargs):
+        backend_call("embeddings.create", 0)
+        super().__init__(size=8)
+
+
+class StubDriver:
+    def execute_query(self, query, parameters=None, **kwargs):
+        backend_call("driver.execute_query", 0)
+        return [], None, None
+
+    def close(self):
+        pass
+
+
+class StubGraph(GraphStore):
+    """
+    Mimics Neo4jGraph: connecting and refreshing the schema each take `latency` seconds.
+    """
+
+    latency = 0.0
+
+    def __init__(self, url=None, username=None, password=None, refresh_schema=True, **kwargs):
+        backend_call("graph.connect", self.latency)
+        self._driver = StubDriver()
+        self._database = "neo4j"
+        self.schema = ""
+        self.structured_schema = {}
+        if refresh_schema:
+            self.refresh_schema()
+
+    @property
+    def get_schema(self):
+        return self.schema
+
+    @property
+    def get_structured_schema(self):
+        return self.structured_schema
+
+    def query(self, query, params=None):
+        backend_call("graph.query", 0)
+        return []
+
+    def refresh_schema(self):
+        backend_call("graph.refresh_schema", self.latency)
+        self.schema = "Node properties: Book {title: STRING, summary: STRING}"
+
+    def add_graph_documents(self, graph_documents, include_source=False):
+        raise NotImplementedError
+
+
+class EmptyRetriever(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager):
+        return []
+
+
+class StubVectorStore:
+    latency = 0.0
+
+    @classmethod
+    def from_existing_index(cls, embedding, **kwargs):
+        backend_call("vector.from_existing_index", cls.latency)
+        return cls()
+
+    def as_retriever(self, **kwargs):
+        return EmptyRetriever()
+
+
+def install_backend_stubs(latency):
+    """
+    Replaces ChatOpenAI, OpenAIEmbeddings, Neo4jGraph and Neo4jVector.from_existing_index with stubs.
+    Must run before the chat modules are imported.
+    """
+    import langchain_community.graphs
+    import langchain_openai
+    from langchain_community.vectorstores.neo4j_vector import Neo4jVector
+
+    langchain_openai.ChatOpenAI = StubChatModel
+    langchain_openai.OpenAIEmbeddings = StubEmbeddings
+    StubGraph.latency = latency
+    StubVectorStore.latency = latency
+    langchain_community.graphs.Neo4jGraph = StubGraph
+    Neo4jVector.from_existing_index = StubVectorStore.from_existing_index
+
+
+NEW_INPUT = re.compile(r"New input: (.*)")
+PLAN_QUESTION = re.compile(r"Reply with the plan as JSON.*\nQuestion: (.*)", re.S)
+CYPHER_TOOL_QUESTION = re.compile(r"\b(by|author|genre|rating|rated|year|recommend|random|similar|like)\b", re.I)
+GENERAL_QUESTION = re.compile(r"\b(why|what makes|opinion)\b", re.I)
+# Parts of a question that need the result of the part before them.
+DEPENDENT_PART = re.compile(r"\b(its|it|that book|the same author)\b", re.I)
+
+
+def question_parts(question):
+    """
+    Splits a scripted multi-part question; its parts are separated by semicolons.
+    """
+    return [part.strip() for part in question.split(";") if part.strip()]
+
+
+def scripted_tool(part):
+    if GENERAL_QUESTION.search(part):
+        return "General Chat"
+    return "Book information" if CYPHER_TOOL_QUESTION.search(part) else "Books Plot Search"
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    A deterministic stand-in for ChatOpenAI. Agent prompts get a scripted ReAct trace: tool_calls
+    actions (the Cypher tool for questions about authors, genres and ratings, the general chat for
+    'why' questions, the plot search otherwise), or one per part of a question whose parts are separated
+    by semicolons, then a final answer. Planner prompts (chat/planner.py) get a plan with one step per
+    part, where parts that refer back ('its', 'that book') depend on the part before. Cypher generation
+    prompts get a fixed query and every other prompt (tool answers, summaries, plan syntheses) a short
+    answer. Every call waits latency seconds before the first token and token_latency seconds per further
+    word, and is counted as 'llm.call', its prompt tokens as 'llm.prompt_tokens'.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    tool_calls: int = 1
+    streaming: bool = False
+    # Settings for instances the app creates with the ChatOpenAI arguments, set by install_offline_backends.
+    defaults: ClassVar[dict] = {}
+
+    def __init__(self, **kwargs):
+        super().__init__(**dict(self.defaults, streaming=kwargs.get("streaming", False)))
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def respond(self, prompt):
+        planned = PLAN_QUESTION.search(prompt)
+        if planned:
+            return self.plan(planned.group(1).strip())
+        question = NEW_INPUT.search(prompt)
+        if question:
+            question = question.group(1).strip()
+            parts = question_parts(question) or [question]
+            done = prompt.count("Observation:") - prompt.count("Observation: the result")
+            if done < max(self.tool_calls, len(parts)):
+                part = parts[min(done, len(parts) - 1)]
+                return f"Thought: Do I need to use a tool? Yes\nAction: {scripted_tool(part)}\nAction Input: {part}"
+            return f"Thought: Do I need to use a tool? No\nFinal Answer: Here is what the library has on {question}."
+        if "translating user questions into Cypher" in prompt:
+            return "MATCH (b:Book) RETURN b.title, b.publication_year, b.rating LIMIT 5"
+        return "A scripted answer drawn from the context."
+
+    @staticmethod
+    def plan(question):
+        # One step per part of the question; a part that refers back waits for the part before it.
+        steps = []
+        for i, part in enumerate(question_parts(question) or [question], start=1):
+            dependent = i > 1 and DEPENDENT_PART.search(part)
+            steps.append({"id": f"s{i}", "tool": scripted_tool(part),
+                          "input": f"{part} ({{s{i - 1}}})" if dependent else part,
+                          "depends_on": [f"s{i - 1}"] if dependent else []})
+        return json.dumps({"steps": steps})
+
+    def _tokens(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        # About four characters per token, as the chat app estimates them.
+        count("llm.prompt_tokens", len(prompt) // 4 + 1)
+        return re.findall(r"\S+\s*|\s+", self.respond(prompt))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+        backend_call("llm.call", self.latency)
+        tokens = self._tokens(messages)
+        time.sleep(self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+        await abackend_call("llm.call", self.latency)
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        backend_call("llm.call", self.latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await abackend_call("llm.call", self.latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def text_vector(text, dimensions):
+    """
+    Returns a deterministic unit vector for a text.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return vector / np.linalg.norm(vector)
+
+
+class DeterministicEmbeddings(Embeddings):
+    """
+    A stand-in for OpenAIEmbeddings: texts map to fixed random unit vectors. Every request waits
+    latency seconds and is counted as 'embeddings.call'.
+    """
+
+    dimensions = 256
+    latency = 0.0
+
+    def __init__(self, **kwargs):
+        pass
+
+    def embed_documents(self, texts):
+        backend_call("embeddings.call", self.latency)
+        return [text_vector(text, self.dimensions).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        await abackend_call("embeddings.call", self.latency)
+        return [text_vector(text, self.dimensions).tolist() for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class Record(dict):
+    def data(self):
+        return dict(self)
+
+
+class OfflineCatalogue:
+    """
+    The book graph and chat sessions behind the offline Neo4j stand-ins.
+
+    Queries are recognised by their text and answered from memory: the catalogue name lookups of the
+    router, the vector and hybrid plot search (an exact search over the summary vectors), the session
+    history queries, the catalogue version, and EXPLAIN and row fetches of the Cypher guard. Any other
+    query returns books matching the $e0 parameter as an author or a title, or a sample of books.
+    """
+
+    def __init__(self, books, dimensions, latency=0.0, seed=42):
+        """
+        Args:
+            books (list): Book dictionaries keyed by the CSV column names of benchmarks.catalogue.
+            dimensions (int): The dimensions of the summary vectors.
+            latency (float): The seconds every query waits.
+        """
+        self.books = books
+        self.latency = latency
+        self.by_title = {book["Title"]: book for book in books}
+        self.by_author = {}
+        for book in books:
+            self.by_author.setdefault(book["Author"], []).append(book)
+        self.genres = sorted({genre.strip() for book in books for genre in book["Genre"].split(",")})
+        self.vectors = np.stack([text_vector(book["Summary"], dimensions) for book in books]).astype(np.float32)
+        self.sessions = {}
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def row(book):
+        authors = [book["Author"]]
+        genres = [genre.strip() for genre in book["Genre"].split(",")]
+        values = {"title": book["Title"], "publication_year": book["Publication Year"], "rating": book["Ratings"],
+                  "summary": book["Summary"]}
+        row = Record({f"{alias}.{key}": value for alias in ("b", "b2") for key, value in values.items()})
+        row.update({"a.name": book["Author"], "authors": authors, "genres": genres})
+        return row
+
+    def search(self, embedding, k):
+        scores = self.vectors @ np.asarray(embedding, dtype=np.float32)
+        best = np.argsort(-scores)[:k]
+        return [Record(text=self.books[i]["Summary"], score=float((1 + scores[i]) / 2),
+                       metadata={"book_title": self.books[i]["Title"], "author": [self.books[i]["Author"]]})
+                for i in best]
+
+    def answer(self, query, params):
+        """
+        Returns the records of a query.
+        """
+        text = getattr(query, "text", query)
+        if "RETURN a.name AS name" in text:
+            return [Record(name=name) for name in self.by_author]
+        if "RETURN g.name AS name" in text:
+            return [Record(name=name) for name in self.genres]
+        if "RETURN b.title AS name" in text:
+            return [Record(name=book["Title"]) for book in self.books]
+        if "db.index.vector.queryNodes" in text:
+            return self.search(params["embedding"], params["k"])
+        if "IngestMeta" in text and "m.version" in text:
+            return [Record(version="offline")]
+        if text.lstrip().startswith(("CREATE", "SHOW", "DROP")):
+            return []
+        if "Session" in text:
+            return self.session_query(text, params)
+        e0 = params.get("e0")
+        with self._lock:
+            if e0 in self.by_author:
+                books = self.by_author[e0]
+            elif e0 in self.by_title:
+                books = [self.by_title[e0]]
+            else:
+                books = self.rng.sample(self.books, min(5, len(self.books)))
+        return [self.row(book) for book in books]
+
+    def session_query(self, text, params):
+        with self._lock:
+            session = self.sessions.setdefault(params["session_id"], {"messages": [], "summary": None, "summarized": 0})
+            if "DETACH DELETE m, s" in text:
+                self.sessions.pop(params["session_id"])
+                return []
+            if "DETACH DELETE" in text:
+                session.update(messages=[], summary=None, summarized=0)
+                return []
+            if text.lstrip().startswith("MERGE"):
+                session["messages"].append({"type": params["type"], "data": {"content": params["content"]}})
+                return [Record(count=len(session["messages"]), summarized=session["summarized"])]
+            window = int(re.search(r"NEXT\*0\.\.(\d+)", text).group(1)) + 1 if "NEXT*0.." in text else 0
+            if "s.summary = $summary" in text:
+                if session["summarized"] != params["summarized"]:
+                    return [Record(updated=0)]
+                session.update(summary=params["summary"], summarized=params["stop"])
+                return [Record(updated=1)]
+            if "messageCount AS count" in text:
+                return [Record(summary=session["summary"], count=len(session["messages"]),
+                               summarized=session["summarized"], messages=session["messages"][-window:])]
+            return [Record(summary=session["summary"], messages=session["messages"][-window:] if window else [])]
+
+
+class _Summary:
+    plan = {"operatorType": "ProduceResults@neo4j", "args": {"EstimatedRows": 1.0}, "children": []}
+
+
+class _Result:
+    def __init__(self, records):
+        self.records = records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def consume(self):
+        return _Summary()
+
+
+class _AsyncResult(_Result):
+    async def consume(self):
+        return _Summary()
+
+    async def fetch(self, n):
+        return self.records[:n]
+
+
+class OfflineSession:
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        backend_call("neo4j.query", self.catalogue.latency)
+        text = getattr(query, "text", query)
+        if text.startswith("EXPLAIN"):
+            return _Result([])
+        return _Result(self.catalogue.answer(text, dict(parameters or {}, **kwargs)))
+
+    def execute_read(self, work, *args, **kwargs):
+        return work(self, *args, **kwargs)
+
+    execute_write = execute_read
+
+
+class OfflineAsyncSession(OfflineSession):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run(self, query, parameters=None, **kwargs):
+        await abackend_call("neo4j.query", self.catalogue.latency)
+        text = getattr(query, "text", query)
+        if text.startswith("EXPLAIN"):
+            return _AsyncResult([])
+        return _AsyncResult(self.catalogue.answer(text, dict(parameters or {}, **kwargs)))
+
+    async def execute_read(self, work, *args, **kwargs):
+        return await work(self, *args, **kwargs)
+
+    execute_write = execute_read
+
+
+def _query_parameters(parameters, kwargs):
+    return dict(parameters or kwargs.pop("parameters_", None) or {},
+                **{key: value for key, value in kwargs.items() if not key.endswith("_")})
+
+
+class OfflineDriver:
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+
+    def execute_query(self, query, parameters=None, **kwargs):
+        backend_call("neo4j.query", self.catalogue.latency)
+        return self.catalogue.answer(query, _query_parameters(parameters, kwargs)), None, None
+
+    def session(self, **kwargs):
+        return OfflineSession(self.catalogue)
+
+    def verify_connectivity(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class OfflineAsyncDriver:
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+
+    async def execute_query(self, query, parameters=None, **kwargs):
+        await abackend_call("neo4j.query", self.catalogue.latency)
+        return self.catalogue.answer(query, _query_parameters(parameters, kwargs)), None, None
+
+    def session(self, **kwargs):
+        return OfflineAsyncSession(self.catalogue)
+
+    async def verify_connectivity(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class OfflineGraph(StubGraph):
+    """
+    Mimics Neo4jGraph on top of an OfflineCatalogue.
+    """
+
+    catalogue = None
+
+    def __init__(self, url=None, username=None, password=None, refresh_schema=True, **kwargs):
+        super().__init__(refresh_schema=refresh_schema)
+        self._driver = OfflineDriver(self.catalogue)
+
+    def query(self, query, params=None):
+        return [record.data() for record in self._driver.execute_query(query, params or {})[0]]
+
+    def refresh_schema(self):
+        backend_call("graph.refresh_schema", self.latency)
+        self.schema = ("Node properties: Book {title: STRING, summary: STRING, rating: FLOAT, publication_year: INTEGER}, "
+                       "Author {name: STRING}, Genre {name: STRING}\n"
+                       "Relationships: (:Book)-[:WRITTEN_BY]->(:Author), (:Book)-[:HAS_GENRE]->(:Genre)")
+
+
+def install_offline_backends(llm_latency=0.0, token_latency=0.0, embedding_latency=0.0, query_latency=0.0,
+                             books=None, dimensions=256, tool_calls=1, offline_graph=True):
+    """
+    Replaces ChatOpenAI with ScriptedChatModel and OpenAIEmbeddings with DeterministicEmbeddings and,
+    with offline_graph, Neo4jGraph and the Neo4j async driver with stand-ins over an OfflineCatalogue
+    of the given books. Must run before the chat modules are imported.
+
+    Returns:
+        OfflineCatalogue: The catalogue, or None without offline_graph.
+    """
+    import langchain_community.graphs
+    import langchain_openai
+
+    ScriptedChatModel.defaults = {"latency": llm_latency, "token_latency": token_latency, "tool_calls": tool_calls}
+    DeterministicEmbeddings.latency = embedding_latency
+    DeterministicEmbeddings.dimensions = dimensions
+    langchain_openai.ChatOpenAI = ScriptedChatModel
+    langchain_openai.OpenAIEmbeddings = DeterministicEmbeddings
+    if not offline_graph:
+        return None
+
+    from neo4j import AsyncGraphDatabase
+
+    catalogue = OfflineCatalogue(books or [], dimensions, latency=query_latency)
+    OfflineGraph.catalogue = catalogue
+    langchain_community.graphs.Neo4jGraph = OfflineGraph
+    AsyncGraphDatabase.driver = staticmethod(lambda *args, **kwargs: OfflineAsyncDriver(catalogue))
+    return catalogue
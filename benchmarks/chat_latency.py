@@ -0,0 +1,169 @@
+"""
+A multi-session load generator for the chat service: --sessions concurrent sessions each ask --turns
+questions through agent.agenerate_response on one event loop, like the chat API does, and the run
+reports per-turn p50/p95/p99 latency, LLM calls and prompt tokens per turn, throughput and peak RSS.
+
+No OpenAI key is needed: the chat model is a scripted ReAct model and the embeddings are deterministic
+(see benchmarks/chat_fakes.py), each waiting the configured latency. By default Neo4j is an in-process
+stand-in over a synthetic catalogue of --books books. With --neo4j the tools query the database
+configured through NEO4J_URI, NEO4J_USERNAME and NEO4J_PASSWORD instead; its plot embeddings must have
+--dimensions dimensions for the vector search to work. Sessions use a '__bench__' id prefix and are removed
+afterwards.
+
+Questions are drawn deterministically from the catalogue: titles, authors and summary words in a mix
+of fast-path and agent questions, so repeated runs send the same load.
+
+    python -m benchmarks.chat_latency --sessions 20 --turns 10 --books 1k --llm-latency 0.5
+    python -m benchmarks.chat_latency --sessions 50 --turns 5 --books 100k --output runs.jsonl
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import resource
+import sys
+import time
+from collections import Counter
+
+from benchmarks.catalogue import catalogue_size, synthetic_books
+from benchmarks.report import add_output_argument, emit, percentiles
+
+# The first three are answered by the fast-path router; the rest describe a book instead of naming it,
+# mention several kinds of names or refer back to earlier turns, so they go to the agent.
+TEMPLATES = [
+    "Which books did {author} write?",
+    "Recommend a {genre} book",
+    "What happens in {title}?",
+    "Tell me about the book where {summary_words}",
+    "Does {author} write {genre} books?",
+    "Is {title} a {genre} book?",
+    "Are there more books like it?",
+]
+
+
+def question_set(books, count, seed=11):
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        book = rng.choice(books)
+        words = book["Summary"].rstrip(".").lower().split()
+        questions.append(rng.choice(TEMPLATES).format(
+            title=book["Title"], author=book["Author"], genre=book["Genre"].split(",")[0],
+            summary_words=" ".join(words[5:15]),
+        ))
+    return questions
+
+
+async def run_session(agent, session_id, questions, think_time, turns):
+    from benchmarks.chat_fakes import turn_calls
+
+    for question in questions:
+        calls = Counter()
+        turn_calls.set(calls)
+        started = time.perf_counter()
+        try:
+            await agent.agenerate_response(question, session_id)
+            error = None
+        except Exception as e:
+            error = type(e).__name__
+        turns.append({"seconds": time.perf_counter() - started, "calls": calls, "error": error})
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def run_load(agent, questions, sessions, turns_per_session, think_time, prefix):
+    turns = []
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        run_session(agent, f"{prefix}{session}", questions[session * turns_per_session:(session + 1) * turns_per_session],
+                    think_time, turns)
+        for session in range(sessions)
+    ])
+    return turns, time.perf_counter() - started
+
+
+def summarize(turns, wall_seconds):
+    answered = [turn for turn in turns if turn["error"] is None]
+
+    def per_turn(name):
+        return round(sum(turn["calls"][name] for turn in answered) / len(answered), 2) if answered else None
+
+    return {
+        "turns": len(turns),
+        "errors": dict(Counter(turn["error"] for turn in turns if turn["error"])),
+        "wall_seconds": round(wall_seconds, 2),
+        "turns_per_sec": round(len(turns) / wall_seconds, 2),
+        "latency": percentiles([turn["seconds"] for turn in answered]),
+        "llm_calls_per_turn": per_turn("llm.call"),
+        "prompt_tokens_per_turn": per_turn("llm.prompt_tokens"),
+        "embedding_calls_per_turn": per_turn("embeddings.call"),
+        "neo4j_queries_per_turn": per_turn("neo4j.query"),
+        "turns_without_llm": sum(not turn["calls"]["llm.call"] for turn in answered),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5, help="questions per session")
+    parser.add_argument("--books", type=catalogue_size, default=1000, help="size of the synthetic catalogue")
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds before the first token of an LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per further token")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--query-latency", type=float, default=0.005, help="seconds per Neo4j query of the stand-in")
+    parser.add_argument("--tool-calls", type=int, default=1, help="tool calls the scripted agent makes per question")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds a session waits between turns")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--neo4j", action="store_true", help="query the configured Neo4j instead of the stand-in")
+    add_output_argument(parser)
+    args = parser.parse_args()
+
+    from benchmarks._paths import use_app
+    from benchmarks.chat_fakes import backend_calls, install_offline_backends
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("OPENAI_GEN_MODEL", "gpt-3.5-turbo")
+    os.environ.setdefault("EMBEDDING_MODEL", "text-embedding-3-small")
+    if args.no_cache:
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    books = list(synthetic_books(args.books))
+    install_offline_backends(llm_latency=args.llm_latency, token_latency=args.token_latency,
+                             embedding_latency=args.embedding_latency, query_latency=args.query_latency,
+                             books=books, dimensions=args.dimensions, tool_calls=args.tool_calls,
+                             offline_graph=not args.neo4j)
+    use_app("chat")
+    import agent
+    from graph import get_graph
+
+    prefix = "__bench__"
+    questions = question_set(books, args.sessions * args.turns)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        # The agent executor is verbose; its trace goes to stderr so stdout stays JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            turns, wall_seconds = asyncio.run(
+                run_load(agent, questions, args.sessions, args.turns, args.think_time, prefix))
+    finally:
+        if args.neo4j:
+            from benchmarks.chat_memory import cleanup
+
+            cleanup(get_graph(), prefix)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    results = summarize(turns, wall_seconds)
+    results.update({
+        "llm_calls_total": backend_calls["llm.call"],
+        "router": agent.get_router().stats.as_dict(),
+        "response_cache": agent.get_response_cache().stats(),
+        "baseline_rss_mb": round(baseline / 1024, 1),
+        "peak_rss_mb": round(peak / 1024, 1),
+    })
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    config["backend"] = "neo4j" if args.neo4j else "in-process"
+    emit("chat_latency", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Measures per-turn memory latency and chat-history prompt size over a long session, comparing
+a full replay of the session (Neo4jChatMessageHistory with an unbounded window) with the
+bounded, summarized SummarizedChatMessageHistory.
+
+Every turn reads the history, renders it as the agent prompt does and appends a question and
+an answer. The summarizer is a deterministic stand-in that keeps the last words of the summary,
+so no OpenAI key is needed. Runs against the Neo4j database configured through NEO4J_URI,
+NEO4J_USERNAME and NEO4J_PASSWORD; sessions use a '__bench__' id prefix and are removed afterwards.
+
+    python -m benchmarks.chat_memory --turns 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+
+from benchmarks._paths import use_app
+
+use_app("chat")
+
+from langchain_community.chat_message_histories import Neo4jChatMessageHistory  # noqa: E402
+from langchain_community.graphs import Neo4jGraph  # noqa: E402
+from langchain_core.messages import get_buffer_string  # noqa: E402
+
+from memory import SummarizedChatMessageHistory, estimate_tokens  # noqa: E402
+
+WORDS = ("book novel author genre story plot character chapter library read recommend fantasy "
+         "mystery history classic rating summary series sequel fiction poem").split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def truncating_summarizer(max_tokens):
+    def summarize(summary, messages):
+        text = " ".join(filter(None, [summary, get_buffer_string(messages)]))
+        return text[-4 * max_tokens:]
+    return summarize
+
+
+def run_session(history, turns, seed=7):
+    rng = random.Random(seed)
+    latencies, prompt_tokens = [], []
+    for _ in range(turns):
+        started = time.perf_counter()
+        prompt_tokens.append(estimate_tokens(get_buffer_string(history.messages)))
+        history.add_user_message(sentence(rng, 20))
+        history.add_ai_message(sentence(rng, 120))
+        latencies.append(time.perf_counter() - started)
+    return latencies, prompt_tokens
+
+
+def report(latencies, prompt_tokens, every):
+    decile = max(len(latencies) // 10, 1)
+    return {
+        "per_turn": [
+            {"turn": i + 1, "ms": round(latencies[i] * 1000, 2), "prompt_tokens": prompt_tokens[i]}
+            for i in range(0, len(latencies), every)
+        ] + [{"turn": len(latencies), "ms": round(latencies[-1] * 1000, 2), "prompt_tokens": prompt_tokens[-1]}],
+        "first_decile_mean_ms": round(statistics.mean(latencies[:decile]) * 1000, 2),
+        "last_decile_mean_ms": round(statistics.mean(latencies[-decile:]) * 1000, 2),
+        "max_prompt_tokens": max(prompt_tokens),
+    }
+
+
+def cleanup(graph, prefix):
+    graph.query("""
+    MATCH (s:Session) WHERE s.id STARTS WITH $prefix
+    OPTIONAL MATCH (s)-[:LAST_MESSAGE]->(last:Message)
+    OPTIONAL MATCH (last)<-[:NEXT*0..]-(m:Message)
+    DETACH DELETE m, s
+    """, {"prefix": prefix})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--window-turns", type=int, default=3)
+    parser.add_argument("--token-budget", type=int, default=1500)
+    parser.add_argument("--summary-tokens", type=int, default=300)
+    parser.add_argument("--every", type=int, default=25, help="report every n-th turn")
+    args = parser.parse_args()
+
+    prefix = "__bench__"
+    url, username, password = os.getenv("NEO4J_URI"), os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")
+    graph = Neo4jGraph(url=url, username=username, password=password, refresh_schema=False)
+    try:
+        # Neo4jChatMessageHistory closes its driver when collected, so it gets its own.
+        full = Neo4jChatMessageHistory(f"{prefix}{uuid.uuid4()}", url=url, username=username, password=password,
+                                       window=args.turns)
+        full_latencies, full_tokens = run_session(full, args.turns)
+
+        bounded = SummarizedChatMessageHistory(
+            f"{prefix}{uuid.uuid4()}", graph, summarizer=truncating_summarizer(args.summary_tokens),
+            window_turns=args.window_turns, token_budget=args.token_budget,
+        )
+        bounded_latencies, bounded_tokens = run_session(bounded, args.turns)
+
+        print(json.dumps({
+            "turns": args.turns,
+            "window_turns": args.window_turns,
+            "token_budget": args.token_budget,
+            "full_replay": report(full_latencies, full_tokens, args.every),
+            "summarized": report(bounded_latencies, bounded_tokens, args.every),
+        }, indent=2))
+    finally:
+        cleanup(graph, prefix)
+        graph._driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures how long importing the chat agent takes and what the first request pays to create the
+LLM, graph, vector-store and agent singletons, with Neo4j and the vector index replaced by stubs
+that sleep --latency seconds per connection, schema introspection or index probe.
+
+No backend call should happen at import time; the cold start pays for each one once and a warm
+call pays for none. Every measurement runs in a fresh interpreter.
+
+    python -m benchmarks.cold_start --latency 0.5 --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def run_single(latency):
+    from benchmarks._paths import use_app
+    from benchmarks.chat_fakes import backend_calls, install_backend_stubs
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("OPENAI_GEN_MODEL", "gpt-3.5-turbo")
+    os.environ.setdefault("EMBEDDING_MODEL", "text-embedding-3-small")
+    install_backend_stubs(latency)
+    use_app("chat")
+
+    started = time.perf_counter()
+    import agent
+    from tools.cypher import get_cypher_chain
+    from tools.vector import get_plot_retriever
+    import_seconds = time.perf_counter() - started
+    import_calls = dict(backend_calls)
+
+    started = time.perf_counter()
+    agent.get_chat_agent()
+    agent.get_router()
+    get_plot_retriever()
+    get_cypher_chain()
+    cold_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    agent.get_chat_agent()
+    warm_seconds = time.perf_counter() - started
+
+    return {
+        "import_seconds": import_seconds,
+        "cold_start_seconds": cold_seconds,
+        "warm_seconds": warm_seconds,
+        "backend_calls_at_import": sum(import_calls.values()),
+        "backend_calls_at_cold_start": sum(backend_calls.values()) - sum(import_calls.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per stubbed backend call")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.latency)))
+        return
+
+    runs = []
+    for _ in range(args.repeat):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.cold_start", "--single", "--latency", str(args.latency)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(json.dumps({
+        "latency_per_backend_call": args.latency,
+        "runs": args.repeat,
+        **{key: round(statistics.median(run[key] for run in runs), 3) for key in runs[0]},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
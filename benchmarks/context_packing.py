@@ -0,0 +1,134 @@
+"""
+Measures what context packing (chat/context_packing.py) does to the answering prompts of the plot
+search and Cypher tools: prompt tokens per question with packing off and on, and spot checks that the
+packed context still holds what the answer needs.
+
+Runs offline on a synthetic catalogue with --summary-words long summaries. Plot questions quote a
+few summary words of a book; that book and --k - 1 others, in falling score order, stand in for
+the retrieval. Cypher questions ask for the books of an author and get the rows of the BOOKS_BY_AUTHOR
+template, capped at CYPHER_MAX_ROWS as the guard does. The spot checks are:
+
+- plot_target_kept: the asked-about book is still in the context;
+- plot_evidence_kept: the share of the question's words found in that book's packed summary;
+- cypher_titles_kept: the share of the result titles still in the table.
+
+With --show, the first packed contexts are included in the report for reading.
+
+    python -m benchmarks.context_packing --books 2000 --questions 100 --summary-words 250
+"""
+import argparse
+import os
+import random
+import statistics
+
+from benchmarks._paths import use_app
+from benchmarks.catalogue import catalogue_size, synthetic_books
+from benchmarks.report import add_output_argument, emit
+
+use_app("chat")
+
+from langchain_community.chains.graph_qa.prompts import CYPHER_QA_PROMPT  # noqa: E402
+from langchain_core.documents import Document  # noqa: E402
+
+from context_packing import content_words  # noqa: E402
+from memory import estimate_tokens  # noqa: E402
+from tools.cypher import pack_cypher_rows  # noqa: E402
+from tools.vector import pack_plots, prompt as plot_prompt  # noqa: E402
+
+
+def retrieve(books, target, k, rng):
+    # The synthetic summaries share one small vocabulary, so word overlap cannot find the asked-about
+    # book; it is put first, as a working retriever would.
+    others = [book for book in rng.sample(books, min(k, len(books))) if book is not target][:k - 1]
+    return [Document(page_content=book["Summary"],
+                     metadata={"book_title": book["Title"], "author": [book["Author"]], "score": 0.9 - 0.05 * rank})
+            for rank, book in enumerate([target] + others)]
+
+
+def author_rows(books_by_author, author, max_rows):
+    return [{"b.title": book["Title"], "b.publication_year": book["Publication Year"], "b.rating": book["Ratings"],
+             "a.name": author, "b.summary": book["Summary"]} for book in books_by_author[author][:max_rows]]
+
+
+def plot_prompt_tokens(question, documents):
+    # create_stuff_documents_chain joins the page contents with blank lines.
+    context = "\n\n".join(document.page_content for document in documents)
+    return sum(estimate_tokens(message.content) for message in plot_prompt.format_messages(input=question, context=context))
+
+
+def measure(packing, books, books_by_author, questions, k, max_rows, show):
+    os.environ["CONTEXT_PACKING"] = "1" if packing else "0"
+    rng = random.Random(3)
+    plot_tokens, cypher_tokens, target_kept, evidence_kept, titles_kept, samples = [], [], [], [], [], []
+    for item in questions:
+        documents = pack_plots(item["question"], retrieve(books, item["book"], k, rng))
+        plot_tokens.append(plot_prompt_tokens(item["question"], documents))
+        target = [document for document in documents if document.metadata["book_title"] == item["title"]]
+        target_kept.append(bool(target))
+        evidence = content_words(target[0].page_content) if target else set()
+        evidence_kept.append(len(item["words"] & evidence) / (len(item["words"]) or 1))
+
+        rows = author_rows(books_by_author, item["author"], max_rows)
+        context = pack_cypher_rows(rows)
+        cypher_tokens.append(estimate_tokens(CYPHER_QA_PROMPT.format(question=item["cypher_question"], context=context)))
+        titles_kept.append(sum(row["b.title"] in str(context) for row in rows) / len(rows))
+        if len(samples) < show:
+            samples.append({"question": item["question"], "plot_context": [document.page_content for document in documents],
+                            "cypher_question": item["cypher_question"], "cypher_context": str(context)})
+
+    results = {
+        "plot_prompt_tokens_mean": round(statistics.mean(plot_tokens), 1),
+        "plot_prompt_tokens_max": max(plot_tokens),
+        "cypher_prompt_tokens_mean": round(statistics.mean(cypher_tokens), 1),
+        "cypher_prompt_tokens_max": max(cypher_tokens),
+        "plot_target_kept": round(statistics.mean(target_kept), 3),
+        "plot_evidence_kept": round(statistics.mean(evidence_kept), 3),
+        "cypher_titles_kept": round(statistics.mean(titles_kept), 3),
+    }
+    if samples:
+        results["samples"] = samples
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=catalogue_size, default=2000)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--summary-words", type=int, default=250)
+    parser.add_argument("--k", type=int, default=4, help="plot documents per question")
+    parser.add_argument("--show", type=int, default=0, help="packed contexts to include in the report")
+    add_output_argument(parser)
+    args = parser.parse_args()
+
+    books = list(synthetic_books(args.books, summary_words=args.summary_words))
+    books_by_author = {}
+    for book in books:
+        books_by_author.setdefault(book["Author"], []).append(book)
+
+    rng = random.Random(7)
+    questions = []
+    for book in rng.sample(books, min(args.questions, len(books))):
+        words = book["Summary"].rstrip(".").split()
+        start = rng.randrange(0, max(len(words) - 12, 1))
+        quoted = " ".join(words[start:start + 12]).replace(".", "")
+        questions.append({"question": f"Which book is about {quoted}?", "book": book, "title": book["Title"],
+                          "words": content_words(quoted), "author": book["Author"],
+                          "cypher_question": f"Which books did {book['Author']} write?"})
+
+    max_rows = int(os.getenv("CYPHER_MAX_ROWS", 10))
+    before = measure(False, books, books_by_author, questions, args.k, max_rows, args.show)
+    after = measure(True, books, books_by_author, questions, args.k, max_rows, args.show)
+    results = {
+        "before": before,
+        "after": after,
+        "plot_token_reduction": round(1 - after["plot_prompt_tokens_mean"] / before["plot_prompt_tokens_mean"], 3),
+        "cypher_token_reduction": round(1 - after["cypher_prompt_tokens_mean"] / before["cypher_prompt_tokens_mean"], 3),
+    }
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    config.update(plot_context_tokens=int(os.getenv("PLOT_CONTEXT_TOKENS", 800)),
+                  cypher_context_tokens=int(os.getenv("CYPHER_CONTEXT_TOKENS", 600)), cypher_max_rows=max_rows)
+    emit("context_packing", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Recall@k against memory for the compact embedding storage options of ingestion: plot vectors
+truncated to their first dimensions (Matryoshka-style) or projected with PCA, each optionally
+rescored with int8 or float16 copies of the full-width embeddings.
+
+For every option the report gives the recall of the k books an exact full-width float32 search
+returns, and the bytes per book of the vector Neo4j stores and indexes and of the rescore vector.
+The searches are exact, so the numbers isolate what the compression loses: the summaryPlots index
+or the local plot index can only lose more. Rescoring takes --rescore-candidates times k
+candidates from the reduced vectors and reorders them by full-width similarity, as the local plot
+index does. 'first_below_min_recall' names, per option, the widest reduction whose recall falls
+below --min-recall: where quality starts to drop.
+
+The projection and the encoding are those of shared/embedding_projection.py. Embeddings come
+from an ingestion sidecar (books.embeddings.npy next to the CSV) with --sidecar, or are synthetic:
+clustered vectors whose variance decays over the dimensions like that of a Matryoshka-trained model;
+--layout rotated spreads it over all dimensions, like a model without that training, where truncation
+should fall behind PCA. Queries are catalogue vectors with --noise added.
+
+    python -m benchmarks.embedding_compression --books 20000 --dimensions 1536 --widths 768 512 256 128 64
+    python -m benchmarks.embedding_compression --sidecar books.embeddings.npy --k 4
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.catalogue import catalogue_size
+from benchmarks.report import add_output_argument, emit
+from shared.embedding_projection import EmbeddingProjection, encode_rescore_vector
+
+
+def synthetic_embeddings(books, dimensions, layout, seed=7):
+    rng = np.random.default_rng(seed)
+    decay = np.arange(1, dimensions + 1, dtype=np.float32) ** -0.6
+    centres = rng.standard_normal((64, dimensions)).astype(np.float32) * decay
+    vectors = centres[rng.integers(0, 64, books)] + 0.7 * rng.standard_normal((books, dimensions)).astype(np.float32) * decay
+    if layout == "rotated":
+        rotation, _ = np.linalg.qr(rng.standard_normal((dimensions, dimensions)))
+        vectors = vectors @ rotation.astype(np.float32)
+    return vectors
+
+
+def sidecar_embeddings(path, books):
+    vectors = np.load(path, mmap_mode="r")
+    vectors = np.asarray(vectors[:books] if books else vectors, dtype=np.float32)
+    # Rows of the sidecar that were never embedded are all zeros.
+    return vectors[np.linalg.norm(vectors, axis=1) > 0]
+
+
+def normalized(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(scores, k):
+    rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(rows, np.argsort(-np.take_along_axis(scores, rows, axis=1), axis=1), axis=1)
+
+
+def decoded(vectors, precision):
+    # What the rescoring sees: the vectors after a round trip through the stored encoding.
+    blobs = [encode_rescore_vector(vector, precision) for vector in vectors]
+    if precision == "float16":
+        return np.stack([np.frombuffer(blob, dtype="<f2", offset=1) for blob in blobs]).astype(np.float32)
+    scales = np.array([np.frombuffer(blob, dtype="<f4", count=1, offset=1)[0] for blob in blobs], dtype=np.float32)
+    return np.stack([np.frombuffer(blob, dtype=np.int8, offset=5) for blob in blobs]).astype(np.float32) * scales[:, None]
+
+
+def recall(found, truth):
+    return round(float(np.mean([len(set(row) & expected) / len(expected) for row, expected in zip(found, truth)])), 4)
+
+
+def evaluate(catalogue, queries, truth, projection, rescore, k, candidates):
+    stored = projection.transform(catalogue) if projection else catalogue
+    query_vectors = projection.transform(queries) if projection else queries
+    found = top_k(query_vectors @ stored.T, candidates if rescore is not None else k)
+    if rescore is not None:
+        exact = np.einsum("qcd,qd->qc", rescore[found], queries)
+        found = np.take_along_axis(found, np.argsort(-exact, axis=1)[:, :k], axis=1)
+    return recall(found, truth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=catalogue_size, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536, help="width of the synthetic embeddings")
+    parser.add_argument("--layout", choices=("matryoshka", "rotated"), default="matryoshka")
+    parser.add_argument("--sidecar", help="an ingestion sidecar .npy to take the embeddings from")
+    parser.add_argument("--widths", type=int, nargs="+", default=[1024, 768, 512, 256, 128, 64])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--noise", type=float, default=0.05, help="norm of the noise added to the unit query vectors")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--rescore-candidates", type=int, default=4, help="candidates per result that are rescored")
+    parser.add_argument("--sample", type=int, default=10_000, help="vectors the PCA is fitted on")
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    add_output_argument(parser)
+    args = parser.parse_args()
+
+    catalogue = (sidecar_embeddings(args.sidecar, args.books) if args.sidecar
+                 else synthetic_embeddings(args.books, args.dimensions, args.layout))
+    catalogue = normalized(catalogue)
+    books, dimensions = catalogue.shape
+    rng = np.random.default_rng(11)
+    queries = catalogue[rng.choice(books, size=min(args.queries, books), replace=False)]
+    queries = normalized(queries + args.noise / np.sqrt(dimensions) * rng.standard_normal(queries.shape).astype(np.float32))
+    truth = [set(row) for row in top_k(queries @ catalogue.T, args.k).tolist()]
+    rescores = {precision: decoded(catalogue, precision) for precision in ("float16", "int8")}
+    rescore_bytes = {None: 0, "float16": 1 + 2 * dimensions, "int8": 5 + dimensions}
+    candidates = args.k * args.rescore_candidates
+
+    rows = []
+    full_recall = evaluate(catalogue, queries, truth, None, None, args.k, candidates)
+    rows.append({"method": "none", "width": dimensions, "rescore": None, "recall_at_k": full_recall,
+                 "stored_bytes_per_book": dimensions * 4, "rescore_bytes_per_book": 0,
+                 "total_mb": round(books * dimensions * 4 / 2 ** 20, 1)})
+    for method in ("truncate", "pca"):
+        for width in sorted((width for width in args.widths if width < dimensions), reverse=True):
+            if method == "pca" and width > min(args.sample, books):
+                continue
+            projection = EmbeddingProjection.fit(method, width, catalogue[:args.sample])
+            for precision in (None, "float16", "int8"):
+                option_recall = evaluate(catalogue, queries, truth, projection, rescores.get(precision), args.k, candidates)
+                per_book = width * 4 + rescore_bytes[precision]
+                rows.append({"method": method, "width": width, "rescore": precision, "recall_at_k": option_recall,
+                             "stored_bytes_per_book": width * 4, "rescore_bytes_per_book": rescore_bytes[precision],
+                             "total_mb": round(books * per_book / 2 ** 20, 1)})
+
+    first_below = {}
+    for row in rows[1:]:
+        option = f"{row['method']}" + (f"+{row['rescore']}" if row["rescore"] else "")
+        if option not in first_below and row["recall_at_k"] < args.min_recall:
+            first_below[option] = row["width"]
+    results = {"books": books, "dimensions": dimensions, "options": rows, "first_below_min_recall": first_below}
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    config["source"] = args.sidecar or f"synthetic/{args.layout}"
+    emit("embedding_compression", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares one-request-per-text embedding with the bulk, concurrent get_embeddings path of
+OpenAIEmbeddingConnecton. By default it starts the local fake embeddings server, so no
+OpenAI key is needed; pass --base-url to measure a real endpoint instead.
+
+    python -m benchmarks.embedding_throughput --texts 500 --latency 0.05 --rate-limit-every 7
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks._paths import use_app
+from benchmarks.fake_openai_server import serve
+
+use_app("download_data")
+
+from openai_embedding_connection import OpenAIEmbeddingConnecton  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--base-url", default=None)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = serve(latency=args.latency, rate_limit_every=args.rate_limit_every)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    texts = [f"A synthetic plot summary number {i} about a lost dog finding its way home." for i in range(args.texts)]
+    connection = OpenAIEmbeddingConnecton(
+        os.getenv("OPENAI_API_KEY", "fake-key"),
+        os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"),
+        base_url=base_url,
+        max_workers=args.workers,
+        max_batch_size=args.batch_size,
+        backoff_base=0.05,
+    )
+    try:
+        started = time.perf_counter()
+        serial = [connection.get_embedding(text) for text in texts]
+        serial_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        bulk = connection.get_embeddings(texts)
+        bulk_seconds = time.perf_counter() - started
+
+        print(json.dumps({
+            "texts": args.texts,
+            "serial": {"seconds": round(serial_seconds, 3), "texts_per_sec": round(args.texts / serial_seconds, 1)},
+            "bulk": {"seconds": round(bulk_seconds, 3), "texts_per_sec": round(args.texts / bulk_seconds, 1)},
+            "same_order": serial == bulk,
+            "rate_limited_requests": server.stats["rate_limited"] if server else None,
+        }, indent=2))
+    finally:
+        if server:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Measures the entity index of the chat app (chat/entity_index.py): its build time and memory and the
+latency of exact, prefix and fuzzy lookups for --names names, and how many Cypher questions with
+misspelled, differently cased or unaccented names would come back empty with and without entity
+resolution.
+
+Names are synthetic: authors made of random syllables, some with diacritics, titles of two to four
+such words and English words, and the genres of benchmarks/catalogue.py. Lookups are timed one by
+one in microseconds:
+
+- exact: a stored name with random case and its diacritics removed;
+- prefix: the first four characters of a stored name;
+- fuzzy: a stored name with one typo (a deleted, inserted, replaced or swapped letter), resolved with
+  EntityIndex.resolve, which also reports the share resolved to the right name;
+- miss: a made-up name, with the share wrongly resolved to a stored one.
+
+The empty-result part asks --questions questions about the first --books books of the catalogue, each
+mentioning a name exactly as stored, in lowercase, in uppercase, without diacritics or with a typo.
+Cypher matches names exactly, so without resolution a query comes back empty unless the question
+spells the name as stored (the generating LLM copies names from the question); with resolution it
+uses the name that resolve_question of tools/cypher.py put in the question's parameters. Every empty
+result costs the agent about three more LLM calls: another reasoning step, Cypher generation and an
+answer.
+
+    python -m benchmarks.entity_resolution --names 1M --lookups 2000
+    python -m benchmarks.entity_resolution --names 100k --questions 1000
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+import unicodedata
+
+from benchmarks._paths import use_app
+from benchmarks.catalogue import GENRES, WORDS, catalogue_size
+from benchmarks.report import add_output_argument, emit
+
+use_app("chat")
+
+from entity_index import EntityIndex, fold  # noqa: E402
+from tools.cypher import resolve_question  # noqa: E402
+
+ONSETS = ["", "b", "br", "c", "ch", "d", "dr", "f", "g", "gr", "h", "j", "k", "l", "m", "n", "p", "pr", "r", "s",
+          "sh", "st", "t", "th", "tr", "v", "w", "z"]
+VOWELS = ["a", "e", "i", "o", "u", "y", "ea", "ou", "ai", "é", "ö", "å", "ü", "ñ"]
+CODAS = ["", "", "n", "r", "l", "s", "t", "m", "nd", "rt", "ck", "ng", "x"]
+SYLLABLES = [onset + vowel + coda for onset in ONSETS for vowel in VOWELS for coda in CODAS
+             if not (vowel == "ñ" and (onset or coda))]
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+VARIANTS = ("exact", "lowercase", "uppercase", "unaccented", "typo")
+TEMPLATES = {
+    "author": "Which books did {name} write?",
+    "title": 'Tell me about "{name}"',
+    "genre": "Recommend a top rated {name} book",
+}
+
+
+def word(rng, syllables):
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+def synthetic_names(count, seed=3):
+    """
+    Returns about count distinct names: a fifth authors, the rest titles, and the genres.
+    """
+    rng = random.Random(seed)
+    authors, titles = set(), set()
+    while len(authors) < count // 5:
+        authors.add(f"{word(rng, rng.randint(1, 3))} {word(rng, rng.randint(2, 3))}")
+    while len(titles) < count - len(authors):
+        words = [word(rng, rng.randint(1, 3)) if rng.random() < 0.6 else rng.choice(WORDS).capitalize()
+                 for _ in range(rng.randint(2, 4))]
+        titles.add(("The " if rng.random() < 0.3 else "") + " ".join(words))
+    return {"author": sorted(authors), "title": sorted(titles), "genre": list(GENRES)}
+
+
+def unaccented(text):
+    return "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+
+
+def typo(rng, name):
+    # One edit away from the name, never on its first letter or a space.
+    positions = [i for i, char in enumerate(name) if i and char.isalpha()]
+    i = rng.choice(positions)
+    edit = rng.choice(("delete", "insert", "replace", "swap"))
+    if edit == "delete":
+        return name[:i] + name[i + 1:]
+    if edit == "insert":
+        return name[:i] + rng.choice(LETTERS) + name[i:]
+    if edit == "replace":
+        return name[:i] + rng.choice([letter for letter in LETTERS if letter != name[i].lower()]) + name[i + 1:]
+    if i + 1 < len(name) and name[i + 1].isalpha() and name[i + 1] != name[i]:
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    return name[:i] + name[i + 1:]
+
+
+def variant(rng, name, kind):
+    if kind == "lowercase":
+        return name.lower()
+    if kind == "uppercase":
+        return name.upper()
+    if kind == "unaccented":
+        return unaccented(name)
+    if kind == "typo":
+        return typo(rng, name)
+    return name
+
+
+def timed(function, inputs):
+    """
+    Calls function on every input and returns the results and the p50, p99 and max time in microseconds.
+    """
+    results, micros = [], []
+    for value in inputs:
+        started = time.perf_counter()
+        results.append(function(value))
+        micros.append((time.perf_counter() - started) * 1e6)
+    micros.sort()
+    return results, {"p50_us": round(micros[len(micros) // 2], 1), "p99_us": round(micros[int(len(micros) * 0.99)], 1),
+                     "mean_us": round(statistics.mean(micros), 1), "max_us": round(micros[-1], 1)}
+
+
+def lookups(index, names, count, rng):
+    stored = [(kind, name) for kind in ("author", "title") for name in rng.sample(names[kind], count // 2)]
+    results = {}
+
+    def random_case(name):
+        return "".join(char.upper() if rng.random() < 0.5 else char.lower() for char in unaccented(name))
+
+    found, results["exact"] = timed(index.lookup, [random_case(name) for _, name in stored])
+    results["exact"]["found"] = round(sum(match == expected for match, expected in zip(found, stored)) / len(stored), 3)
+    found, results["prefix"] = timed(index.prefix, [fold(name)[:4] for _, name in stored])
+    results["prefix"]["found"] = round(sum(expected in match or len(match) == 10
+                                           for match, expected in zip(found, stored)) / len(stored), 3)
+    found, results["fuzzy"] = timed(index.resolve, [typo(rng, name) for _, name in stored])
+    results["fuzzy"]["resolved_correctly"] = round(
+        sum(match is not None and match[:2] == expected for match, expected in zip(found, stored)) / len(stored), 3)
+    found, results["miss"] = timed(index.resolve, [f"{word(rng, 4)} {word(rng, 4)} {word(rng, 3)}" for _ in stored])
+    results["miss"]["wrongly_resolved"] = round(sum(match is not None for match in found) / len(found), 3)
+    return results
+
+
+def empty_results(index, names, books, count, rng):
+    stored = {kind: set(values) for kind, values in names.items()}
+    by_variant = {name: {"questions": 0, "empty_before": 0, "empty_after": 0, "wrong_after": 0} for name in VARIANTS}
+    for i in range(count):
+        kind = ("author", "title", "genre")[i % 3]
+        name = rng.choice(names[kind][:books] if kind != "genre" else names[kind])
+        kind_of_variant = VARIANTS[(i // 3) % len(VARIANTS)]
+        typed = variant(rng, name, kind_of_variant)
+        question = TEMPLATES[kind].format(name=typed)
+        _, _, params, _ = resolve_question(question, index)
+        counts = by_variant[kind_of_variant]
+        counts["questions"] += 1
+        # Without resolution the query uses the name as typed; with it, the resolved parameter.
+        counts["empty_before"] += typed not in stored[kind]
+        if name not in params.values():
+            if any(value in stored[kind] for value in params.values()):
+                counts["wrong_after"] += 1
+            else:
+                counts["empty_after"] += 1
+
+    total = {key: sum(counts[key] for counts in by_variant.values()) for key in next(iter(by_variant.values()))}
+    return {
+        "by_variant": by_variant,
+        "empty_rate_before": round(total["empty_before"] / total["questions"], 3),
+        "empty_rate_after": round(total["empty_after"] / total["questions"], 3),
+        "wrong_rate_after": round(total["wrong_after"] / total["questions"], 3),
+        "retries_avoided_per_100_questions": round(100 * (total["empty_before"] - total["empty_after"]) / total["questions"], 1),
+        "llm_calls_saved_per_100_questions": round(300 * (total["empty_before"] - total["empty_after"]) / total["questions"], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--names", type=catalogue_size, default=1_000_000, help="names in the index")
+    parser.add_argument("--lookups", type=int, default=2000, help="timed lookups of every kind")
+    parser.add_argument("--questions", type=int, default=1500)
+    parser.add_argument("--books", type=int, default=20000, help="catalogue names the questions are drawn from")
+    add_output_argument(parser)
+    args = parser.parse_args()
+
+    names = synthetic_names(args.names)
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = EntityIndex(names)
+    build_seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rng = random.Random(9)
+    results = {
+        "names": len(index),
+        "build_seconds": round(build_seconds, 2),
+        "index_mb": round(index.nbytes() / 2 ** 20, 1),
+        "build_peak_mb": round(peak / 2 ** 20, 1),
+        "lookups": lookups(index, names, args.lookups, rng),
+        "cypher_questions": empty_results(index, names, args.books, args.questions, rng),
+    }
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    config["min_similarity"] = index.min_similarity
+    emit("entity_resolution", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
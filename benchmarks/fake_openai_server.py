@@ -0,0 +1,117 @@
+"""
+A local stand-in for the OpenAI embeddings endpoint.
+
+It returns deterministic vectors derived from the input text, can add artificial latency and
+can answer every n-th request with HTTP 429 to exercise retry and backoff logic. Point an
+OpenAI client at it with ``base_url="http://127.0.0.1:8089/v1"``.
+
+    python -m benchmarks.fake_openai_server --port 8089 --latency 0.2 --rate-limit-every 5
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_embedding(text, dimensions):
+    """
+    Returns a deterministic unit vector for a text.
+    """
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        stats = self.server.stats
+        with stats["lock"]:
+            stats["requests"] += 1
+            request_number = stats["requests"]
+
+        every = self.server.rate_limit_every
+        if every and request_number % every == 0:
+            with stats["lock"]:
+                stats["rate_limited"] += 1
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                       headers={"retry-after": "0.05"})
+            return
+
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with stats["lock"]:
+            stats["inputs"] += len(inputs)
+
+        dimensions = body.get("dimensions") or self.server.dimensions
+        tokens = sum(len(text) // 4 + 1 for text in inputs)
+        self._send(200, {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=0, dimensions=1536, latency=0.0, rate_limit_every=0):
+    """
+    Starts the fake server on a background thread and returns it.
+    The bound address is ``server.server_address``; call ``server.shutdown()`` to stop it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.dimensions = dimensions
+    server.latency = latency
+    server.rate_limit_every = rate_limit_every
+    server.stats = {"lock": threading.Lock(), "requests": 0, "inputs": 0, "rate_limited": 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.dimensions, args.latency, args.rate_limit_every)
+    print(f"Fake OpenAI server listening on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Deterministic, dependency-free stand-ins for the external services used by the benchmarks.
+"""
+import hashlib
+import random
+import threading
+import time
+
+
+def fake_vector(text, dimensions):
+    """
+    Returns a deterministic unit vector for a text.
+    """
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+
+class FakeEmbeddingConnection:
+    """
+    Mimics OpenAIEmbeddingConnecton with deterministic vectors and a configurable per-request latency.
+    """
+
+    def __init__(self, dimensions=1536, latency=0.0, model="fake-embedding"):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model = model
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def get_embedding(self, text):
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [fake_vector(text, self.dimensions) if isinstance(text, str) and text.strip() else None
+                for text in texts]
+
+
+class NullNeo4jConnection:
+    """
+    Mimics the ingestion API of Neo4jConnection without a database. Books are kept in a dictionary
+    with the properties the incremental loader looks at, so repeated runs behave like against a real graph.
+    Useful to measure the client side of the pipeline in isolation.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.books = {}
+        self.written = 0
+        self.batches = 0
+        self.catalogue_version = None
+        self.book_count = None
+        self._lock = threading.Lock()
+
+    def ensure_schema(self):
+        return []
+
+    def check_index(self, vector_dimensions=None):
+        return True
+
+    def create_index(self, vector_dimensions, similarity_function):
+        pass
+
+    def create_fulltext_index(self):
+        pass
+
+    def load_books_batch(self, rows, batch_size=500):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        return []
+
+    def _write(self, batch):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            for row in batch:
+                stored = self.books.get(row["title"], {})
+                self.books[row["title"]] = {
+                    "contentHash": row.get("content_hash"),
+                    "summaryHash": row.get("summary_hash"),
+                    "hasVector": row.get("embeddings") is not None or stored.get("hasVector", False),
+                    "run": row.get("run_id"),
+                }
+            self.written += len(batch)
+            self.batches += 1
+
+    def fetch_book_hashes(self, titles):
+        with self._lock:
+            return {title: dict(self.books[title]) for title in titles if title in self.books}
+
+    def mark_books_seen(self, titles, run_id):
+        with self._lock:
+            for title in titles:
+                if title in self.books:
+                    self.books[title]["run"] = run_id
+
+    def update_catalogue_version(self, version):
+        self.catalogue_version = version
+
+    def fetch_book_seqs(self):
+        with self._lock:
+            return [(title, book.get("seq")) for title, book in self.books.items()]
+
+    def set_book_seqs(self, rows, count, batch_size=1000):
+        with self._lock:
+            for row in rows:
+                self.books[row["title"]]["seq"] = row["seq"]
+            self.book_count = count
+
+    def fetch_book_vectors(self, start, stop):
+        # Vectors and relationships are not kept, so the similar-books build has nothing to compare.
+        with self._lock:
+            return [(book["seq"], None, False, []) for book in self.books.values() if start <= book.get("seq", -1) < stop]
+
+    def replace_similar_books(self, rows):
+        pass
+
+    def remove_books_not_in_run(self, run_id, batch_size=1000):
+        with self._lock:
+            removed = [title for title, book in self.books.items() if book["run"] != run_id]
+            for title in removed:
+                del self.books[title]
+        return len(removed)
+
+    def close(self):
+        pass
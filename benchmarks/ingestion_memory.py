@@ -0,0 +1,93 @@
+"""
+Measures the throughput (rows/sec) and peak RSS of the streaming CSV ingestion for growing catalogue sizes.
+Every size runs in a fresh subprocess with fake OpenAI embeddings that wait --embedding-latency seconds
+per request. By default Neo4j is replaced by an in-process stand-in, so the numbers reflect the loader
+itself and peak RSS should stay flat as the file grows. With --neo4j the books are written to the
+database configured through NEO4J_URI, NEO4J_USERNAME and NEO4J_PASSWORD; use a throwaway database,
+e.g. a local container, as the synthetic catalogue is left in it.
+
+    python -m benchmarks.ingestion_memory --sizes 1k 100k 1M
+    python -m benchmarks.ingestion_memory --sizes 1k 100k --neo4j --embedding-latency 0.2 --output runs.jsonl
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.catalogue import catalogue_size
+from benchmarks.report import add_output_argument, emit
+
+
+def run_single(rows, dimensions, chunk_size, embedding_latency=0.0, live=False):
+    from benchmarks._paths import use_app
+    from benchmarks.catalogue import write_catalogue
+    from benchmarks.fakes import FakeEmbeddingConnection, NullNeo4jConnection
+
+    use_app("download_data")
+    from data_loader import DataLoader
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_catalogue(os.path.join(directory, "books.csv"), rows)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if live:
+            from neo4j_connection import Neo4jConnection
+
+            neo4j = Neo4jConnection(os.getenv("NEO4J_URI"), os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))
+        else:
+            neo4j = NullNeo4jConnection()
+        embeddings = FakeEmbeddingConnection(dimensions, latency=embedding_latency)
+        loader = DataLoader(neo4j, embeddings, path, dimensions, "cosine", chunk_size=chunk_size)
+        try:
+            started = time.perf_counter()
+            loader.load_books_from_csv()
+            seconds = time.perf_counter() - started
+        finally:
+            if live:
+                neo4j.close()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 2),
+        "rows_per_sec": round(rows / seconds, 1),
+        "baseline_rss_mb": round(baseline / 1024, 1),
+        "peak_rss_mb": round(peak / 1024, 1),
+        "embedding_requests": embeddings.requests,
+        "books_written": None if live else neo4j.written,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=catalogue_size, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="seconds per fake embeddings request")
+    parser.add_argument("--neo4j", action="store_true", help="write to the configured Neo4j instead of the stand-in")
+    add_output_argument(parser)
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    options = ["--dimensions", str(args.dimensions), "--chunk-size", str(args.chunk_size),
+               "--embedding-latency", str(args.embedding_latency)] + (["--neo4j"] if args.neo4j else [])
+    if args.single:
+        print(json.dumps(run_single(args.single, args.dimensions, args.chunk_size, args.embedding_latency, args.neo4j)))
+        return
+
+    results = []
+    for size in args.sizes:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.ingestion_memory", "--single", str(size)] + options,
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    config = {"dimensions": args.dimensions, "chunk_size": args.chunk_size,
+              "embedding_latency": args.embedding_latency, "backend": "neo4j" if args.neo4j else "in-process"}
+    emit("ingestion_memory", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
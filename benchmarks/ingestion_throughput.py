@@ -0,0 +1,94 @@
+"""
+Compares the per-row ingestion path (load_book + load_summary, two transactions per book)
+with the batched UNWIND path (load_books_batch) against the Neo4j database configured
+through NEO4J_URI, NEO4J_USERNAME and NEO4J_PASSWORD.
+
+Synthetic books are written with a '__bench__' title prefix and removed afterwards.
+
+    python -m benchmarks.ingestion_throughput --rows 2000 --batch-size 500
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from benchmarks._paths import use_app
+
+use_app("download_data")
+
+from neo4j_connection import Neo4jConnection  # noqa: E402
+
+
+def synthetic_rows(count, dimensions, prefix):
+    rng = random.Random(42)
+    for i in range(count):
+        yield {
+            'index': i,
+            'title': f"{prefix}{i}",
+            'author': f"{prefix}author {i % 97}",
+            'lang': 'English',
+            'rating': round(rng.uniform(1, 5), 2),
+            'summary': f"Synthetic summary {i}",
+            'year': 1900 + i % 120,
+            'genres': [f"{prefix}genre {i % 13}", f"{prefix}genre {i % 7}"],
+            'embeddings': [rng.random() for _ in range(dimensions)],
+        }
+
+
+def cleanup(connection, prefix):
+    with connection.driver.session() as session:
+        for label, key in (("Book", "title"), ("Author", "name"), ("Genre", "name")):
+            session.run(
+                f"MATCH (n:{label}) WHERE n.{key} STARTS WITH $prefix DETACH DELETE n",
+                prefix=prefix,
+            ).consume()
+
+
+def run_per_row(connection, rows):
+    started = time.perf_counter()
+    for row in rows:
+        book_data = {key: row[key] for key in ('title', 'author', 'lang', 'rating', 'summary', 'year')}
+        connection.load_book(genres=row['genres'], **book_data)
+        connection.load_summary(row['title'], row['embeddings'])
+    return time.perf_counter() - started
+
+
+def run_batched(connection, rows, batch_size):
+    started = time.perf_counter()
+    failed = connection.load_books_batch(rows, batch_size=batch_size)
+    return time.perf_counter() - started, len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dimensions", type=int, default=int(os.getenv("DIMENSIONS", 1536)))
+    args = parser.parse_args()
+
+    prefix = "__bench__"
+    connection = Neo4jConnection(os.getenv("NEO4J_URI"), os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))
+    try:
+        rows = list(synthetic_rows(args.rows, args.dimensions, prefix))
+
+        cleanup(connection, prefix)
+        per_row_seconds = run_per_row(connection, rows)
+
+        cleanup(connection, prefix)
+        batched_seconds, failed = run_batched(connection, rows, args.batch_size)
+
+        print(json.dumps({
+            "rows": args.rows,
+            "batch_size": args.batch_size,
+            "per_row": {"seconds": round(per_row_seconds, 3), "rows_per_sec": round(args.rows / per_row_seconds, 1)},
+            "batched": {"seconds": round(batched_seconds, 3), "rows_per_sec": round(args.rows / batched_seconds, 1), "failed": failed},
+            "speedup": round(per_row_seconds / batched_seconds, 1),
+        }, indent=2))
+    finally:
+        cleanup(connection, prefix)
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
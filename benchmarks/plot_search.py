@@ -0,0 +1,142 @@
+"""
+Compares the vector-only and the hybrid (vector + full-text, rank-fused) plot search on a fixed
+question set: how often the asked-about book is retrieved, and with --agent how many tool calls
+and LLM calls the agent needs per answer.
+
+The questions name a title, an author or words of the summary of books picked deterministically
+from the catalogue (every n-th book by title), so the set is the same on every run over the same
+data. Runs against the Neo4j database configured through NEO4J_URI, NEO4J_USERNAME and
+NEO4J_PASSWORD and needs OPENAI_API_KEY for embeddings (and for the agent). Agent sessions use a
+'__bench__' id prefix and are removed afterwards.
+
+    python -m benchmarks.plot_search --books 30 --k 4
+    python -m benchmarks.plot_search --books 10 --agent
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+
+from benchmarks._paths import use_app
+
+use_app("chat")
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+
+from benchmarks.chat_memory import cleanup  # noqa: E402
+from graph import get_graph  # noqa: E402
+from resources import clear_resources  # noqa: E402
+
+SAMPLE_BOOKS = """
+MATCH (b:Book) WHERE b.summary IS NOT NULL
+WITH b ORDER BY b.title
+WITH collect(b) AS books
+UNWIND range(0, size(books) - 1, size(books) / $count + 1) AS i
+WITH books[i] AS b
+RETURN b.title AS title, b.summary AS summary, [(b)-[:WRITTEN_BY]->(a) | a.name][0] AS author
+LIMIT $count
+"""
+
+TEMPLATES = [
+    "What is {title} about?",
+    "Tell me about the book by {author} where {summary_words}",
+    "Which book is this: {summary_words}",
+]
+
+
+class TurnCounter(BaseCallbackHandler):
+    def __init__(self):
+        self.tool_calls = 0
+        self.llm_calls = 0
+
+    def on_agent_action(self, action, **kwargs):
+        self.tool_calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.llm_calls += 1
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.llm_calls += 1
+
+
+def question_set(graph, count):
+    questions = []
+    for book in graph.query(SAMPLE_BOOKS, {"count": count}):
+        summary_words = " ".join(book["summary"].split()[5:17])
+        for template in TEMPLATES:
+            questions.append({
+                "question": template.format(title=book["title"], author=book["author"], summary_words=summary_words),
+                "title": book["title"],
+            })
+    return questions
+
+
+def use_mode(mode):
+    os.environ["PLOT_RETRIEVER"] = mode
+    clear_resources()
+
+
+async def measure_retrieval(questions, k):
+    from tools.vector import asearch_plots
+
+    found, latencies = 0, []
+    for item in questions:
+        started = time.perf_counter()
+        documents = await asearch_plots(item["question"], k)
+        latencies.append(time.perf_counter() - started)
+        found += any(document.metadata["book_title"] == item["title"] for document in documents)
+    return {"hit_rate": round(found / len(questions), 3), "mean_ms": round(statistics.mean(latencies) * 1000, 1)}
+
+
+async def measure_agent(questions, prefix):
+    from agent import get_chat_agent
+
+    agent = get_chat_agent()
+    tool_calls, llm_calls, mentioned = [], [], 0
+    for item in questions:
+        counter = TurnCounter()
+        response = await agent.ainvoke({"input": item["question"]},
+                                       {"configurable": {"session_id": f"{prefix}{uuid.uuid4()}"},
+                                        "callbacks": [counter]})
+        tool_calls.append(counter.tool_calls)
+        llm_calls.append(counter.llm_calls)
+        mentioned += item["title"].casefold() in response["output"].casefold()
+    return {
+        "tool_calls_per_answer": round(statistics.mean(tool_calls), 2),
+        "llm_calls_per_answer": round(statistics.mean(llm_calls), 2),
+        "answers_naming_the_book": round(mentioned / len(questions), 3),
+    }
+
+
+async def compare(questions, k, agent, prefix):
+    results = {"questions": len(questions)}
+    for mode in ("vector", "hybrid"):
+        use_mode(mode)
+        results[mode] = await measure_retrieval(questions, k)
+        if agent:
+            results[mode].update(await measure_agent(questions, prefix))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=30, help="books in the question set, three questions each")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--agent", action="store_true", help="also run the agent on every question")
+    args = parser.parse_args()
+
+    prefix = "__bench__"
+    questions = question_set(get_graph(), args.books)
+    try:
+        results = asyncio.run(compare(questions, args.k, args.agent, prefix))
+    finally:
+        if args.agent:
+            cleanup(get_graph(), prefix)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Shared output of the benchmarks: every run is one JSON document with the benchmark name, the time,
+the git commit and the configuration next to the results, so runs can be compared over time.
+With --output the document is also appended as one line to a JSON Lines file.
+"""
+import datetime
+import json
+import subprocess
+
+from benchmarks._paths import ROOT
+
+
+def percentiles(seconds):
+    """
+    Returns the p50, p95, p99, mean and max of a list of durations in milliseconds.
+    """
+    ordered = sorted(seconds)
+    if not ordered:
+        return {}
+
+    def at(fraction):
+        return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000, 1)
+
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 1), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def add_output_argument(parser):
+    parser.add_argument("--output", help="append the report as one line to this JSON Lines file")
+
+
+def emit(benchmark, config, results, output=None):
+    """
+    Prints the report of a run and appends it to output, if given.
+
+    Args:
+        benchmark (str): The name of the benchmark.
+        config (dict): The settings of the run.
+        results: The measurements.
+        output (str, optional): A JSON Lines file to append to.
+    """
+    report = {
+        "benchmark": benchmark,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": config,
+        "results": results,
+    }
+    if output:
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report) + "\n")
+    print(json.dumps(report, indent=2))
+    return report
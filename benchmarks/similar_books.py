@@ -0,0 +1,168 @@
+"""
+Measures the build time and peak RSS of the similar-books (k-nearest-neighbour) graph for growing
+catalogue sizes, and checks a sample of the neighbours against an exact search.
+
+Every size runs in a fresh subprocess against a synthetic catalogue that produces its embeddings
+on the fly and counts the relationships it would write, so the numbers reflect the blocked build
+itself. Peak RSS should grow with the embeddings matrix (which is memory-mapped) and the block
+size, never with the square of the number of books.
+
+After the full build, --changed books get new embeddings and the graph is brought up to date again,
+which only computes the neighbours of the books the change affects.
+
+    python -m benchmarks.similar_books --sizes 1000 10000 100000 --dimensions 256
+    python -m benchmarks.similar_books --sizes 100000 --dimensions 256 --changed 100
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+class SyntheticCatalogue:
+    """
+    Stands in for Neo4jConnection in SimilarBooksBuilder: books have no seq yet and their embeddings
+    are derived from their seq, so besides the build itself only the written relationships, as two
+    small (books, k) arrays, hold memory.
+    """
+
+    def __init__(self, books, dimensions, k, seed=7):
+        self.books = books
+        self.dimensions = dimensions
+        self.seed = seed
+        self.relationships = 0
+        self.neighbours = {}
+        self.versions = np.zeros(books, dtype=np.int32)
+        self.stale = np.ones(books, dtype=bool)
+        self.edge_rows = np.full((books, k), -1, dtype=np.int32)
+        self.edge_scores = np.zeros((books, k), dtype=np.float32)
+
+    def change(self, seqs):
+        """
+        Gives the books of the given seqs a new embedding.
+        """
+        self.versions[seqs] += 1
+        self.stale[seqs] = True
+
+    def vectors(self, start, stop, chunk=1000):
+        # Noise is drawn per chunk of 1000 books, so any range of seqs gets the same vectors.
+        centres = np.random.default_rng(self.seed).standard_normal((32, self.dimensions))
+        parts = []
+        for first in range(start - start % chunk, stop, chunk):
+            # [seed, 0] would draw the same numbers as the centres' seed, so noise has a stream of its own.
+            noise = np.random.default_rng([self.seed, 1, first]).standard_normal((chunk, self.dimensions))
+            rows = np.arange(first, first + chunk)
+            # A few shared directions give the catalogue clusters, like genres.
+            parts.append((centres[rows % 32] + 0.8 * noise)[max(start - first, 0):stop - first])
+        vectors = np.concatenate(parts)
+        for seq in np.flatnonzero(self.versions[start:stop]) + start:
+            noise = np.random.default_rng([self.seed, 2, int(seq), int(self.versions[seq])]).standard_normal(self.dimensions)
+            vectors[seq - start] = centres[(seq * 7) % 32] + 0.8 * noise
+        return vectors
+
+    def fetch_book_seqs(self):
+        return [(f"Book {i}", None) for i in range(self.books)]
+
+    def set_book_seqs(self, rows, count, batch_size=1000):
+        pass
+
+    def fetch_book_vectors(self, start, stop):
+        stop = min(stop, self.books)
+        return [(seq, vector, bool(self.stale[seq]),
+                 [[int(other), float(score)] for other, score in zip(self.edge_rows[seq], self.edge_scores[seq]) if other >= 0])
+                for seq, vector in zip(range(start, stop), self.vectors(start, stop))]
+
+    def replace_similar_books(self, rows):
+        for row in rows:
+            seq = row["seq"]
+            self.relationships += len(row["neighbours"])
+            self.stale[seq] = False
+            self.edge_rows[seq] = -1
+            for i, neighbour in enumerate(row["neighbours"]):
+                self.edge_rows[seq, i] = neighbour["seq"]
+                self.edge_scores[seq, i] = neighbour["score"]
+            if seq < 50:
+                self.neighbours[seq] = [neighbour["seq"] for neighbour in row["neighbours"]]
+
+
+def exact_recall(catalogue, k):
+    vectors = catalogue.vectors(0, catalogue.books)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    found = total = 0
+    for seq, neighbours in catalogue.neighbours.items():
+        scores = vectors @ vectors[seq]
+        scores[seq] = -np.inf
+        expected = set(np.argsort(-scores)[:k].tolist())
+        found += len(expected & set(neighbours))
+        total += len(expected)
+    return found / total if total else 1.0
+
+
+def run_single(books, dimensions, k, block_size, changed=0):
+    from benchmarks._paths import use_app
+
+    use_app("download_data")
+    from similar_books import SimilarBooksBuilder
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    catalogue = SyntheticCatalogue(books, dimensions, k)
+    builder = SimilarBooksBuilder(catalogue, dimensions, k=k, block_size=block_size)
+    started = time.perf_counter()
+    builder.build()
+    seconds = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    incremental = None
+    if changed:
+        # Half of the changed books are in the recall sample, so stale neighbours would show up there.
+        seqs = np.unique(np.concatenate([np.arange(min(changed // 2, 50)),
+                                         np.random.default_rng(1).choice(books, changed - min(changed // 2, 50))]))
+        catalogue.change(seqs)
+        incremental = builder.build()
+        incremental = {"changed": len(seqs), "updated": incremental["updated"],
+                       "seconds": round(incremental["seconds"], 2)}
+    return {
+        "books": books,
+        "seconds": round(seconds, 2),
+        "relationships": catalogue.relationships,
+        "baseline_rss_mb": round(baseline / 1024, 1),
+        "peak_rss_mb": round(peak / 1024, 1),
+        "matrix_mb": round(books * dimensions * 4 / 2 ** 20, 1),
+        "full_similarity_matrix_mb": round(books * books * 4 / 2 ** 20, 1),
+        "incremental": incremental,
+        # Only checked on small catalogues, where the exact search is cheap.
+        "sample_recall": round(exact_recall(catalogue, k), 4) if books <= 20_000 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--changed", type=int, default=0, help="books changed before an incremental rebuild")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.dimensions, args.k, args.block_size, args.changed)))
+        return
+
+    results = []
+    for books in args.sizes:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.similar_books", "--single", str(books),
+             "--dimensions", str(args.dimensions), "--k", str(args.k), "--block-size", str(args.block_size),
+             "--changed", str(args.changed)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Compares plot retrieval through the Neo4j summaryPlots vector index with the in-process,
+memory-mapped index of chat/local_index.py: recall@k against an exact search and query latency.
+
+Queries are stored book vectors with some noise added, so no OpenAI key is needed. By default the
+export is built from the Neo4j database configured through NEO4J_URI, NEO4J_USERNAME and
+NEO4J_PASSWORD. With --synthetic, random vectors stand in for the catalogue and only the local
+index (exact NumPy search, and hnswlib when installed) is measured.
+
+    python -m benchmarks.vector_retrieval --queries 200 --k 4
+    python -m benchmarks.vector_retrieval --synthetic 100000 --dimensions 1536
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks._paths import use_app
+
+use_app("chat")
+
+from local_index import CATALOGUE_VERSION, LocalPlotIndex, hnswlib  # noqa: E402
+
+VECTOR_SEARCH = """
+CALL db.index.vector.queryNodes('summaryPlots', $k, $embedding)
+YIELD node, score
+RETURN node.title AS title, score
+"""
+
+
+class SyntheticDriver:
+    """
+    Answers the export queries of LocalPlotIndex.refresh from random unit vectors.
+    """
+
+    def __init__(self, rows, dimensions, seed=7):
+        rng = np.random.default_rng(seed)
+        self.vectors = rng.standard_normal((rows, dimensions), dtype=np.float32)
+        self.titles = [f"Book {row}" for row in range(rows)]
+        self.rows = dict(zip(self.titles, range(rows)))
+
+    def execute_query(self, query, titles=None, database_=None):
+        if "UNWIND" in query:
+            return [{"title": title, "contentHash": title, "summary": "", "authors": [],
+                     "vector": self.vectors[self.rows[title]]} for title in titles], None, None
+        return [{"title": title, "contentHash": title} for title in self.titles], None, None
+
+
+def percentiles(seconds):
+    ordered = sorted(seconds)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95)] * 1000, 3),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+    }
+
+
+def measure(search, queries, truth, k):
+    latencies, found = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        titles = search(query)
+        latencies.append(time.perf_counter() - started)
+        found += len(set(titles[:k]) & expected)
+    return {"recall_at_k": round(found / (k * len(queries)), 4), **percentiles(latencies)}
+
+
+def sample_queries(index, count, noise, seed=11):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(index.books), size=min(count, len(index.books)), replace=False)
+    queries = np.asarray(index.vectors[rows]) + noise * rng.standard_normal((len(rows), index.vectors.shape[1]))
+    return queries.astype(np.float32)
+
+
+def exact_titles(index, query, k):
+    similarities = np.asarray(index.vectors) @ (query / np.linalg.norm(query))
+    return {index.books[row]["title"] for row in np.argsort(-similarities)[:k]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--noise", type=float, default=0.02, help="standard deviation of the noise added to queries")
+    parser.add_argument("--synthetic", type=int, help="use this many random vectors instead of Neo4j")
+    parser.add_argument("--dimensions", type=int, default=1536, help="dimensions of the synthetic vectors")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="plot_index_")
+    exact = LocalPlotIndex(directory, hnsw_min_rows=None)
+    neo4j_driver = None
+    started = time.perf_counter()
+    if args.synthetic:
+        exact.refresh(SyntheticDriver(args.synthetic, args.dimensions), None, "synthetic")
+    else:
+        from neo4j import GraphDatabase
+
+        neo4j_driver = GraphDatabase.driver(os.getenv("NEO4J_URI"),
+                                            auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+        database = os.getenv("NEO4J_DATABASE", "neo4j")
+        records, _, _ = neo4j_driver.execute_query(CATALOGUE_VERSION, database_=database)
+        exact.refresh(neo4j_driver, database, records[0]["version"] if records else None)
+    export_seconds = time.perf_counter() - started
+
+    queries = sample_queries(exact, args.queries, args.noise)
+    truth = [exact_titles(exact, query, args.k) for query in queries]
+    results = {
+        "books": len(exact.books),
+        "dimensions": exact.manifest["dimensions"],
+        "matrix_mb": round(exact.vectors.nbytes / 2 ** 20, 1),
+        "export_seconds": round(export_seconds, 2),
+        "local_numpy": measure(lambda q: [book["title"] for book, _ in exact.search(q, args.k)], queries, truth, args.k),
+    }
+
+    if hnswlib is not None:
+        approximate = LocalPlotIndex(tempfile.mkdtemp(prefix="plot_index_"), hnsw_min_rows=0)
+        started = time.perf_counter()
+        approximate.refresh(SyntheticDriver(args.synthetic, args.dimensions) if args.synthetic else neo4j_driver,
+                            os.getenv("NEO4J_DATABASE", "neo4j"), exact.manifest["version"])
+        results["hnsw_build_seconds"] = round(time.perf_counter() - started, 2)
+        results["local_hnsw"] = measure(lambda q: [book["title"] for book, _ in approximate.search(q, args.k)],
+                                        queries, truth, args.k)
+
+    if neo4j_driver is not None:
+        def neo4j_search(query):
+            records, _, _ = neo4j_driver.execute_query(VECTOR_SEARCH, k=args.k, embedding=query.tolist(),
+                                                       database_=os.getenv("NEO4J_DATABASE", "neo4j"))
+            return [record["title"] for record in records]
+
+        results["neo4j_index"] = measure(neo4j_search, queries, truth, args.k)
+        neo4j_driver.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,29 @@
+import asyncio
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
 from langchain.tools import Tool
-from langchain_community.graphs import Neo4jGraph
-from langchain_community.chat_message_histories import Neo4jChatMessageHistory
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain import hub
 from langchain_core.prompts import PromptTemplate
 from utils import get_session_id
-from llm import llm
-from graph import graph
-from tools.vector import get_book_plot
-from tools.cypher import cypher_qa
+from llm import get_embeddings, get_llm
+from graph import get_graph
+from resources import lazy_resource
+from tools.vector import aget_book_plot, get_book_plot
+from tools.cypher import acypher_qa, cypher_qa, resolve_question
+from concurrency import get_background_loop
+from graph import get_async_driver
+from response_cache import CatalogueVersion, SemanticResponseCache, history_scope, is_cacheable, normalize_question, question_literals
+from router import get_router
+from streaming import AgentStreamHandler
+from memory import SummarizedChatMessageHistory, llm_summarizer
+from planner import PlanAndExecuteAgent
+from tracing import set_path, span, turn
 
 
 chat_prompt = ChatPromptTemplate.from_messages(
@@ -22,23 +33,34 @@ chat_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-book_chat = chat_prompt | llm | StrOutputParser()
+@lazy_resource
+def get_book_chat():
+    return chat_prompt | get_llm() | StrOutputParser()
+
+def book_chat(input):
+    return get_book_chat().invoke(input)
+
+async def abook_chat(input):
+    return await get_book_chat().ainvoke(input)
 
 tools = [
     Tool.from_function(
         name="General Chat",
         description="For general books chat not covered by other tools",
-        func=book_chat.invoke,
+        func=book_chat,
+        coroutine=abook_chat,
     ),
     Tool.from_function(
         name="Books Plot Search",
         description="For when you need to find information about books based on a plot or find the book if it's not covered by other tools",
         func=get_book_plot,
+        coroutine=aget_book_plot,
     ),
     Tool.from_function(
         name="Book information",
         description="Search for books based on author, genre, rating, year, recommend the book (you have to find one random book) or provide detailed book information using Cypher queries",
         func=cypher_qa,
+        coroutine=acypher_qa,
     )
 ]
 
@@ -82,31 +104,273 @@ New input: {input}
 {agent_scratchpad}
 """)
 
-agent = create_react_agent(llm, tools, agent_prompt)
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=tools,
-    verbose=True
-    )
-    
+# Summaries of turns that leave the memory window are written in the background.
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+@lazy_resource
+def get_summarizer():
+    return llm_summarizer(get_llm(), max_tokens=int(os.getenv("MEMORY_SUMMARY_TOKENS", 300)))
+
 def get_memory(session_id):
-    return Neo4jChatMessageHistory(session_id=session_id, graph=graph)
+    return SummarizedChatMessageHistory(
+        session_id,
+        get_graph(),
+        summarizer=get_summarizer(),
+        window_turns=int(os.getenv("MEMORY_WINDOW_TURNS", 3)),
+        token_budget=int(os.getenv("MEMORY_TOKEN_BUDGET", 1500)),
+        executor=summary_executor,
+    )
 
-chat_agent = RunnableWithMessageHistory(
-    agent_executor,
-    get_memory,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-)
+@lazy_resource
+def get_chat_agent():
+    """
+    Returns the conversational ReAct agent with session memory, created on first use and
+    shared by all sessions of the process.
+    """
+    agent = create_react_agent(get_llm(), tools, agent_prompt)
+    agent_executor = AgentExecutor(
+        agent=agent,
+        tools=tools,
+        # Turns are traced (see tracing.py); AGENT_VERBOSE=1 also prints the agent's steps.
+        verbose=os.getenv("AGENT_VERBOSE", "0").lower() in ("1", "true", "yes")
+        )
+    return RunnableWithMessageHistory(
+        agent_executor,
+        get_memory,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    )
+
+def agent_mode():
+    """
+    Returns how questions past the fast path and the response cache are answered: 'react' (the ReAct
+    agent, the default) or 'plan' (plan-and-execute, see planner.py).
+    """
+    return os.getenv("AGENT_MODE", "react").lower()
+
+@lazy_resource
+def get_plan_agent():
+    return PlanAndExecuteAgent(get_llm(), tools, max_steps=int(os.getenv("PLAN_MAX_STEPS", 4)))
+
+async def _aplan(user_input, session_id):
+    """
+    Plans the tool calls of a question in plan mode.
+
+    Returns:
+        tuple: The plan steps and the chat history messages, or None if the ReAct agent should answer,
+        because AGENT_MODE is not 'plan' or the LLM did not write a usable plan.
+    """
+    if agent_mode() != "plan":
+        return None
+    history = await asyncio.to_thread(lambda: get_memory(session_id).messages)
+    with span("plan", "plan") as attributes:
+        steps = await get_plan_agent().aplan(user_input, history)
+        attributes["steps"] = None if steps is None else len(steps)
+    return None if steps is None else (steps, history)
+
+async def _aanswer_planned(user_input, session_id, plan, events=None):
+    steps, history = plan
+    answer = await get_plan_agent().aanswer(user_input, history, steps, events)
+    await asyncio.to_thread(_remember, session_id, user_input, answer)
+    return {"input": user_input, "output": answer}
+
+def _record_turn(fast_path, seconds):
+    router_stats = get_router().stats
+    router_stats.record(fast_path, seconds)
+    stats = router_stats.as_dict()
+    logging.info("Fast path served %d of %d turns (%.0f%%), saving about %.1fs.", stats["fast_path_turns"],
+                 stats["turns"], 100 * stats["fast_path_fraction"], stats["estimated_seconds_saved"])
+
+def _remember(session_id, user_input, answer):
+    memory = get_memory(session_id)
+    memory.add_user_message(user_input)
+    memory.add_ai_message(answer)
+
+def _answer_fast(user_input, session_id):
+    """
+    Answers a question on the fast path and stores the turn in the session history.
+    Returns None if the question needs the agent.
+    """
+    with span("router", "fast path") as attributes:
+        answer = get_router().route(user_input)
+        attributes["answered"] = answer is not None
+    if answer is not None:
+        _remember(session_id, user_input, answer)
+    return answer
+
+@lazy_resource
+def get_response_cache():
+    return SemanticResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 1000)),
+        threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95)),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+    )
+
+catalogue_version = CatalogueVersion(check_interval=float(os.getenv("RESPONSE_CACHE_VERSION_CHECK", 30)))
+
+async def _alookup_cache(user_input, session_id, started):
+    """
+    Answers a question from the response cache and stores the turn in the session history.
+
+    Answers given with a conversation history are only shared with turns that have the same history,
+    and similar questions only when they mention the same names and numbers.
+
+    Returns:
+        tuple: The answer (None on a miss), the question embedding to store the agent's answer
+        under (None if the answer must not be cached), and the history scope and literals
+        (see question_literals) to store it with.
+    """
+    cache = get_response_cache()
+    if cache.max_entries <= 0:
+        return None, None, None, None
+    if not is_cacheable(user_input):
+        cache.record_skipped()
+        return None, None, None, None
+    try:
+        with span("cache", "response cache lookup") as attributes:
+            cache.set_version(await catalogue_version.current(get_async_driver(), os.getenv("NEO4J_DATABASE", "neo4j")))
+            scope = history_scope(await asyncio.to_thread(lambda: get_memory(session_id).messages))
+            entry, vector, literals = cache.lookup_exact(user_input, scope), None, None
+            if entry is None:
+                embeddings = await asyncio.to_thread(get_embeddings)
+                vector = await embeddings.aembed_query(normalize_question(user_input))
+                _, _, params, _ = await asyncio.to_thread(resolve_question, user_input)
+                literals = question_literals(user_input, params.values())
+                entry = cache.lookup_similar(vector, scope, literals)
+            attributes["hit"] = entry is not None
+    except Exception as e:
+        logging.warning("Response cache lookup failed: %s", e)
+        cache.record_miss()
+        return None, None, None, None
+    if entry is None:
+        cache.record_miss()
+        return None, vector, scope, literals
+    await asyncio.to_thread(_remember, session_id, user_input, entry["answer"])
+    cache.record_saved(entry, time.perf_counter() - started)
+    stats = cache.stats()
+    logging.info("Response cache hit (hit rate %.0f%%, about %.1fs saved).", 100 * stats["hit_rate"], stats["saved_seconds"])
+    return entry["answer"], None, None, None
+
+def _store_in_cache(user_input, vector, scope, literals, answer, started):
+    if vector is not None:
+        get_response_cache().put(user_input, vector, answer, time.perf_counter() - started, scope, literals)
+
+async def agenerate_response(user_input, session_id):
+    """
+    Answers a question on the running event loop.
+
+    Questions with an obvious intent are answered by the fast-path router without the agent, and
+    repeated or near-duplicate questions from the response cache; the turn is still stored in the
+    session history so follow-up questions keep their context. The agent runs with ainvoke, so its LLM and Neo4j calls share the process-wide async clients.
+    With AGENT_MODE=plan, the agent is replaced by plan-and-execute (see planner.py) unless the plan
+    is unusable. The turn is traced; see tracing.py.
+
+    Args:
+        user_input (str): The question.
+        session_id (str): The chat session.
+
+    Returns:
+        str: The answer.
+    """
+    with turn(user_input, session_id):
+        started = time.perf_counter()
+
+        answer = await asyncio.to_thread(_answer_fast, user_input, session_id)
+        if answer is not None:
+            set_path("fast_path")
+            _record_turn(True, time.perf_counter() - started)
+            return answer
+
+        answer, vector, scope, literals = await _alookup_cache(user_input, session_id, started)
+        if answer is not None:
+            set_path("cache")
+            return answer
+
+        plan = await _aplan(user_input, session_id)
+        if plan is not None:
+            set_path("plan")
+            response = await _aanswer_planned(user_input, session_id, plan)
+        else:
+            set_path("agent")
+            response = await get_chat_agent().ainvoke(
+                {"input": user_input},
+                {"configurable": {"session_id": session_id}},)
+        _record_turn(False, time.perf_counter() - started)
+        _store_in_cache(user_input, vector, scope, literals, response['output'], started)
+        return response['output']
+
+async def astream_response(user_input, session_id):
+    """
+    Streams the response to a question as events on the running event loop.
+
+    Yields ("tool", message) when the agent calls a tool and ("token", text) for the pieces of the
+    final answer as the LLM writes them; in plan mode, the tool events come as the planned calls start.
+    The chat history is persisted once the answer is complete. The time to the first answer token is logged and the turn is traced.
+    """
+    with turn(user_input, session_id):
+        started = time.perf_counter()
+
+        answer = await asyncio.to_thread(_answer_fast, user_input, session_id)
+        if answer is not None:
+            logging.info("Time to first token: %.2fs (fast path).", time.perf_counter() - started)
+            set_path("fast_path")
+            _record_turn(True, time.perf_counter() - started)
+            yield "token", answer
+            return
+
+        answer, vector, scope, literals = await _alookup_cache(user_input, session_id, started)
+        if answer is not None:
+            logging.info("Time to first token: %.2fs (response cache).", time.perf_counter() - started)
+            set_path("cache")
+            yield "token", answer
+            return
+
+        plan = await _aplan(user_input, session_id)
+        events = asyncio.Queue()
+        if plan is not None:
+            set_path("plan")
+            task = asyncio.ensure_future(_aanswer_planned(user_input, session_id, plan, events))
+        else:
+            set_path("agent")
+            task = asyncio.ensure_future(get_chat_agent().ainvoke(
+                {"input": user_input},
+                {"configurable": {"session_id": session_id}, "callbacks": [AgentStreamHandler(events)]},))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+
+        try:
+            first_token = None
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                if event[0] == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                    logging.info("Time to first token: %.2fs.", first_token)
+                yield event
+            response = await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+        if first_token is None:
+            # The ReAct answer did not follow the format, e.g. it was produced by an output parser fallback.
+            logging.info("Time to first token: %.2fs (not streamed).", time.perf_counter() - started)
+            yield "token", response["output"]
+        _record_turn(False, time.perf_counter() - started)
+        _store_in_cache(user_input, vector, scope, literals, response["output"], started)
 
 def generate_response(user_input):
     """
     Create a handler that calls the Conversational agent
-    and returns a response to be rendered in the UI
-    """
+    and returns a response to be rendered in the UI.
 
-    response = chat_agent.invoke(
-        {"input": user_input},
-        {"configurable": {"session_id": get_session_id()}},)
+    The work runs on the shared background event loop, so concurrent sessions overlap their
+    OpenAI and Neo4j calls.
+    """
+    return get_background_loop().run(agenerate_response(user_input, get_session_id()))
 
-    return response['output']
+def stream_response(user_input):
+    """
+    Streams the response to a question as events for the UI; see astream_response.
+    """
+    yield from get_background_loop().iterate(astream_response(user_input, get_session_id()))
@@ -0,0 +1,196 @@
+"""
+HTTP API of the library chatbot.
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+POST /chat          {"session_id": "...", "message": "..."} -> {"session_id": "...", "answer": "..."}
+POST /chat/stream   same body -> newline-delimited JSON events: {"type": "tool" | "token", "text": "..."},
+                    then {"type": "done"} or {"type": "error", "text": "..."}
+POST /batch         {"questions": ["...", ...]} -> {"answers": [{"question", "answer" | "error"}, ...]}
+GET  /healthz       liveness: the process serves requests
+GET  /readyz        readiness: the agent is built and Neo4j is reachable through the shared drivers
+GET  /metrics       Prometheus metrics of the response cache, the fast-path router, entity resolution and the turn traces
+GET  /trace/{session_id}  the trace of the last turn of a session (see tracing.py)
+
+Each process runs one event loop that all requests share with the async OpenAI and Neo4j clients;
+scale out with more processes behind a load balancer. Sessions are identified by the caller.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from agent import agenerate_response, astream_response, get_chat_agent, get_memory, get_response_cache
+from concurrency import SingleFlight
+from entity_index import entity_stats, get_catalogue_entities
+from graph import get_async_driver, get_graph
+from router import get_router
+from tracing import last_trace, metrics as trace_metrics
+
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 100))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+
+readiness = {"ready": False, "error": None}
+# The lifespan task and concurrent readiness probes share one warm-up instead of each starting their own
+warm_ups = SingleFlight()
+
+
+async def warm_up():
+    """
+    Creates the shared resources and checks that Neo4j answers, so the first request does not pay for it.
+
+    A call made while a warm-up is already running waits for that warm-up instead of starting another.
+    """
+    await warm_ups.do("warm_up", _warm_up)
+
+
+async def _warm_up():
+    try:
+        await asyncio.to_thread(get_chat_agent)
+        await asyncio.to_thread(get_router)
+        await asyncio.to_thread(lambda: get_catalogue_entities().index())
+        await asyncio.to_thread(get_graph)
+        await get_async_driver().verify_connectivity()
+        readiness.update(ready=True, error=None)
+        logging.info("Chat API is ready.")
+    except Exception as e:
+        readiness.update(ready=False, error=str(e))
+        logging.error("Chat API warm-up failed: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    warming = asyncio.ensure_future(warm_up())
+    yield
+    warming.cancel()
+    if get_async_driver.created():
+        await get_async_driver().close()
+
+
+async def _read_chat_request(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, JSONResponse({"error": "The body must be JSON."}, status_code=400)
+    message = body.get("message") if isinstance(body, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        return None, JSONResponse({"error": "'message' must be a non-empty string."}, status_code=400)
+    session_id = body.get("session_id") or str(uuid.uuid4())
+    return (str(session_id), message), None
+
+
+async def chat(request):
+    parsed, error = await _read_chat_request(request)
+    if error:
+        return error
+    session_id, message = parsed
+    answer = await agenerate_response(message, session_id)
+    return JSONResponse({"session_id": session_id, "answer": answer})
+
+
+async def chat_stream(request):
+    parsed, error = await _read_chat_request(request)
+    if error:
+        return error
+    session_id, message = parsed
+
+    async def events():
+        try:
+            async for kind, text in astream_response(message, session_id):
+                yield json.dumps({"type": kind, "text": text}) + "\n"
+            yield json.dumps({"type": "done"}) + "\n"
+        except Exception as e:
+            logging.error("Streaming answer failed: %s", e)
+            yield json.dumps({"type": "error", "text": str(e)}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers={"X-Session-Id": session_id})
+
+
+async def batch(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "The body must be JSON."}, status_code=400)
+    questions = body.get("questions") if isinstance(body, dict) else None
+    if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+        return JSONResponse({"error": "'questions' must be a list of strings."}, status_code=400)
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch."}, status_code=413)
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(question):
+        # Every question is independent and gets its own session, which is deleted once it is answered.
+        session_id = f"batch-{uuid.uuid4()}"
+        async with semaphore:
+            try:
+                return {"question": question, "answer": await agenerate_response(question, session_id)}
+            except Exception as e:
+                logging.error("Batch question '%s' failed: %s", question, e)
+                return {"question": question, "error": str(e)}
+            finally:
+                try:
+                    await asyncio.to_thread(lambda: get_memory(session_id).delete())
+                except Exception as e:
+                    logging.warning("Could not delete batch session %s: %s", session_id, e)
+
+    return JSONResponse({"answers": await asyncio.gather(*(answer(question) for question in questions))})
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request):
+    if not readiness["ready"]:
+        # Retry the warm-up, e.g. when Neo4j was still starting.
+        await warm_up()
+    if not readiness["ready"]:
+        return JSONResponse({"status": "not ready", "error": readiness["error"]}, status_code=503)
+    try:
+        await asyncio.wait_for(get_async_driver().verify_connectivity(), timeout=5)
+    except Exception as e:
+        return JSONResponse({"status": "not ready", "error": f"Neo4j is unreachable: {e}"}, status_code=503)
+    return JSONResponse({"status": "ready"})
+
+
+def prometheus_metrics(prefix, stats):
+    """
+    Formats a flat dictionary of numbers in the Prometheus text exposition format.
+    """
+    return "".join(f"{prefix}_{name} {float(value)}\n" for name, value in stats.items())
+
+
+async def metrics(request):
+    body = prometheus_metrics("chatbot_response_cache", get_response_cache().stats())
+    body += prometheus_metrics("chatbot_router", get_router().stats.as_dict())
+    body += prometheus_metrics("chatbot_entities", entity_stats.as_dict())
+    body += trace_metrics.prometheus()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+async def trace(request):
+    record = last_trace(request.path_params["session_id"])
+    if record is None:
+        return JSONResponse({"error": "No traced turn for this session."}, status_code=404)
+    return JSONResponse(record)
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/batch", batch, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/readyz", readyz, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/trace/{session_id}", trace, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,48 @@
+import json
+
+import httpx
+
+
+def stream_chat(base_url, session_id, message, timeout=120.0):
+    """
+    Streams an answer from the chat API.
+
+    Args:
+        base_url (str): The URL of the API, e.g. http://api:8000.
+        session_id (str): The chat session.
+        message (str): The question.
+        timeout (float): The read timeout in seconds.
+
+    Yields:
+        tuple: ("tool", message) and ("token", text) events, like agent.stream_response.
+
+    Raises:
+        RuntimeError: If the API reports an error while answering.
+    """
+    with httpx.stream(
+        "POST",
+        f"{base_url.rstrip('/')}/chat/stream",
+        json={"session_id": session_id, "message": message},
+        timeout=httpx.Timeout(timeout, connect=5.0),
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "done":
+                return
+            if event["type"] == "error":
+                raise RuntimeError(event["text"])
+            yield event["type"], event["text"]
+
+
+def fetch_trace(base_url, session_id, timeout=5.0):
+    """
+    Returns the trace of the last turn of a session from the chat API, or None if there is none.
+    """
+    response = httpx.get(f"{base_url.rstrip('/')}/trace/{session_id}", timeout=timeout)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
@@ -1,6 +1,27 @@
+import os
 import time
 import streamlit as st
-from agent import generate_response
+from utils import get_session_id
+
+# With CHAT_API_URL set the app is a client of the chat API; otherwise it runs the agent in-process.
+CHAT_API_URL = os.getenv("CHAT_API_URL")
+if CHAT_API_URL:
+    from api_client import fetch_trace, stream_chat
+
+    def stream_response(message):
+        return stream_chat(CHAT_API_URL, get_session_id(), message)
+
+    def load_trace():
+        return fetch_trace(CHAT_API_URL, get_session_id())
+else:
+    from agent import stream_response
+    from tracing import last_trace
+
+    def load_trace():
+        return last_trace(get_session_id())
+
+# With SHOW_TRACE set the sidebar shows where the time of the last answer went.
+SHOW_TRACE = os.getenv("SHOW_TRACE", "0").lower() in ("1", "true", "yes")
 
 # Set page config
 st.set_page_config("Library bot", page_icon=":books:")
@@ -27,14 +48,56 @@ def write_message(role, content, save = True):
         st.markdown(content)
 
 def handle_submit(message):
-    """Handle submission of user input."""
+    """Handle submission of user input, rendering the answer as it is streamed."""
     try:
-        with st.spinner('Thinking...'):
-            response = generate_response(message)
-            write_message('assistant', response)
+        with st.chat_message('assistant', avatar=":material/support_agent: "):
+            status = st.status('Thinking...')
+
+            def answer_tokens():
+                for kind, text in stream_response(message):
+                    if kind == 'tool':
+                        status.update(label=text)
+                        status.write(text)
+                    else:
+                        yield text
+                status.update(label='Done', state='complete')
+
+            response = st.write_stream(answer_tokens())
+        st.session_state.messages.append({"role": 'assistant', "content": response})
     except Exception as e:
         st.error(f"### Error\nAn unexpected error occurred:\n\n**{str(e)}**")
 
+def show_trace(trace):
+    """Shows the spans of the last traced turn in the sidebar as a waterfall."""
+    with st.sidebar:
+        st.subheader("Last answer")
+        if not trace:
+            st.caption("No traced answer yet.")
+            return
+        st.caption(f"{trace['duration_ms'] / 1000:.2f}s, answered by the {(trace['path'] or 'unknown').replace('_', ' ')}")
+        rows = []
+        for i, span in enumerate(sorted(trace["spans"], key=lambda span: span["start_ms"])):
+            attributes = span["attributes"]
+            rows.append({
+                "span": f"{i + 1:02d} {span['name']}",
+                "kind": span["kind"],
+                "start": span["start_ms"],
+                "end": span["start_ms"] + span["duration_ms"],
+                "ms": span["duration_ms"],
+                "db_ms": attributes.get("db_ms"),
+                "tokens": (attributes.get("prompt_tokens") or 0) + (attributes.get("completion_tokens") or 0) or None,
+            })
+        st.vega_lite_chart(rows, {
+            "mark": "bar",
+            "encoding": {
+                "y": {"field": "span", "type": "nominal", "sort": None, "title": None},
+                "x": {"field": "start", "type": "quantitative", "title": "ms"},
+                "x2": {"field": "end"},
+                "color": {"field": "kind", "type": "nominal"},
+                "tooltip": [{"field": field} for field in ("span", "ms", "db_ms", "tokens")],
+            },
+        }, use_container_width=True)
+
 # Option 1
 st.title("Library  ChatBot")
 
@@ -47,6 +110,12 @@ if question := st.chat_input("Ask me to find your next book..."):
     write_message('user', question)
     handle_submit(question)
 
+if SHOW_TRACE:
+    try:
+        show_trace(load_trace())
+    except Exception as e:
+        st.sidebar.caption(f"The trace is unavailable: {e}")
+
 #Option 2: Side_panel
 # with st.sidebar:
 #     st.title("Library  ChatBot")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import queue
+import threading
+
+from resources import lazy_resource
+
+
+class BackgroundLoop:
+    """
+    An asyncio event loop running in a daemon thread.
+
+    Synchronous callers such as Streamlit script threads hand their coroutines to this loop, so all
+    async clients of the process (the Neo4j async driver, the OpenAI HTTP client) live on one loop
+    and the requests of every session overlap on it instead of each holding a thread.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="chat-event-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine, timeout=None):
+        """
+        Runs a coroutine on the loop and waits for its result. Code already running on the loop must
+        await the coroutine instead; waiting here would block the loop for good.
+        """
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise RuntimeError("BackgroundLoop.run was called from the loop itself; await the coroutine instead.")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def iterate(self, async_iterable):
+        """
+        Iterates an async iterable on the loop from a synchronous caller.
+
+        Yields:
+            The items of the async iterable, in order.
+        """
+        items = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in async_iterable:
+                    items.put(item)
+            except BaseException as e:
+                items.put(e)
+                raise
+            finally:
+                items.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            for item in iter(items.get, done):
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Stop the async iterable if the caller stopped early.
+            future.cancel()
+
+
+@lazy_resource
+def get_background_loop():
+    return BackgroundLoop()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is in flight, later callers with
+    the same key await its result instead of starting their own, so a burst of the same question
+    reaches the backends once. Results are not cached after the call completes.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        """
+        Args:
+            key (hashable): Identifies identical calls.
+            factory (callable): Returns the coroutine to run when no identical call is in flight.
+
+        Returns:
+            The result of the call.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            logging.info("Joined an in-flight call for %s.", key)
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieve the exception so a call nobody joined is not reported as never retrieved.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+def flight_key(*parts):
+    """
+    Builds a single-flight key from a tool name and its inputs, ignoring case and surrounding whitespace.
+    """
+    return tuple(" ".join(str(part).split()).casefold() for part in parts)
+
+
+# Identical in-flight tool calls of the process share one backend call.
+tool_calls = SingleFlight()
@@ -0,0 +1,192 @@
+"""
+Packs retrieved plot summaries and Cypher result rows into a token budget before they reach the
+answering LLM, so the prompt size depends on the question rather than on how long the catalogue's
+summaries are.
+
+Plot documents are deduplicated (the same book, or summaries that share most of their word
+trigrams), ranked by retrieval score and shortened to the sentences that share the most words with
+the question. Cypher rows are written as a compact pipe-separated table with a hard row cap, long
+text cells cut to their first sentences.
+
+CONTEXT_PACKING=0 turns packing off and passes the full context through, e.g. to compare prompt sizes.
+"""
+import os
+import re
+
+from langchain_core.documents import Document
+from memory import estimate_tokens
+
+# Words too common to tell two summaries or a question and a sentence apart.
+STOP_WORDS = frozenset("""
+a about an and are as at be book books by can did do does find for from has have how i in is it me of on or
+plot story tell that the their there this to was what when where which who whose why with
+""".split())
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'A-Z0-9])")
+WORDS = re.compile(r"[\w']+")
+ELLIPSIS = " … "
+
+
+def packing_enabled():
+    return os.getenv("CONTEXT_PACKING", "1").lower() not in ("0", "false", "no")
+
+
+def content_words(text):
+    return {word for word in WORDS.findall(text.casefold()) if word not in STOP_WORDS}
+
+
+def _shingles(text):
+    words = WORDS.findall(text.casefold())
+    return {tuple(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+
+
+def sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_END.split(text.strip()) if sentence.strip()]
+
+
+def truncate_words(text, tokens):
+    """
+    Cuts a text to about the given number of tokens at a word boundary.
+    """
+    if estimate_tokens(text) <= tokens:
+        return text
+    cut = text[:max(tokens * 4, 0)].rsplit(" ", 1)[0]
+    return cut.rstrip(",;:") + "…"
+
+
+def extract_sentences(text, question_words, tokens):
+    """
+    Shortens a text to about the given number of tokens, keeping the sentences that share the most
+    words with the question (earlier sentences win ties), in their original order.
+    """
+    if estimate_tokens(text) <= tokens:
+        return text
+    parts = sentences(text)
+    ranked = sorted(range(len(parts)), key=lambda i: (-len(content_words(parts[i]) & question_words), i))
+    chosen, used = [], 0
+    for i in ranked:
+        cost = estimate_tokens(parts[i])
+        if used + cost > tokens:
+            continue
+        chosen.append(i)
+        used += cost
+    if not chosen:
+        return truncate_words(parts[ranked[0]], tokens)
+    chosen.sort()
+    text = parts[chosen[0]]
+    for previous, i in zip(chosen, chosen[1:]):
+        # Mark where sentences were left out.
+        text += (" " if i == previous + 1 else ELLIPSIS) + parts[i]
+    return text
+
+
+def _header(metadata):
+    authors = metadata.get("author") or []
+    if isinstance(authors, str):
+        authors = [authors]
+    title = metadata.get("book_title") or "Unknown title"
+    return f"{title} (by {', '.join(authors)})" if authors else title
+
+
+def pack_documents(question, documents, token_budget=800, duplicate_threshold=0.8):
+    """
+    Packs plot documents into a token budget.
+
+    Documents of the same book, or whose summaries share at least duplicate_threshold of their word
+    trigrams with a better-ranked one, are dropped. The rest are ranked by their 'score' metadata
+    (retrieval order if there is none), and each gets an even share of the budget that is left,
+    shortened to its most relevant sentences. The title and authors head every document, so the
+    answering LLM can name the book.
+
+    Args:
+        question (str): The question the documents were retrieved for.
+        documents (list): The retrieved documents.
+        token_budget (int): The approximate number of tokens of all packed documents together.
+        duplicate_threshold (float): The trigram overlap from which two summaries are the same.
+
+    Returns:
+        list: The packed documents, best first, with their metadata.
+    """
+    if not packing_enabled():
+        return documents
+    ranked = sorted(enumerate(documents), key=lambda item: (-(item[1].metadata.get("score") or 0), item[0]))
+    kept, seen_titles, seen_shingles = [], set(), []
+    for _, document in ranked:
+        title = (document.metadata.get("book_title") or "").casefold()
+        shingles = _shingles(document.page_content)
+        duplicate = any(len(shingles & other) / (min(len(shingles), len(other)) or 1) >= duplicate_threshold
+                        for other in seen_shingles)
+        if (title and title in seen_titles) or duplicate:
+            continue
+        seen_titles.add(title)
+        seen_shingles.append(shingles)
+        kept.append(document)
+
+    question_words = content_words(question)
+    packed, budget = [], token_budget
+    for position, document in enumerate(kept):
+        header = _header(document.metadata)
+        share = budget // (len(kept) - position) - estimate_tokens(header)
+        if share <= 0:
+            break
+        text = extract_sentences(document.page_content or "", question_words, share)
+        content = f"{header}: {text}"
+        budget -= estimate_tokens(content)
+        packed.append(Document(page_content=content, metadata=document.metadata))
+    return packed
+
+
+def _column(key):
+    # "b.title" and "b2.title" become "title"; aliases carry no meaning for the answering LLM.
+    return key.split(".", 1)[1] if "." in key else key
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ", ".join(_cell(item) for item in value if item is not None)
+    if isinstance(value, float):
+        return f"{value:g}"
+    return " ".join(str(value).split()).replace("|", "/")
+
+
+def pack_rows(rows, token_budget=600, max_rows=10, cell_tokens=60):
+    """
+    Writes Cypher result rows as a compact table within a token budget: a header of column names,
+    then one pipe-separated line per distinct row, at most max_rows of them. Text cells longer than
+    cell_tokens keep their first sentences, and rows that do not fit the budget are counted, not sent.
+
+    Args:
+        rows (list): The result rows as dictionaries.
+        token_budget (int): The approximate number of tokens of the table.
+        max_rows (int): The most rows to include.
+        cell_tokens (int): The approximate size of the longest cell.
+
+    Returns:
+        str: The table, or the rows unchanged if packing is disabled.
+    """
+    if not packing_enabled():
+        return rows
+    if not rows:
+        return "No results."
+    keys = list(dict.fromkeys(key for row in rows for key in row))
+    columns = list(dict.fromkeys(_column(key) for key in keys))
+    distinct = {}
+    for row in rows:
+        values = {}
+        for key in keys:
+            if not values.get(_column(key)):
+                values[_column(key)] = _cell(row.get(key))
+        distinct[" | ".join(extract_sentences(values[column], set(), cell_tokens) for column in columns)] = None
+
+    lines = [" | ".join(columns)]
+    budget = token_budget - estimate_tokens(lines[0])
+    for line in distinct:
+        if len(lines) > max_rows or estimate_tokens(line) > budget:
+            break
+        lines.append(line)
+        budget -= estimate_tokens(line)
+    if len(distinct) > len(lines) - 1:
+        lines.append(f"(+{len(distinct) - len(lines) + 1} more rows)")
+    return "\n".join(lines)
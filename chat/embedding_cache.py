@@ -0,0 +1,60 @@
+import asyncio
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    A LangChain Embeddings wrapper that serves repeated texts, such as identical user queries,
+    from an EmbeddingCache and only calls the wrapped embeddings for cache misses. The async methods
+    do the SQLite reads and writes in a worker thread, off the event loop.
+    """
+
+    def __init__(self, embeddings, cache, model, dimensions=None):
+        """
+        Args:
+            embeddings (Embeddings): The embeddings used for cache misses.
+            cache (EmbeddingCache): The cache to read from and write to.
+            model (str): The embedding model name, part of the cache key.
+            dimensions (int, optional): The embedding dimensions, part of the cache key.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(self.model, self.dimensions, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many(self.model, self.dimensions, [texts[i] for i in missing], missing_vectors)
+            for i, vector in zip(missing, missing_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get_many(self.model, self.dimensions, [text])[0]
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many(self.model, self.dimensions, [text], [vector])
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model, self.dimensions, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_vectors = await self.embeddings.aembed_documents([texts[i] for i in missing])
+            await asyncio.to_thread(self.cache.put_many, self.model, self.dimensions, [texts[i] for i in missing],
+                                    missing_vectors)
+            for i, vector in zip(missing, missing_vectors):
+                vectors[i] = vector
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = (await asyncio.to_thread(self.cache.get_many, self.model, self.dimensions, [text]))[0]
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put_many, self.model, self.dimensions, [text], [vector])
+        return vector
@@ -0,0 +1,63 @@
+"""
+Question embeddings for catalogues ingested with a reduced embedding width.
+
+Ingestion can store projected plot vectors in Neo4j (the first dimensions of every embedding, or a
+PCA of them; see shared/embedding_projection.py) and saves the projection to a file. With
+EMBEDDING_PROJECTION_PATH pointing at that file, the chat app projects its question embeddings the
+same way before they are compared with the stored vectors.
+
+Ingestion can also store every book's full-width embedding as int8 or float16 bytes; the local plot
+index rescores its candidates with them (see local_index.py).
+"""
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class ProjectedEmbeddings(Embeddings):
+    """
+    A LangChain Embeddings wrapper that projects the vectors of the wrapped embeddings to the width
+    of the stored plot vectors.
+    """
+
+    def __init__(self, embeddings, projection):
+        """
+        Args:
+            embeddings (Embeddings): The full-width embeddings.
+            projection (EmbeddingProjection): The projection of the ingestion run.
+        """
+        self.embeddings = embeddings
+        self.projection = projection
+
+    def _project(self, vectors):
+        return self.projection.transform(vectors).tolist() if vectors else []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._project(self.embeddings.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._project([self.embeddings.embed_query(text)])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._project(await self.embeddings.aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._project([await self.embeddings.aembed_query(text)])[0]
+
+
+async def aembed_query_full(embeddings, text):
+    """
+    Returns the embedding of a query for the stored vectors and, if they are projected, its full-width
+    embedding for rescoring (None otherwise).
+    """
+    if isinstance(embeddings, ProjectedEmbeddings):
+        vector = await embeddings.embeddings.aembed_query(text)
+        return embeddings._project([vector])[0], vector
+    return await embeddings.aembed_query(text), None
+
+
+def embed_query_full(embeddings, text):
+    if isinstance(embeddings, ProjectedEmbeddings):
+        vector = embeddings.embeddings.embed_query(text)
+        return embeddings._project([vector])[0], vector
+    return embeddings.embed_query(text), None
@@ -0,0 +1,459 @@
+"""
+An in-process index of the author, book and genre names of the graph, which maps the names users type
+to the names as stored.
+
+Names are compared folded: without case, diacritics, apostrophes, periods and punctuation, and with single
+spaces, so "jose saramago", "José Saramago" and "JOSÉ SARAMAGO." are the same name. Every kind of name
+is a sorted tuple of folded keys, which answers exact and prefix lookups by binary search, and a
+trigram index over the keys in numpy arrays (one sorted array of trigrams, the offsets of their
+postings by key length and one int32 array of postings), which finds the names that share the most
+trigrams with a misspelled one; the best few are ranked by a bit-parallel edit distance. Only the
+postings of names long or short enough to be similar are read, from the rarest trigrams of the query
+first, so common trigrams like 'the' cost little time on large catalogues.
+
+The index is loaded from the graph once and rebuilt in the background when ingestion writes a new
+catalogue version (see CatalogueEntities).
+"""
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+
+from graph import get_graph
+from resources import lazy_resource
+
+CATALOGUE_VERSION = "MATCH (m:IngestMeta {id: 'catalogue'}) RETURN m.version AS version"
+KINDS = ("author", "title", "genre")
+NAME_QUERIES = {
+    "author": "MATCH (a:Author) RETURN a.name AS name",
+    "genre": "MATCH (g:Genre) RETURN g.name AS name",
+    "title": "MATCH (b:Book) RETURN b.title AS name",
+}
+# The node property that holds each kind of name.
+PROPERTIES = {"author": "Author.name", "title": "Book.title", "genre": "Genre.name"}
+
+WORD = re.compile(r"[\w'’.&-]+")
+ELIDED = re.compile(r"['’`.]")
+NON_WORD = re.compile(r"[\W_]+")
+# Key lengths are stored in the low 16 bits of the cells of the trigram index; longer keys count as this long.
+LONGEST = 0xFFFE
+
+
+def fold(text):
+    """
+    Returns the form of a name that lookups compare: casefolded, without diacritics, apostrophes and
+    periods ("J.R.R." is "jrr"), with every run of other punctuation and spaces turned into a single space.
+    """
+    text = text.casefold()
+    if not text.isascii():
+        text = "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+    return " ".join(NON_WORD.sub(" ", ELIDED.sub("", text)).split())
+
+
+def _trigram_codes(codes):
+    # Code points fit in 21 bits, so three of them make one integer.
+    return (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+
+
+def trigrams(key):
+    """
+    Returns the distinct trigrams of a folded key, padded like pg_trgm, as a sorted uint64 array.
+    """
+    codes = np.frombuffer(f"  {key} ".encode("utf-32-le"), dtype="<u4").astype(np.uint64)
+    return np.unique(_trigram_codes(codes))
+
+
+class NameTable:
+    """
+    The names of one kind, sorted by folded key, with a trigram index over the keys.
+    Names that fold to the same key are stored once, under the first spelling.
+    """
+
+    def __init__(self, names):
+        canonical = {}
+        for name in names:
+            if name:
+                key = fold(name)
+                if key:
+                    canonical.setdefault(key, name)
+        # Tuples of strings are not tracked by the garbage collector, so a million names add no time to
+        # its full collections.
+        self.keys = tuple(sorted(canonical))
+        self.names = tuple(canonical[key] for key in self.keys)
+        self._index_trigrams()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _index_trigrams(self):
+        # All keys are encoded at once, separated by NUL code points; trigrams that span a separator are dropped.
+        padded = [f"  {key} " for key in self.keys]
+        lengths = np.fromiter((len(text) for text in padded), dtype=np.int64, count=len(padded))
+        codes = np.frombuffer("\x00".join(padded).encode("utf-32-le"), dtype="<u4").astype(np.uint64)
+        owners = np.repeat(np.arange(len(padded), dtype=np.int32), lengths + 1)[:len(codes)]
+        codes_trigrams = _trigram_codes(codes)
+        valid = (codes[:-2] != 0) & (codes[1:-1] != 0) & (codes[2:] != 0)
+        codes_trigrams, owners = codes_trigrams[valid], owners[:-2][valid]
+
+        # Postings hold the rank of a key by length, so the keys of a length range are one run of every posting list.
+        key_lengths = np.minimum(lengths - 3, LONGEST)
+        self.by_length = np.argsort(key_lengths, kind="stable").astype(np.int32)
+        ranks = np.empty(len(padded), dtype=np.int32)
+        ranks[self.by_length] = np.arange(len(padded), dtype=np.int32)
+        owners = ranks[owners]
+
+        order = np.lexsort((owners, codes_trigrams))
+        codes_trigrams, owners = codes_trigrams[order], owners[order]
+        distinct = np.ones(len(codes_trigrams), dtype=bool)
+        distinct[1:] = (codes_trigrams[1:] != codes_trigrams[:-1]) | (owners[1:] != owners[:-1])
+        codes_trigrams, owners = codes_trigrams[distinct], owners[distinct]
+
+        # A cell is a trigram and a key length, (trigram number << 16) | length, with the offset of its postings.
+        self.trigrams = np.unique(codes_trigrams)
+        posting_lengths = key_lengths.astype(np.uint16)[self.by_length][owners]
+        starts = np.ones(len(owners), dtype=bool)
+        starts[1:] = (codes_trigrams[1:] != codes_trigrams[:-1]) | (posting_lengths[1:] != posting_lengths[:-1])
+        starts = np.flatnonzero(starts)
+        numbers = np.searchsorted(self.trigrams, codes_trigrams[starts]).astype(np.int64)
+        self.cells = (numbers << 16) | posting_lengths[starts]
+        self.cell_offsets = np.append(starts, len(owners)).astype(np.int64)
+        self.postings = owners
+
+    def nbytes(self):
+        """
+        Returns the approximate memory of the table in bytes.
+        """
+        strings = sum(len(key) + len(name) + 98 for key, name in zip(self.keys, self.names))
+        arrays = (self.trigrams.nbytes + self.cells.nbytes + self.cell_offsets.nbytes + self.postings.nbytes
+                  + self.by_length.nbytes)
+        return strings + 16 * len(self.keys) + arrays
+
+    def exact(self, key):
+        i = bisect_left(self.keys, key)
+        return self.names[i] if i < len(self.keys) and self.keys[i] == key else None
+
+    def prefix(self, key, limit=10):
+        # At most limit + 1 keys are compared, however many names share the prefix.
+        if not key:
+            return []
+        names = []
+        start = bisect_left(self.keys, key)
+        for i in range(start, min(start + limit, len(self.keys))):
+            if not self.keys[i].startswith(key):
+                break
+            names.append(self.names[i])
+        return names
+
+    def candidates(self, query, count, lengths=None, max_postings=256, edits=2):
+        """
+        Returns the ids of up to count names that share the most trigrams with a query, and how many
+        of the trigrams read they share.
+
+        Only names whose folded length is within lengths are read: every posting list is cut to their
+        run. Postings are then read from the rarest trigrams of the query: at least the 3 * edits + 1
+        rarest, since an edit changes at most three trigrams and a name within edits edits of the query
+        must share one of them, and more while fewer than max_postings postings have been read.
+
+        Args:
+            query (ndarray): The trigrams of the folded query (see trigrams).
+            count (int): The number of candidates.
+            lengths (tuple, optional): The shortest and longest folded length of a candidate.
+            max_postings (int): The number of postings to read beyond the rarest trigrams.
+            edits (int): The number of edits within which a name is sure to be read.
+        """
+        if not len(self.trigrams):
+            return [], []
+        positions = np.minimum(np.searchsorted(self.trigrams, query), len(self.trigrams) - 1)
+        hits = positions[self.trigrams[positions] == query].astype(np.int64) << 16
+        shortest, longest = lengths or (0, LONGEST)
+        starts = self.cell_offsets[np.searchsorted(self.cells, hits | min(shortest, LONGEST))]
+        ends = self.cell_offsets[np.searchsorted(self.cells, hits | (min(longest, LONGEST) + 1))]
+        sizes = ends - starts
+        order = np.argsort(sizes, kind="stable")
+        order = order[sizes[order] > 0]
+        if not len(order):
+            return [], []
+        read = max(int(np.searchsorted(np.cumsum(sizes[order]), max_postings, side="right")), 3 * edits + 1)
+        ranks, shared = np.unique(
+            np.concatenate([self.postings[starts[i]:ends[i]] for i in order[:read]]), return_counts=True)
+        if len(ranks) > count:
+            best = np.argpartition(-shared, count - 1)[:count]
+            ranks, shared = ranks[best], shared[best]
+        return self.by_length[ranks].tolist(), shared.tolist()
+
+
+def similarity(a, b):
+    """
+    Returns 1 minus the edit distance of two strings, counting a swap of adjacent characters as one
+    edit, divided by the length of the longer one.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    return round(1 - edit_distance(a, b) / max(len(a), len(b)), 3)
+
+
+def edit_distance(a, b):
+    """
+    Returns the optimal string alignment distance of two strings, with the bit-parallel algorithm of
+    Hyyrö (2003): the columns of the dynamic programming matrix are the bits of a Python integer.
+    """
+    mask = (1 << len(a)) - 1
+    top = 1 << (len(a) - 1)
+    positions = {}
+    for i, char in enumerate(a):
+        positions[char] = positions.get(char, 0) | (1 << i)
+    vp, vn, d0, previous, distance = mask, 0, 0, 0, len(a)
+    for char in b:
+        pm = positions.get(char, 0)
+        transposed = (((~d0) & pm) << 1) & previous
+        d0 = ((((pm & vp) + vp) & mask) ^ vp) | pm | vn | transposed
+        hp = vn | (~(d0 | vp) & mask)
+        hn = d0 & vp
+        if hp & top:
+            distance += 1
+        elif hn & top:
+            distance -= 1
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = hn | (~(d0 | hp) & mask)
+        vn = d0 & hp
+        previous = pm
+    return distance
+
+
+class EntityIndex:
+    """
+    The author, title and genre names of a catalogue version, with folded exact, prefix and fuzzy lookups.
+    Kinds are tried in the order given; by default authors, then titles, then genres.
+    """
+
+    def __init__(self, names, version=None, min_similarity=0.75):
+        """
+        Args:
+            names (dict): The names of every kind in KINDS.
+            version (str, optional): The catalogue version the names were read at.
+            min_similarity (float): The edit similarity a misspelled name needs to be resolved.
+        """
+        self.version = version
+        self.min_similarity = min_similarity
+        self.tables = {kind: NameTable(names.get(kind, ())) for kind in KINDS}
+
+    def __len__(self):
+        return sum(len(table) for table in self.tables.values())
+
+    def nbytes(self):
+        return sum(table.nbytes() for table in self.tables.values())
+
+    def lookup(self, text, kinds=KINDS):
+        """
+        Returns (kind, name) for a name that matches text once folded, or None.
+        """
+        key = fold(text)
+        for kind in kinds:
+            name = self.tables[kind].exact(key)
+            if name is not None:
+                return kind, name
+        return None
+
+    def prefix(self, text, kinds=KINDS, limit=10):
+        """
+        Returns up to limit (kind, name) pairs whose folded name starts with the folded text.
+        """
+        key = fold(text)
+        found = []
+        for kind in kinds:
+            found.extend((kind, name) for name in self.tables[kind].prefix(key, limit - len(found)))
+            if len(found) >= limit:
+                break
+        return found
+
+    def fuzzy(self, text, kinds=KINDS, limit=5, verify=4):
+        """
+        Returns up to limit (kind, name, similarity) triples of names similar to text, best first.
+
+        The names that share the most trigrams with the text are candidates (see NameTable.candidates),
+        among those whose length allows min_similarity: a name m similar to a key of length n is between
+        m * n and n / m long. The best verify of them, or 2 * limit if more, are ranked by edit similarity
+        (see similarity) and kept if it is at least min_similarity.
+        """
+        key = fold(text)
+        if not key:
+            return []
+        query = trigrams(key)
+        verify = max(verify, 2 * limit)
+        lengths = None
+        if self.min_similarity > 0:
+            lengths = (math.floor(self.min_similarity * len(key)), math.ceil(len(key) / self.min_similarity))
+        candidates = []
+        for kind in kinds:
+            ids, shared = self.tables[kind].candidates(query, verify, lengths)
+            candidates.extend(zip(shared, [kind] * len(ids), ids))
+        candidates.sort(key=lambda candidate: -candidate[0])
+        found = []
+        for _, kind, i in candidates[:verify]:
+            stored = self.tables[kind].keys[i]
+            # Names whose lengths alone rule out the similarity are not compared.
+            if abs(len(stored) - len(key)) > (1 - self.min_similarity) * max(len(stored), len(key)):
+                continue
+            score = similarity(key, stored)
+            if score >= self.min_similarity:
+                found.append((kind, self.tables[kind].names[i], score))
+        return sorted(found, key=lambda match: -match[2])[:limit]
+
+    def resolve(self, text, kinds=KINDS):
+        """
+        Returns (kind, name, similarity) for the stored name text most likely refers to: an exact match
+        once folded (similarity 1.0), else the most similar name, or None.
+        """
+        match = self.lookup(text, kinds)
+        if match is not None:
+            return match + (1.0,)
+        matches = self.fuzzy(text, kinds, limit=1)
+        return matches[0] if matches else None
+
+    def mentions(self, question, max_words=8):
+        """
+        Finds the longest runs of words in a question that match a known name once folded.
+
+        Returns:
+            list: (start, end, kind, name) tuples in order of appearance.
+        """
+        words = list(WORD.finditer(question))
+        found, i = [], 0
+        while i < len(words):
+            for n in range(min(max_words, len(words) - i), 0, -1):
+                start, end = words[i].start(), words[i + n - 1].end()
+                text = question[start:end].rstrip(".")
+                # A single lowercase word is only taken as a genre, never as an author or a title like "It".
+                kinds = KINDS if n > 1 or text[:1].isupper() else ("genre",)
+                match = self.lookup(text, kinds)
+                if match:
+                    found.append((start, start + len(text)) + match)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+
+class ResolutionStats:
+    """
+    Counts how the names mentioned in Cypher questions were resolved and how many Cypher queries found
+    nothing. An empty result usually sends the agent into another round of reasoning and Cypher.
+    """
+
+    def __init__(self):
+        self.mentions = 0
+        self.exact = 0
+        self.fuzzy = 0
+        self.unresolved = 0
+        self.queries = 0
+        self.empty_results = 0
+        self._lock = threading.Lock()
+
+    def record_mention(self, match):
+        with self._lock:
+            self.mentions += 1
+            if match is None:
+                self.unresolved += 1
+            elif match[2] < 1.0:
+                self.fuzzy += 1
+            else:
+                self.exact += 1
+
+    def record_query(self, empty):
+        with self._lock:
+            self.queries += 1
+            self.empty_results += bool(empty)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "mentions": self.mentions,
+                "exact_matches": self.exact,
+                "fuzzy_matches": self.fuzzy,
+                "unresolved": self.unresolved,
+                "cypher_queries": self.queries,
+                "empty_results": self.empty_results,
+                "empty_result_rate": self.empty_results / self.queries if self.queries else 0.0,
+            }
+
+
+class CatalogueEntities:
+    """
+    Keeps an EntityIndex of the graph's names in line with the catalogue version written by ingestion,
+    checking the version at most every check_interval seconds. Rebuilds run in a background thread;
+    lookups use the previous index until the new one is built.
+    """
+
+    def __init__(self, graph, check_interval=60, min_similarity=0.75):
+        self.graph = graph
+        self.check_interval = check_interval
+        self.min_similarity = min_similarity
+        self._index = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def index(self):
+        """
+        Returns the current index, waiting for the first one to be built.
+        """
+        with self._lock:
+            if self._checked_at is None or time.monotonic() - self._checked_at > self.check_interval:
+                self._checked_at = time.monotonic()
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._refresh, name="entity-index-refresh", daemon=True)
+                    self._thread.start()
+            thread = self._thread
+        if self._index is None:
+            thread.join()
+        if self._index is None:
+            # The first build failed; lookups find nothing until a later check succeeds.
+            return EntityIndex({}, min_similarity=self.min_similarity)
+        return self._index
+
+    def find(self, question):
+        """
+        Returns (kind, name) for every known name in a question, in order of appearance.
+        """
+        return [(kind, name) for _, _, kind, name in self.index().mentions(question)]
+
+    def _refresh(self):
+        try:
+            records = self.graph.query(CATALOGUE_VERSION)
+            version = records[0]["version"] if records else None
+            if self._index is not None and self._index.version == version:
+                return
+            started = time.perf_counter()
+            names = {kind: [row["name"] for row in self.graph.query(query)] for kind, query in NAME_QUERIES.items()}
+            index = EntityIndex(names, version=version, min_similarity=self.min_similarity)
+            self._index = index
+            logging.info("Built the entity index of %d names in %.1fs (about %.0f MB).", len(index),
+                         time.perf_counter() - started, index.nbytes() / 2 ** 20)
+        except Exception as e:
+            logging.error("Failed to build the entity index: %s", e)
+
+
+entity_stats = ResolutionStats()
+
+
+def entity_resolution_enabled():
+    return os.getenv("ENTITY_RESOLUTION", "1").lower() not in ("0", "false", "no")
+
+
+@lazy_resource
+def get_catalogue_entities():
+    return CatalogueEntities(
+        get_graph(),
+        check_interval=float(os.getenv("ENTITY_INDEX_CHECK_INTERVAL", 60)),
+        min_similarity=float(os.getenv("ENTITY_FUZZY_THRESHOLD", 0.75)),
+    )
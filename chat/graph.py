@@ -1,5 +1,10 @@
 import os
+import threading
+import time
 from langchain_community.graphs import Neo4jGraph
+from neo4j import AsyncGraphDatabase
+from resources import lazy_resource
+from tracing import TracedAsyncDriver, TracedDriver
 
 def create_neo4j_graph():
     """
@@ -11,6 +16,9 @@ def create_neo4j_graph():
     environment variables and handling connections directly within
     other parts of your codebase.
 
+    The schema is not introspected here; get_graph_schema loads it when it is first needed.
+    The driver is wrapped so that its queries are timed in the trace of the current chat turn.
+
     Returns:
         Neo4jGraph: An instance of Neo4jGraph connected to the specified Neo4j database.
     """
@@ -20,7 +28,52 @@ def create_neo4j_graph():
     password = os.getenv("NEO4J_PASSWORD")
 
     # Create and return a Neo4jGraph object
-    return Neo4jGraph(url=url, username=username, password=password)
+    graph = Neo4jGraph(url=url, username=username, password=password, refresh_schema=False)
+    graph._driver = TracedDriver(graph._driver)
+    return graph
+
+# The Neo4j graph shared by the whole process, connected on first use
+get_graph = lazy_resource(create_neo4j_graph)
+
+@lazy_resource
+def get_async_driver():
+    """
+    Returns the pooled Neo4j async driver shared by the process, used by the async query path.
+
+    The pool holds at most NEO4J_MAX_CONCURRENCY connections (default 16), which caps the number of
+    queries in flight; further queries wait for a free connection. Its queries are timed in the
+    trace of the current chat turn.
+
+    Returns:
+        AsyncDriver: The driver.
+    """
+    return TracedAsyncDriver(AsyncGraphDatabase.driver(
+        os.getenv("NEO4J_URI"),
+        auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")),
+        max_connection_pool_size=int(os.getenv("NEO4J_MAX_CONCURRENCY", 16)),
+    ))
 
-# Instantiate the Neo4j graph using the function defined above
-graph = create_neo4j_graph()
+_schema_lock = threading.Lock()
+_schema_loaded_at = None
+
+def get_graph_schema(refresh=False):
+    """
+    Returns the schema of the graph as text for Cypher generation prompts.
+
+    The schema is introspected on first use and again when it is older than GRAPH_SCHEMA_TTL
+    seconds (default 3600), or immediately when refresh is True, e.g. after an ingestion run.
+
+    Args:
+        refresh (bool): Reload the schema even if the cached one is still fresh.
+
+    Returns:
+        str: The graph schema.
+    """
+    global _schema_loaded_at
+    graph = get_graph()
+    ttl = float(os.getenv("GRAPH_SCHEMA_TTL", 3600))
+    with _schema_lock:
+        if refresh or _schema_loaded_at is None or time.monotonic() - _schema_loaded_at > ttl:
+            graph.refresh_schema()
+            _schema_loaded_at = time.monotonic()
+        return graph.schema
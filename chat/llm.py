@@ -1,35 +1,73 @@
 import os
+import httpx
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from embedding_cache import CachedEmbeddings
+from embedding_projection import ProjectedEmbeddings
+from resources import lazy_resource
+from shared.embedding_cache import EmbeddingCache
+from shared.embedding_projection import EmbeddingProjection
 
-def initialize_openai_services():
+@lazy_resource
+def get_http_client():
     """
-    Initializes and returns OpenAI services for chat and embeddings.
+    Returns the pooled async HTTP client shared by the OpenAI chat and embeddings clients.
 
-    This function configures services using API keys and model information 
-    retrieved from environment variables, encapsulating the initialization 
-    logic to enhance modularity and reduce code duplication across your application.
+    The pool holds at most LLM_MAX_CONCURRENCY connections (default 8), which caps the number of
+    OpenAI requests in flight; further requests wait for a free connection.
 
     Returns:
-        tuple: A tuple containing instances of ChatOpenAI and OpenAIEmbeddings.
+        httpx.AsyncClient: The client.
     """
-    # Retrieve OpenAI API key and model names from environment variables
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    chat_model = os.getenv("OPENAI_GEN_MODEL")
-    embeddings_model = os.getenv("EMBEDDING_MODEL")
+    max_connections = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                 max_keepalive_connections=max_connections))
+
+@lazy_resource
+def get_llm():
+    """
+    Returns the OpenAI chat model shared by the process, created on first use.
+
+    The API key and model name are read from environment variables.
+    Tokens are streamed so the UI can show the answer as it is written.
 
-    # Initialize the OpenAI chat model
-    llm = ChatOpenAI(
-        openai_api_key=openai_api_key,
-        model=chat_model,
+    Returns:
+        ChatOpenAI: The chat model.
+    """
+    return ChatOpenAI(
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        model=os.getenv("OPENAI_GEN_MODEL"),
+        streaming=True,
+        http_async_client=get_http_client(),
     )
 
-    # Initialize the OpenAI embeddings model
+@lazy_resource
+def get_embeddings():
+    """
+    Returns the OpenAI embeddings model shared by the process, created on first use.
+
+    If EMBEDDING_CACHE_PATH is set, query embeddings are served from a persistent
+    on-disk cache so identical questions are only embedded once. If EMBEDDING_PROJECTION_PATH names a file,
+    they are projected like the plot vectors ingestion stored; see embedding_projection.py. Ingestion only
+    writes that file when it reduces the stored vectors, so a missing file means full-width vectors.
+
+    Returns:
+        Embeddings: OpenAIEmbeddings, wrapped in CachedEmbeddings when the cache is enabled and in
+        ProjectedEmbeddings when a projection is configured.
+    """
+    embeddings_model = os.getenv("EMBEDDING_MODEL")
     embeddings = OpenAIEmbeddings(
-        openai_api_key=openai_api_key,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
         model=embeddings_model,
+        http_async_client=get_http_client(),
     )
 
-    return llm, embeddings
+    cache_path = os.getenv("EMBEDDING_CACHE_PATH")
+    if cache_path:
+        cache = EmbeddingCache(cache_path, max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1_000_000)))
+        embeddings = CachedEmbeddings(embeddings, cache, embeddings_model, os.getenv("DIMENSIONS"))
+
+    projection_path = os.getenv("EMBEDDING_PROJECTION_PATH")
+    if projection_path and os.path.exists(projection_path):
+        embeddings = ProjectedEmbeddings(embeddings, EmbeddingProjection.load(projection_path))
 
-# Get instances of OpenAI chat and embeddings services
-llm, embeddings = initialize_openai_services()
+    return embeddings
@@ -0,0 +1,440 @@
+"""
+An in-process, memory-mapped copy of the plot embeddings for the "Books Plot Search" tool.
+
+The vectors of every book are exported from Neo4j into a float32 matrix on disk, next to a JSON
+file with the title, authors and summary of each row. Searches run in the process with NumPy (or
+with an optional hnswlib index for large catalogues) instead of going to the summaryPlots index
+over the network. The matrix is memory-mapped read-only, so all worker processes on a host share
+one copy in the page cache.
+
+If ingestion stored the plot vectors at a reduced width together with int8 or float16 copies of the
+full-width embeddings (see embedding_projection.py), the export keeps those copies too. A search then
+takes rescore_candidates times as many candidates from the reduced vectors and reorders them by their
+full-width similarity, which recovers most of the recall the reduction costs.
+
+The export is refreshed incrementally when ingestion records a new catalogue version: only books
+whose contentHash changed are fetched again. To build or refresh it by hand, e.g. after ingestion:
+
+    python local_index.py
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from embedding_projection import aembed_query_full, embed_query_full
+from shared.embedding_projection import decode_rescore_vectors, rescore_precision
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+CATALOGUE_VERSION = "MATCH (m:IngestMeta {id: 'catalogue'}) RETURN m.version AS version"
+
+BOOK_HASHES = """
+MATCH (b:Book) WHERE b.plotEmbeddingSummury IS NOT NULL
+RETURN b.title AS title, b.contentHash AS contentHash
+"""
+
+BOOK_ROWS = """
+UNWIND $titles AS title
+MATCH (b:Book {title: title})
+RETURN b.title AS title, b.contentHash AS contentHash, b.summary AS summary,
+       [(b)-[:WRITTEN_BY]->(author) | author.name] AS authors, b.plotEmbeddingSummury AS vector,
+       b.plotEmbeddingRescore AS rescore
+"""
+
+
+def _ensure_writable(directory):
+    """
+    Creates directory if needed and fails with an explicit message if this user cannot write to it.
+    """
+    try:
+        os.makedirs(directory, exist_ok=True)
+        writable = os.access(directory, os.W_OK | os.X_OK)
+    except OSError as e:
+        raise PermissionError(f"Cannot create the plot index directory {os.path.abspath(directory)}: {e}. "
+                              "Set PLOT_INDEX_DIR to a directory this user can write, e.g. a volume.") from e
+    if not writable:
+        raise PermissionError(f"The plot index directory {os.path.abspath(directory)} is not writable by this user. "
+                              "Set PLOT_INDEX_DIR to a directory this user can write, e.g. a volume.")
+
+
+class LocalPlotIndex:
+    """
+    Searches a memory-mapped export of the plot embeddings.
+
+    Files in directory:
+    - manifest.json: the generation, catalogue version, dimensions and row count of the export.
+    - vectors-<generation>.npy: the unit-normalized float32 vectors, one row per book.
+    - rescore-<generation>.npy: the optional int8 or float16 full-width vectors, one row per book.
+    - scales-<generation>.npy: the float32 scale of every int8 rescore row.
+    - books-<generation>.json: the title, authors, summary and contentHash of every row.
+    - hnsw-<generation>.bin: the optional approximate index.
+
+    A refresh writes a new generation and then replaces the manifest, so readers in other
+    processes switch over atomically the next time they check it. The files of the previous
+    generation are kept until the next refresh, so a reader that read the manifest just before the
+    switch can still map the generation it names.
+    """
+
+    def __init__(self, directory, similarity_function="cosine", hnsw_min_rows=None, rescore_candidates=4):
+        """
+        Args:
+            directory (str): Where the export is stored.
+            similarity_function (str): The similarity of the Neo4j index, 'cosine' or 'euclidean'; scores use the same scale.
+            hnsw_min_rows (int, optional): Build and use an hnswlib index from this many rows on, if hnswlib is installed.
+            rescore_candidates (int): How many times k candidates are rescored with the full-width vectors, if there are any.
+
+        Raises:
+            PermissionError: If directory cannot be created or written, since refreshes write the export there.
+        """
+        self.directory = directory
+        self.similarity_function = similarity_function
+        self.hnsw_min_rows = hnsw_min_rows
+        self.rescore_candidates = max(int(rescore_candidates), 1)
+        self.manifest = None
+        self.vectors = None
+        self.books = []
+        self.hnsw = None
+        self.rescore = None
+        self.scales = None
+        self._lock = threading.Lock()
+        _ensure_writable(directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read_manifest(self):
+        try:
+            with open(self._path("manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """
+        Maps the generation named in the manifest if it is not the loaded one.
+
+        Returns:
+            bool: True if an export is loaded.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return False
+        if self.manifest and manifest["generation"] == self.manifest["generation"]:
+            return True
+        generation = manifest["generation"]
+        vectors = np.load(self._path(f"vectors-{generation}.npy"), mmap_mode="r")
+        with open(self._path(f"books-{generation}.json")) as f:
+            books = json.load(f)
+        hnsw = None
+        if manifest.get("hnsw") and hnswlib is not None:
+            hnsw = hnswlib.Index(space="ip", dim=manifest["dimensions"])
+            hnsw.load_index(self._path(f"hnsw-{generation}.bin"), max_elements=len(books))
+            hnsw.set_ef(64)
+        rescore = scales = None
+        if manifest.get("rescore"):
+            rescore = np.load(self._path(f"rescore-{generation}.npy"), mmap_mode="r")
+            if manifest["rescore"] == "int8":
+                scales = np.load(self._path(f"scales-{generation}.npy"))
+        with self._lock:
+            self.manifest, self.vectors, self.books, self.hnsw = manifest, vectors, books, hnsw
+            self.rescore, self.scales = rescore, scales
+        logging.info("Loaded local plot index generation %s with %d books.", generation, len(books))
+        return True
+
+    def search(self, vector, k=4, full_vector=None):
+        """
+        Finds the k books whose plot embeddings are most similar to a vector. If the export has rescore
+        vectors and the full-width query embedding is given, more candidates are taken and reordered by
+        their full-width similarity.
+
+        Returns:
+            list: (book, score) tuples, best first. Scores match those of the Neo4j vector index.
+        """
+        with self._lock:
+            vectors, books, hnsw, rescore, scales = self.vectors, self.books, self.hnsw, self.rescore, self.scales
+        if vectors is None or not len(books):
+            return []
+        query = np.array(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        k = min(k, len(books))
+        rescoring = rescore is not None and full_vector is not None
+        candidates = min(k * self.rescore_candidates, len(books)) if rescoring else k
+        if hnsw is not None:
+            hnsw.set_ef(max(64, candidates))
+            labels, distances = hnsw.knn_query(query, k=candidates)
+            rows, similarities = labels[0], 1.0 - distances[0]
+        else:
+            similarities = vectors @ query
+            rows = np.argpartition(-similarities, candidates - 1)[:candidates]
+            rows = rows[np.argsort(-similarities[rows])]
+            similarities = similarities[rows]
+        if rescoring:
+            full = np.array(full_vector, dtype=np.float32)
+            full /= np.linalg.norm(full) or 1.0
+            exact = np.asarray(rescore[rows], dtype=np.float32)
+            if scales is not None:
+                exact *= scales[rows, None]
+            similarities = exact @ full
+            best = np.argsort(-similarities)[:k]
+            rows, similarities = rows[best], similarities[best]
+        return [(books[row], self._score(similarity)) for row, similarity in zip(rows, similarities)]
+
+    def _score(self, cosine):
+        cosine = float(cosine)
+        if self.similarity_function == "euclidean":
+            # Neo4j scores euclidean similarity as 1 / (1 + d^2); for unit vectors d^2 = 2 - 2 cos.
+            return 1.0 / (1.0 + max(2.0 - 2.0 * cosine, 0.0))
+        return (1.0 + cosine) / 2.0
+
+    def refresh(self, driver, database, version):
+        """
+        Brings the export up to date with Neo4j, fetching only the books whose contentHash changed.
+        Runs under a file lock, so one process per host refreshes while the others wait and then load the result.
+
+        Args:
+            driver (Driver): A synchronous Neo4j driver.
+            database (str): The Neo4j database.
+            version (str): The catalogue version the export will be marked with.
+
+        Returns:
+            dict: The number of books kept, fetched and removed.
+        """
+        with open(self._path("refresh.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.read_manifest()
+            try:
+                self.load()
+            except Exception as e:
+                # The books of a generation that cannot be mapped are exported again.
+                logging.warning("Failed to load the local plot index, exporting it again: %s", e)
+                manifest = None
+            if manifest and manifest.get("version") == version:
+                return {"kept": manifest["count"], "fetched": 0, "removed": 0}
+            return self._write_generation(driver, database, version)
+
+    def _write_generation(self, driver, database, version):
+        old_rows = {book["title"]: (row, book) for row, book in enumerate(self.books)}
+        records, _, _ = driver.execute_query(BOOK_HASHES, database_=database)
+        current = {record["title"]: record["contentHash"] for record in records}
+
+        keep = [title for title, content_hash in current.items()
+                if title in old_rows and content_hash is not None and old_rows[title][1]["contentHash"] == content_hash]
+        kept = set(keep)
+        fetch = [title for title in current if title not in kept]
+        fetched = {}
+        for start in range(0, len(fetch), 1000):
+            rows, _, _ = driver.execute_query(BOOK_ROWS, titles=fetch[start:start + 1000], database_=database)
+            for record in rows:
+                fetched[record["title"]] = record
+
+        titles = keep + [title for title in fetch if title in fetched]
+        dimensions = (len(next(iter(fetched.values()))["vector"]) if fetched
+                      else self.vectors.shape[1] if self.vectors is not None else 0)
+        generation = uuid.uuid4().hex
+        vectors = np.lib.format.open_memmap(self._path(f"vectors-{generation}.npy"), mode="w+",
+                                            dtype=np.float32, shape=(len(titles), dimensions))
+        books = []
+        for row, title in enumerate(titles):
+            if title in fetched:
+                record = fetched[title]
+                vector = np.asarray(record["vector"], dtype=np.float32)
+                vectors[row] = vector / (np.linalg.norm(vector) or 1.0)
+                books.append({"title": title, "authors": record["authors"], "summary": record["summary"],
+                              "contentHash": record["contentHash"]})
+            else:
+                old_row, book = old_rows[title]
+                vectors[row] = self.vectors[old_row]
+                books.append(book)
+        vectors.flush()
+        with open(self._path(f"books-{generation}.json"), "w") as f:
+            json.dump(books, f)
+        precision = self._write_rescore(generation, titles, fetched, old_rows)
+
+        use_hnsw = hnswlib is not None and self.hnsw_min_rows is not None and len(titles) >= self.hnsw_min_rows
+        if use_hnsw:
+            hnsw = hnswlib.Index(space="ip", dim=dimensions)
+            hnsw.init_index(max_elements=len(titles), ef_construction=200, M=16)
+            hnsw.add_items(np.asarray(vectors), np.arange(len(titles)))
+            hnsw.save_index(self._path(f"hnsw-{generation}.bin"))
+        del vectors
+
+        previous = self.read_manifest()
+        manifest = {"generation": generation, "version": version, "dimensions": dimensions, "count": len(titles),
+                    "hnsw": use_hnsw, "rescore": precision, "created": time.time(),
+                    "previous": previous["generation"] if previous else None}
+        temporary = self._path("manifest.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temporary, self._path("manifest.json"))
+        self._remove_old_generations((generation, manifest["previous"]))
+        self.load()
+
+        stats = {"kept": len(keep), "fetched": len(fetched), "removed": len(old_rows.keys() - current.keys())}
+        logging.info("Refreshed local plot index to version %s: %d kept, %d fetched, %d removed.",
+                     version, stats["kept"], stats["fetched"], stats["removed"])
+        return stats
+
+    def _write_rescore(self, generation, titles, fetched, old_rows):
+        """
+        Writes the rescore vectors of a new generation if every book has them in one precision.
+
+        Returns:
+            str: The precision, or None if the generation has no rescore vectors.
+        """
+        precisions = {rescore_precision(fetched[title].get("rescore")) for title in titles if title in fetched}
+        if len(fetched) < len(titles):
+            precisions.add(self.manifest.get("rescore") if self.manifest else None)
+        precision = precisions.pop() if len(precisions) == 1 else None
+        if precision is None:
+            return None
+
+        fetched_rows = [row for row, title in enumerate(titles) if title in fetched]
+        decoded, decoded_scales = None, None
+        if fetched_rows:
+            _, decoded, decoded_scales = decode_rescore_vectors([fetched[titles[row]]["rescore"] for row in fetched_rows])
+        dimensions = decoded.shape[1] if decoded is not None else self.rescore.shape[1]
+        rescore = np.lib.format.open_memmap(self._path(f"rescore-{generation}.npy"), mode="w+",
+                                            dtype=np.int8 if precision == "int8" else np.float16,
+                                            shape=(len(titles), dimensions))
+        scales = np.ones(len(titles), dtype=np.float32)
+        kept_rows = [row for row, title in enumerate(titles) if title not in fetched]
+        if kept_rows:
+            old = [old_rows[titles[row]][0] for row in kept_rows]
+            rescore[kept_rows] = self.rescore[old]
+            if self.scales is not None:
+                scales[kept_rows] = self.scales[old]
+        if fetched_rows:
+            rescore[fetched_rows] = decoded
+            if decoded_scales is not None:
+                scales[fetched_rows] = decoded_scales
+        rescore.flush()
+        del rescore
+        if precision == "int8":
+            np.save(self._path(f"scales-{generation}.npy"), scales)
+        return precision
+
+    def _remove_old_generations(self, keep):
+        # Processes that still map an old generation keep their mapping; the files just lose their names.
+        for name in os.listdir(self.directory):
+            kind, _, rest = name.partition("-")
+            if kind in ("vectors", "books", "hnsw", "rescore", "scales") and rest.split(".")[0] not in keep:
+                os.remove(self._path(name))
+
+
+class LocalIndexRefresher:
+    """
+    Keeps a LocalPlotIndex in line with the catalogue version, checking it at most every check_interval seconds.
+    Refreshes run in a background thread; searches use the previous generation until it is done.
+    """
+
+    def __init__(self, index, graph, check_interval=60):
+        self.index = index
+        self.graph = graph
+        self.check_interval = check_interval
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_fresh(self, wait=False):
+        """
+        Starts a refresh if the catalogue changed since the export. With wait, or if there is no
+        export yet, waits for the refresh to finish.
+        """
+        with self._lock:
+            due = self._checked_at is None or time.monotonic() - self._checked_at > self.check_interval
+            if not due and not wait:
+                return
+            self._checked_at = time.monotonic()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._refresh, name="plot-index-refresh", daemon=True)
+                self._thread.start()
+            thread = self._thread
+        if wait or self.index.manifest is None:
+            thread.join()
+
+    def _refresh(self):
+        try:
+            self.index.load()
+        except Exception as e:
+            # refresh exports an index that cannot be loaded again.
+            logging.warning("Failed to load the local plot index: %s", e)
+        try:
+            records, _, _ = self.graph._driver.execute_query(CATALOGUE_VERSION, database_=self.graph._database)
+            version = records[0]["version"] if records else None
+            if self.index.manifest is None or self.index.manifest.get("version") != version:
+                self.index.refresh(self.graph._driver, self.graph._database, version)
+        except Exception as e:
+            logging.error("Failed to refresh the local plot index: %s", e)
+
+
+class LocalPlotRetriever(BaseRetriever):
+    """
+    A LangChain retriever over a LocalPlotIndex that returns the same documents as the Neo4j
+    searches of tools/vector.py: the summary as content, the title, authors and score as metadata.
+    While no export can be loaded, queries go to the retriever returned by fallback, if given.
+    """
+
+    index: LocalPlotIndex
+    refresher: LocalIndexRefresher
+    embeddings: object
+    fallback: object = None
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def ready(self):
+        """
+        Returns whether an export is loaded, waiting for the first one if there is none yet.
+        """
+        self.refresher.ensure_fresh()
+        return self.index.vectors is not None
+
+    def _documents(self, vector, k, full_vector=None):
+        self.refresher.ensure_fresh()
+        return [
+            Document(page_content=book["summary"] or "",
+                     metadata={"book_title": book["title"], "author": book["authors"], "score": score})
+            for book, score in self.index.search(vector, k, full_vector)
+        ]
+
+    async def asearch(self, query, k=None):
+        """
+        Embeds a query with the async client and returns the k closest documents. The search runs in
+        a worker thread, as the first call may wait for the initial export.
+        """
+        vector, full_vector = await aembed_query_full(self.embeddings, query)
+        return await asyncio.to_thread(self._documents, vector, k or self.k, full_vector)
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        if self.fallback is not None and not self.ready():
+            return self.fallback().invoke(query)
+        vector, full_vector = embed_query_full(self.embeddings, query)
+        return self._documents(vector, self.k, full_vector)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        if self.fallback is not None and not await asyncio.to_thread(self.ready):
+            return await asyncio.to_thread(lambda: self.fallback().invoke(query))
+        return await self.asearch(query)
+
+if __name__ == "__main__":
+    from graph import get_graph
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = LocalPlotIndex(os.getenv("PLOT_INDEX_DIR", "plot_index"), os.getenv("SIMILARITY_FUNCTION", "cosine"),
+                           hnsw_min_rows=int(os.getenv("PLOT_INDEX_HNSW_MIN_ROWS", 100_000)),
+                           rescore_candidates=int(os.getenv("PLOT_INDEX_RESCORE_CANDIDATES", 4)))
+    LocalIndexRefresher(index, get_graph()).ensure_fresh(wait=True)
+    print(json.dumps(index.manifest, indent=2))
@@ -0,0 +1,246 @@
+import logging
+import threading
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import SystemMessage, get_buffer_string, messages_from_dict
+from langchain_core.prompts import PromptTemplate
+
+from tracing import span
+
+SESSION_INDEX = "CREATE CONSTRAINT session_id IF NOT EXISTS FOR (s:Session) REQUIRE s.id IS UNIQUE"
+
+# The number of out-of-window messages folded into the summary by one summarizer call.
+MAX_FOLD_MESSAGES = 20
+
+SUMMARY_PROMPT = PromptTemplate.from_template("""
+Progressively summarize the conversation between a reader and a librarian chatbot, adding the new lines to the previous summary.
+Keep the books, authors, genres and preferences the reader mentioned. Use at most {max_words} words.
+
+Previous summary:
+{summary}
+
+New lines:
+{new_lines}
+
+New summary:
+""")
+
+_index_lock = threading.Lock()
+_indexed_drivers = set()
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimates the number of tokens of a text (about four characters per token for English).
+    """
+    return len(text) // 4 + 1
+
+
+def llm_summarizer(llm, max_tokens=300):
+    """
+    Returns a summarizer that asks the LLM to fold new messages into the previous summary.
+
+    Args:
+        llm: The chat model.
+        max_tokens (int): The approximate size of the summary.
+
+    Returns:
+        callable: summarize(summary, messages) -> str.
+    """
+    chain = SUMMARY_PROMPT | llm
+
+    def summarize(summary, messages):
+        return chain.invoke({
+            "summary": summary or "(none)",
+            "new_lines": get_buffer_string(messages),
+            "max_words": int(max_tokens * 0.75),
+        }).content.strip()
+
+    return summarize
+
+
+def ensure_session_index(graph):
+    """
+    Creates the unique constraint on Session.id once per driver, so every session lookup is an index seek.
+    """
+    with _index_lock:
+        if id(graph._driver) in _indexed_drivers:
+            return
+        graph._driver.execute_query(SESSION_INDEX, database_=graph._database)
+        _indexed_drivers.add(id(graph._driver))
+
+
+class SummarizedChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history of a session that keeps the last window_turns turns verbatim and a rolling summary
+    of everything older on the Session node.
+
+    Messages use the same graph layout as Neo4jChatMessageHistory, a NEXT chain of Message nodes
+    hanging off (:Session)-[:LAST_MESSAGE]->, so existing sessions keep working. Reading the history
+    is a single query that seeks the session by its indexed id and walks back at most
+    2 * window_turns messages, so its cost does not grow with the length of the session.
+
+    When messages drop out of the window they are folded into Session.summary by the summarizer,
+    which runs on the given executor when there is one so the turn is not delayed by it.
+    Session.summarizedCount records how many messages the summary covers and makes concurrent
+    folds of the same session safe: a fold that lost the race is discarded.
+    """
+
+    def __init__(self, session_id, graph, summarizer=None, window_turns=3, token_budget=1500, executor=None):
+        """
+        Args:
+            session_id (str): The session id.
+            graph (Neo4jGraph): The graph whose driver is used.
+            summarizer (callable, optional): summarize(summary, messages) -> str; without one no summary is kept.
+            window_turns (int): The number of most recent turns passed verbatim.
+            token_budget (int): The approximate maximum size of the summary and messages together.
+            executor (Executor, optional): Runs the summarizer in the background.
+        """
+        if not session_id:
+            raise ValueError("Please ensure that the session_id parameter is provided")
+        self.session_id = session_id
+        self.graph = graph
+        self.summarizer = summarizer
+        self.window = 2 * window_turns
+        self.token_budget = token_budget
+        self.executor = executor
+        ensure_session_index(graph)
+
+    def _query(self, query, **params):
+        records, _, _ = self.graph._driver.execute_query(
+            query, dict(params, session_id=self.session_id), database_=self.graph._database
+        )
+        return records
+
+    @property
+    def messages(self):
+        """
+        The summary of older turns as a system message, followed by the most recent messages that fit the token budget.
+        """
+        with span("history", "read history") as attributes:
+            records = self._query(f"""
+            MATCH (s:Session {{id: $session_id}})
+            OPTIONAL MATCH (s)-[:LAST_MESSAGE]->(last:Message)
+            OPTIONAL MATCH p = (last)<-[:NEXT*0..{max(self.window - 1, 0)}]-(:Message)
+            WITH s, p ORDER BY length(p) DESC LIMIT 1
+            RETURN s.summary AS summary,
+                   [node IN reverse(coalesce(nodes(p), [])) | {{type: node.type, data: {{content: node.content}}}}] AS messages
+            """)
+            attributes["messages"] = len(records[0]["messages"]) if records else 0
+        if not records:
+            return []
+        summary = records[0]["summary"]
+        # With a window of 0 turns the history is the summary alone.
+        recent = messages_from_dict(records[0]["messages"]) if self.window else []
+
+        budget = self.token_budget - (estimate_tokens(summary) if summary else 0)
+        kept = []
+        for message in reversed(recent):
+            budget -= estimate_tokens(message.content)
+            if budget < 0:
+                break
+            kept.append(message)
+        kept.reverse()
+        return ([SystemMessage(content=f"Summary of the earlier conversation: {summary}")] if summary else []) + kept
+
+    @messages.setter
+    def messages(self, messages):
+        raise NotImplementedError("Direct assignment to 'messages' is not allowed. Use the 'add_messages' instead.")
+
+    def add_message(self, message):
+        """
+        Appends a message to the session and schedules a summary update when turns leave the window.
+        """
+        with span("history", f"write {message.type} message"):
+            records = self._query("""
+            MERGE (s:Session {id: $session_id})
+            ON CREATE SET s.messageCount = 0, s.summarizedCount = 0
+            WITH s
+            OPTIONAL MATCH (s)-[lm:LAST_MESSAGE]->(last:Message)
+            // Sessions written before messages were counted are counted once.
+            WITH s, lm, last, coalesce(s.messageCount,
+                 CASE WHEN last IS NULL THEN 0 ELSE size([(last)<-[:NEXT*0..]-(m:Message) | m]) END) AS count
+            CREATE (s)-[:LAST_MESSAGE]->(new:Message {type: $type, content: $content})
+            FOREACH (_ IN CASE WHEN last IS NULL THEN [] ELSE [1] END | CREATE (last)-[:NEXT]->(new))
+            DELETE lm
+            SET s.messageCount = count + 1
+            RETURN s.messageCount AS count, coalesce(s.summarizedCount, 0) AS summarized
+            """, type=message.type, content=message.content)
+        count, summarized = records[0]["count"], records[0]["summarized"]
+
+        # Fold whole turns: start once a user message and its answer have both left the window.
+        if self.summarizer is not None and count - self.window - summarized >= 2:
+            if self.executor is not None:
+                self.executor.submit(self._fold_safely)
+            else:
+                self._fold_safely()
+
+    def _fold_safely(self):
+        try:
+            self.fold()
+        except Exception as e:
+            logging.warning("Failed to update the summary of session %s: %s", self.session_id, e)
+
+    def fold(self):
+        """
+        Folds the oldest messages that left the window, at most MAX_FOLD_MESSAGES of them, into the summary.
+
+        Returns:
+            int: The number of messages folded, 0 if there was nothing to fold or another fold updated the summary first.
+        """
+        # Walk back a bit further than needed, so messages added since the fold was scheduled are covered.
+        records = self._query(f"""
+        MATCH (s:Session {{id: $session_id}})-[:LAST_MESSAGE]->(last:Message)
+        MATCH p = (last)<-[:NEXT*0..{self.window + 2 * MAX_FOLD_MESSAGES}]-(:Message)
+        WITH s, p ORDER BY length(p) DESC LIMIT 1
+        RETURN s.summary AS summary, s.messageCount AS count, coalesce(s.summarizedCount, 0) AS summarized,
+               [node IN reverse(nodes(p)) | {{type: node.type, data: {{content: node.content}}}}] AS messages
+        """)
+        if not records:
+            return 0
+        record = records[0]
+        path = messages_from_dict(record["messages"])
+        # The path holds the last len(path) messages of the session in chronological order.
+        first = record["count"] - len(path)
+        if record["summarized"] < first:
+            logging.warning("Session %s fell %d messages behind its summary; they are left out.",
+                            self.session_id, first - record["summarized"])
+        start = max(record["summarized"], first)
+        stop = min(record["count"] - self.window, start + MAX_FOLD_MESSAGES)
+        if stop <= start:
+            return 0
+        messages = path[start - first:stop - first]
+
+        summary = self.summarizer(record["summary"], messages)
+        updated = self._query("""
+        MATCH (s:Session {id: $session_id})
+        WHERE coalesce(s.summarizedCount, 0) = $summarized
+        SET s.summary = $summary, s.summarizedCount = $stop
+        RETURN count(s) AS updated
+        """, summary=summary, summarized=record["summarized"], stop=stop)
+        return stop - record["summarized"] if updated[0]["updated"] else 0
+
+    def clear(self):
+        """
+        Deletes the messages and the summary of the session.
+        """
+        self._query("""
+        MATCH (s:Session {id: $session_id})
+        OPTIONAL MATCH (s)-[:LAST_MESSAGE]->(last:Message)
+        OPTIONAL MATCH (last)<-[:NEXT*0..]-(m:Message)
+        DETACH DELETE m
+        WITH DISTINCT s
+        SET s.messageCount = 0, s.summarizedCount = 0
+        REMOVE s.summary
+        """)
+
+    def delete(self):
+        """
+        Deletes the session together with its messages.
+        """
+        self._query("""
+        MATCH (s:Session {id: $session_id})
+        OPTIONAL MATCH (s)-[:LAST_MESSAGE]->(last:Message)
+        OPTIONAL MATCH (last)<-[:NEXT*0..]-(m:Message)
+        DETACH DELETE m, s
+        """)
@@ -0,0 +1,241 @@
+"""
+Plan-and-execute answering, an alternative to the ReAct agent selected with AGENT_MODE=plan.
+
+The ReAct agent makes one LLM call per tool call and runs the tools one after another. Here the LLM
+is asked once for a plan: a short list of tool calls, each naming the earlier calls whose results it
+needs. Calls without pending dependencies run concurrently, dependent ones start as soon as their
+inputs are ready, and one more LLM call writes the answer from all the results. A question that needs
+two lookups takes two LLM calls of the agent's own instead of three, and its lookups overlap.
+"""
+import asyncio
+import json
+import logging
+import re
+
+from langchain.schema import StrOutputParser
+from langchain_core.messages import get_buffer_string
+from langchain_core.prompts import PromptTemplate
+
+from tracing import span
+
+JSON_VALUE = re.compile(r"[\[{].*[\]}]", re.S)
+
+plan_prompt = PromptTemplate.from_template("""
+You plan the tool calls a librarian chatbot needs to answer a question about the books in a Neo4j database.
+
+TOOLS:
+------
+
+{tools}
+
+Reply with the plan as JSON and nothing else, in the form
+{{"steps": [{{"id": "s1", "tool": "<one of [{tool_names}]>", "input": "<the input of the tool>", "depends_on": []}}]}}
+
+Steps that do not depend on each other run at the same time, so put every independent lookup in its own step.
+A step that needs the result of earlier steps lists their ids in depends_on and can quote a result in its input as {{s1}}.
+Use at most {max_steps} steps. If no tool is needed, reply with {{"steps": []}}.
+
+Previous conversation history:
+{chat_history}
+
+Question: {input}
+""")
+
+synthesis_prompt = PromptTemplate.from_template("""
+The chatbot, modeled as a librarian, should display traits such as attentiveness, thoroughness, and a deep passion for literature.
+Answer the question from the results of the tool calls below, which come from the Neo4j database. Do not answer any questions using your pre-trained knowledge, only use the information in these results and the conversation history, and say so if they do not answer the question.
+Do not answer any questions that do not relate to books, authors, or genres.
+
+Previous conversation history:
+{chat_history}
+
+Tool results:
+{results}
+
+Question: {input}
+Answer:""")
+
+
+def parse_plan(text, tool_names, max_steps):
+    """
+    Parses the plan the LLM wrote.
+
+    Args:
+        text (str): The LLM's reply.
+        tool_names (list): The names of the tools a step may use.
+        max_steps (int): The maximum number of steps; later steps are dropped.
+
+    Returns:
+        list: The steps, dictionaries with 'id', 'tool', 'input' and 'depends_on', in an order in
+        which every step comes after the steps it depends on.
+
+    Raises:
+        ValueError: If the reply is not a valid plan.
+    """
+    match = JSON_VALUE.search(text)
+    if match is None:
+        raise ValueError("the reply contains no JSON")
+    try:
+        plan = json.loads(match.group(0))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"the reply is not valid JSON: {e}") from None
+    raw_steps = plan.get("steps") if isinstance(plan, dict) else plan
+    if not isinstance(raw_steps, list):
+        raise ValueError("the plan has no list of steps")
+
+    steps = []
+    for position, raw in enumerate(raw_steps[:max_steps], start=1):
+        if not isinstance(raw, dict):
+            raise ValueError(f"step {position} is not an object")
+        step_id = str(raw.get("id") or f"s{position}")
+        tool, tool_input = raw.get("tool"), raw.get("input")
+        if tool not in tool_names:
+            raise ValueError(f"step {step_id} uses the unknown tool {tool!r}")
+        if not isinstance(tool_input, str) or not tool_input.strip():
+            raise ValueError(f"step {step_id} has no input")
+        if any(step["id"] == step_id for step in steps):
+            raise ValueError(f"the step id {step_id} is used twice")
+        depends_on = raw.get("depends_on") or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        earlier = {step["id"] for step in steps}
+        # Only earlier steps can be waited for, which also rules out cycles.
+        unknown = [str(dependency) for dependency in depends_on if str(dependency) not in earlier]
+        if unknown:
+            raise ValueError(f"step {step_id} depends on {', '.join(unknown)}, which are not earlier steps")
+        steps.append({"id": step_id, "tool": tool, "input": tool_input.strip(),
+                      "depends_on": [str(dependency) for dependency in depends_on]})
+    return steps
+
+
+def tool_text(output):
+    """
+    Returns the text of a tool result: the answer of the plot search, the result of the Cypher tool,
+    or the reply of the general chat.
+    """
+    if isinstance(output, dict):
+        return str(output.get("answer") or output.get("result") or output)
+    return str(output)
+
+
+def step_input(step, results):
+    """
+    Fills the results of the steps a step depends on into its input: in place of their {id}
+    references, or appended if the input does not quote them.
+    """
+    text = step["input"]
+    for dependency in step["depends_on"]:
+        reference = "{" + dependency + "}"
+        if reference in text:
+            text = text.replace(reference, results[dependency])
+        else:
+            text += f"\n\nResult of an earlier lookup: {results[dependency]}"
+    return text
+
+
+class PlanAndExecuteAgent:
+    """
+    Answers a question with one planning LLM call, concurrent tool calls and one synthesis LLM call.
+    """
+
+    def __init__(self, llm, tools, max_steps=4):
+        """
+        Args:
+            llm (BaseChatModel): The model that plans and writes the answer.
+            tools (list): The tools a plan may use.
+            max_steps (int): The maximum number of tool calls per question.
+        """
+        self.tools = {tool.name: tool for tool in tools}
+        self.max_steps = max_steps
+        self.planner = (plan_prompt.partial(
+            tools="\n".join(f"> {tool.name}: {tool.description}" for tool in tools),
+            tool_names=", ".join(self.tools), max_steps=str(max_steps),
+        ) | llm | StrOutputParser()).with_config(run_name="planner")
+        self.synthesizer = (synthesis_prompt | llm | StrOutputParser()).with_config(run_name="synthesis")
+
+    async def aplan(self, user_input, history):
+        """
+        Asks the LLM for a plan.
+
+        Args:
+            user_input (str): The question.
+            history (list): The messages of the chat history.
+
+        Returns:
+            list: The steps (see parse_plan), or None if the LLM did not write a valid plan.
+        """
+        reply = await self.planner.ainvoke({"input": user_input, "chat_history": get_buffer_string(history)})
+        try:
+            steps = parse_plan(reply, list(self.tools), self.max_steps)
+        except ValueError as e:
+            logging.warning("Unusable plan, falling back to the ReAct agent: %s", e)
+            return None
+        logging.info("Planned %d tool calls: %s", len(steps), ", ".join(step["tool"] for step in steps))
+        return steps
+
+    async def aexecute(self, steps, events=None):
+        """
+        Runs the tool calls of a plan, each as soon as the steps it depends on are done.
+
+        Args:
+            steps (list): The steps of the plan.
+            events (asyncio.Queue, optional): Receives ("tool", message) when a tool call starts.
+
+        Returns:
+            dict: The text result of every step by id. A failed tool call yields its error message,
+            so the answer can still use the other results.
+        """
+        tasks = {}
+
+        async def run(step):
+            dependencies = await asyncio.gather(*(tasks[dependency] for dependency in step["depends_on"]))
+            tool_input = step_input(step, dict(zip(step["depends_on"], dependencies)))
+            if events is not None:
+                events.put_nowait(("tool", f"Using {step['tool']}: {tool_input}"))
+            try:
+                return tool_text(await self.tools[step["tool"]].ainvoke(tool_input))
+            except Exception as e:
+                logging.warning("Planned %s call failed: %s", step["tool"], e)
+                return f"The lookup failed: {e}"
+
+        for step in steps:
+            tasks[step["id"]] = asyncio.ensure_future(run(step))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        return {step_id: task.result() for step_id, task in tasks.items()}
+
+    async def aanswer(self, user_input, history, steps, events=None):
+        """
+        Executes a plan and writes the answer.
+
+        Args:
+            user_input (str): The question.
+            history (list): The messages of the chat history.
+            steps (list): The plan returned by aplan.
+            events (asyncio.Queue, optional): Receives ("tool", message) events and ("token", text)
+                for the pieces of the answer as the LLM writes them.
+
+        Returns:
+            str: The answer.
+        """
+        with span("plan", "execute plan", steps=len(steps)):
+            results = await self.aexecute(steps, events)
+        inputs = {
+            "input": user_input,
+            "chat_history": get_buffer_string(history),
+            "results": "\n\n".join(f"{step['tool']} ({step['input']}):\n{results[step['id']]}" for step in steps)
+                       or "No tools were used.",
+        }
+        if events is None:
+            return await self.synthesizer.ainvoke(inputs)
+        answer = ""
+        async for text in self.synthesizer.astream(inputs):
+            if not answer:
+                text = text.lstrip()
+            if text:
+                answer += text
+                events.put_nowait(("token", text))
+        return answer
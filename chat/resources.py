@@ -0,0 +1,52 @@
+import functools
+import logging
+import threading
+import time
+
+_registry = []
+
+
+def lazy_resource(func):
+    """
+    Turns a factory into a lazily created, process-wide singleton.
+
+    The factory runs on the first call only, so importing a module that defines a resource costs
+    nothing; concurrent first calls wait for a single creation instead of racing. Because the
+    cache lives in the module, every Streamlit session and worker thread of the process shares it,
+    like st.cache_resource, without depending on Streamlit.
+
+    The wrapper has clear() to drop the instance, so the next call creates a new one, and created()
+    to tell whether the instance exists without creating it.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(func)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    started = time.perf_counter()
+                    instance.append(func())
+                    logging.info("Created %s in %.2fs.", func.__name__, time.perf_counter() - started)
+        return instance[0]
+
+    def clear():
+        with lock:
+            instance.clear()
+
+    def created():
+        return bool(instance)
+
+    get.clear = clear
+    get.created = created
+    _registry.append(get)
+    return get
+
+
+def clear_resources():
+    """
+    Drops every resource, e.g. after the configuration changed.
+    """
+    for resource in _registry:
+        resource.clear()
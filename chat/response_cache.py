@@ -0,0 +1,290 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from router import FOLLOW_UP
+
+# Questions about the reader's own taste or reading history; their answers are not shared.
+PERSONAL = re.compile(
+    r"\b(i (liked|loved|enjoyed|read|hated|prefer|like|love)|i've read|i have read|my (favou?rite|taste|list)|"
+    r"based on (what|my))\b", re.I)
+# Questions whose answer is meant to differ every time.
+RANDOM = re.compile(r"\b(random|surprise me|another)\b", re.I)
+PUNCTUATION = re.compile(r"[^\w\s']")
+NUMBER = re.compile(
+    r"\b(\d+(?:[.,]\d+)*|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|fifteen|twenty|"
+    r"thirty|fifty|hundred|dozen)\b", re.I)
+
+CATALOGUE_VERSION = "MATCH (m:IngestMeta {id: 'catalogue'}) RETURN m.version AS version"
+
+
+def normalize_question(question):
+    """
+    Lowercases a question and drops punctuation and repeated whitespace.
+    """
+    return " ".join(PUNCTUATION.sub(" ", question.casefold()).split())
+
+
+def is_cacheable(question):
+    """
+    Returns False for questions whose answer depends on the conversation history, on the reader
+    or on chance, which must never be served from the cache.
+    """
+    return not (FOLLOW_UP.search(question) or PERSONAL.search(question) or RANDOM.search(question))
+
+
+def question_literals(question, names=()):
+    """
+    Returns what a semantic cache hit must share with the cached question: the names it mentions and
+    its numbers. Questions like "books by Stephen King" and "books by Stephen Fry", or "top 5" and
+    "top 10", embed almost identically but must not share an answer.
+
+    Args:
+        question (str): The question.
+        names (iterable): The names the question mentions, as stored in the graph (see resolve_question).
+
+    Returns:
+        tuple: The folded names and numbers in order of appearance.
+    """
+    return (tuple(name.casefold() for name in names),
+            tuple(number.casefold().replace(",", "") for number in NUMBER.findall(question)))
+
+
+def history_scope(messages):
+    """
+    Returns the cache scope of a turn: None for the first turn of a session, whose answer can be shared,
+    and otherwise a hash of the history the answer may depend on.
+    """
+    if not messages:
+        return None
+    digest = hashlib.sha1()
+    for message in messages:
+        digest.update(f"{message.type}\x1f{message.content}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SemanticResponseCache:
+    """
+    Caches final answers by the embedding of the normalized question.
+
+    A question is answered from the cache when an entry has exactly the same normalized text, or
+    when the cosine similarity of their embeddings is at least threshold and both mention the same
+    names and numbers (see question_literals). Answers given with a conversation history are stored
+    under the scope of that history (see history_scope) and only match turns with the same history.
+    Entries expire after ttl seconds, the least recently used entry is evicted when the cache is full,
+    and the whole cache is dropped when the catalogue version written by ingestion changes.
+
+    The embeddings of the entries that may match each other, those with the same scope and literals,
+    are kept in one matrix, so a lookup is a single matrix product over its candidates.
+    """
+
+    def __init__(self, max_entries=1000, threshold=0.95, ttl=3600):
+        """
+        Args:
+            max_entries (int): The maximum number of cached answers.
+            threshold (float): The minimal cosine similarity of a semantic hit.
+            ttl (float): The lifetime of an entry in seconds.
+        """
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.version = None
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    def set_version(self, version):
+        """
+        Drops every entry if the catalogue version changed.
+        """
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    logging.info("Catalogue version changed to %s; dropping %d cached answers.", version, len(self._entries))
+                    self.invalidations += 1
+                self._entries.clear()
+                self._groups.clear()
+                self.version = version
+
+    def lookup_exact(self, question, scope=None):
+        """
+        Returns the cached answer of a question with the same normalized text in the same scope, or None.
+        """
+        with self._lock:
+            entry = self._live_entry(_entry_key(normalize_question(question), scope))
+            if entry is not None:
+                self.exact_hits += 1
+                self._entries.move_to_end(entry["key"])
+            return entry
+
+    def lookup_similar(self, vector, scope=None, literals=((), ())):
+        """
+        Returns the entry of the same scope and literals whose question embedding is most similar to
+        vector, if it reaches the threshold, or None.
+
+        Args:
+            vector (list): The embedding of the normalized question.
+            scope (str, optional): The history scope of the turn.
+            literals (tuple): The names and numbers of the question (see question_literals).
+        """
+        vector = _unit(vector)
+        with self._lock:
+            group = self._groups.get((scope, literals))
+            if group is None:
+                return None
+            similarities = group.similarities(vector)
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.threshold:
+                    break
+                entry = self._live_entry(group.keys[position])
+                if entry is not None:
+                    self.semantic_hits += 1
+                    self._entries.move_to_end(entry["key"])
+                    return entry
+            return None
+
+    def put(self, question, vector, answer, seconds, scope=None, literals=((), ())):
+        """
+        Stores the answer to a question.
+
+        Args:
+            question (str): The question.
+            vector (list): The embedding of the normalized question.
+            answer (str): The final answer.
+            seconds (float): How long the answer took, to estimate the time saved by hits.
+            scope (str, optional): The history scope of the answer, None if it can be shared.
+            literals (tuple): The names and numbers of the question (see question_literals).
+        """
+        key = _entry_key(normalize_question(question), scope)
+        entry = {
+            "key": key,
+            "scope": scope,
+            "literals": literals,
+            "vector": _unit(vector),
+            "answer": answer,
+            "seconds": seconds,
+            "expires": time.monotonic() + self.ttl,
+        }
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._groups.setdefault((scope, literals), _VectorGroup(len(entry["vector"]))).add(key, entry["vector"])
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def record_saved(self, entry, seconds):
+        with self._lock:
+            self.saved_seconds += max(entry["seconds"] - seconds, 0.0)
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_skipped(self):
+        with self._lock:
+            self.skipped += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            # Questions that were not cacheable were not served by the cache either.
+            lookups = hits + self.misses + self.skipped
+            return {
+                "hits": hits,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "invalidations": self.invalidations,
+                "saved_seconds": self.saved_seconds,
+            }
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry["expires"] < time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        group_key = (entry["scope"], entry["literals"])
+        group = self._groups[group_key]
+        group.remove(key)
+        if not group.keys:
+            del self._groups[group_key]
+
+
+class _VectorGroup:
+    """
+    The unit embeddings of a group of entries as the rows of one matrix, which grows by doubling.
+    A removed row is replaced by the last one, so the rows stay contiguous.
+    """
+
+    def __init__(self, dimensions):
+        self.keys = []
+        self._positions = {}
+        self._matrix = np.empty((4, dimensions), dtype=np.float32)
+
+    def similarities(self, vector):
+        return self._matrix[:len(self.keys)] @ vector
+
+    def add(self, key, vector):
+        if len(self.keys) == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.empty_like(self._matrix)])
+        self._matrix[len(self.keys)] = vector
+        self._positions[key] = len(self.keys)
+        self.keys.append(key)
+
+    def remove(self, key):
+        position = self._positions.pop(key)
+        last = self.keys.pop()
+        if last != key:
+            self._matrix[position] = self._matrix[len(self.keys)]
+            self.keys[position] = last
+            self._positions[last] = position
+
+
+def _entry_key(question, scope):
+    return f"{scope}:{question}" if scope else question
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class CatalogueVersion:
+    """
+    Reads the catalogue version from the IngestMeta node written by ingestion, at most once every check_interval seconds.
+    """
+
+    def __init__(self, check_interval=30):
+        self.check_interval = check_interval
+        self.version = None
+        self._checked_at = None
+
+    async def current(self, driver, database):
+        """
+        Returns the catalogue version, querying Neo4j when the last check is older than check_interval.
+        """
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.check_interval:
+            records, _, _ = await driver.execute_query(CATALOGUE_VERSION, database_=database)
+            self.version = records[0]["version"] if records else None
+            self._checked_at = time.monotonic()
+        return self.version
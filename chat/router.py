@@ -0,0 +1,238 @@
+import logging
+import os
+import re
+import threading
+
+from entity_index import get_catalogue_entities
+from resources import lazy_resource
+from tools.cypher import BOOK_DETAILS, BOOKS_BY_AUTHOR, RANDOM_BOOK, SIMILAR_BOOKS, TOP_RATED_IN_GENRE, get_cypher_guard
+from tools.vector import get_book_plot
+
+# Words that refer back to earlier turns; such questions need the conversation history and go to the agent.
+FOLLOW_UP = re.compile(
+    r"\b(them|another|more like|something else|previous|again|same|the author|"
+    r"(this|that|these|those) (one|ones|book|books|author|genre))\b", re.I)
+# "it" only refers back to an earlier turn when the question names nothing itself; "what is it about?" after
+# a title, or a book called "It", stays on the fast path.
+PRONOUN = re.compile(r"\bit\b", re.I)
+RECOMMEND = re.compile(r"\b(recommend|suggest|suggestion|what should i read|random|pick (me )?a book|surprise me)\b", re.I)
+BY_AUTHOR = re.compile(r"\b(by|from|written by|wrote|books of|works of|author)\b", re.I)
+DETAILS = re.compile(r"\b(about|tell me|details?|information|info|who wrote|when was|rating|summary|plot of)\b", re.I)
+SIMILAR = re.compile(r"\b(similar to|books? like|reads? like|comparable to)\b", re.I)
+# Only explicit questions for the story of a named book take the plot fast path; descriptions of a topic
+# ("books about dragons") may carry conditions the plot search cannot honour.
+PLOT = re.compile(r"\b(plot|summary|summarize|synopsis|what happens in|what is (it|the book) about)\b", re.I)
+TOPIC = re.compile(r"\b(about|story|where|in which|involving|features?|follows?)\b", re.I)
+# Filters and aggregations need a generated Cypher query.
+FILTER = re.compile(
+    r"\b(how many|count|number of|average|most|least|top \d+|after|before|since|between|older|newer|"
+    r"rating|rated|published|above|below|over|under|more than|less than|at least|at most|\d{4})\b", re.I)
+
+# Example phrasings for the optional embedding classifier.
+INTENT_EXAMPLES = {
+    "random": [
+        "recommend me a book",
+        "what should I read next",
+        "suggest something good to read",
+    ],
+}
+
+
+class EmbeddingIntentClassifier:
+    """
+    Classifies a question by its cosine similarity to example phrasings of each intent.
+    Works with any LangChain Embeddings, e.g. a local sentence-transformers model.
+    """
+
+    def __init__(self, embeddings, examples=INTENT_EXAMPLES, threshold=0.8):
+        self.embeddings = embeddings
+        self.examples = examples
+        self.threshold = threshold
+        self._vectors = None
+
+    def classify(self, question):
+        """
+        Returns the best matching intent and its similarity, or (None, similarity) below the threshold.
+        """
+        if self._vectors is None:
+            self._vectors = {
+                intent: self.embeddings.embed_documents(texts) for intent, texts in self.examples.items()
+            }
+        query = self.embeddings.embed_query(question)
+        intent, score = max(
+            ((intent, max(_cosine(query, vector) for vector in vectors)) for intent, vectors in self._vectors.items()),
+            key=lambda item: item[1],
+        )
+        return (intent, score) if score >= self.threshold else (None, score)
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return dot / norm if norm else 0.0
+
+
+class RouterStats:
+    """
+    Counts the turns served by the fast path and estimates the latency it saved.
+    """
+
+    def __init__(self):
+        self.fast_turns = 0
+        self.agent_turns = 0
+        self.fast_seconds = 0.0
+        self.agent_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, fast_path, seconds):
+        with self._lock:
+            if fast_path:
+                self.fast_turns += 1
+                self.fast_seconds += seconds
+            else:
+                self.agent_turns += 1
+                self.agent_seconds += seconds
+
+    def as_dict(self):
+        with self._lock:
+            turns = self.fast_turns + self.agent_turns
+            fast_mean = self.fast_seconds / self.fast_turns if self.fast_turns else 0.0
+            agent_mean = self.agent_seconds / self.agent_turns if self.agent_turns else 0.0
+            return {
+                "turns": turns,
+                "fast_path_turns": self.fast_turns,
+                "fast_path_fraction": self.fast_turns / turns if turns else 0.0,
+                "fast_path_mean_seconds": fast_mean,
+                "agent_mean_seconds": agent_mean,
+                "estimated_seconds_saved": self.fast_turns * max(agent_mean - fast_mean, 0.0) if agent_mean else 0.0,
+            }
+
+
+class FastPathRouter:
+    """
+    Answers questions with an obvious intent without the ReAct agent.
+
+    Intents are recognised from keywords and from author, genre and title names found in the graph,
+    optionally backed by an embedding classifier. Confident intents are answered with a single
+    parameterized Cypher query or a plot search; everything else, including follow-up questions that
+    depend on the conversation history and questions with filters or aggregations, is left to the agent.
+    """
+
+    def __init__(self, catalogue, classifier=None):
+        self.catalogue = catalogue
+        self.classifier = classifier
+        self.stats = RouterStats()
+
+    def intent(self, question):
+        """
+        Returns (intent, entity name) for a confident intent, or None if the question is ambiguous.
+        """
+        if FOLLOW_UP.search(question):
+            return None
+        mentions = self.catalogue.find(question)
+        if not mentions and PRONOUN.search(question):
+            return None
+        # The fast-path queries take one name; "books by Stephen King and Neil Gaiman" goes to the agent.
+        if len(mentions) > 1:
+            return None
+        kinds = {kind for kind, _ in mentions}
+
+        if kinds == {"title"} and PLOT.search(question) and not FILTER.search(question):
+            return "plot", mentions[0][1]
+        if kinds == {"title"} and DETAILS.search(question):
+            return "details", mentions[0][1]
+        if FILTER.search(question):
+            return None
+        if kinds == {"title"} and SIMILAR.search(question):
+            return "similar", mentions[0][1]
+        if kinds == {"author"} and BY_AUTHOR.search(question):
+            return "author", mentions[0][1]
+        if kinds == {"genre"} and RECOMMEND.search(question):
+            return "genre", mentions[0][1]
+        if not mentions and RECOMMEND.search(question) and not TOPIC.search(question):
+            return "random", None
+        if not mentions and self.classifier is not None:
+            intent, _ = self.classifier.classify(question)
+            if intent:
+                return intent, None
+        return None
+
+    def route(self, question):
+        """
+        Answers a question on the fast path.
+
+        Returns:
+            str: The answer, or None if the question should go to the agent.
+        """
+        try:
+            routed = self.intent(question)
+        except Exception as e:
+            logging.warning("Fast-path routing failed, falling back to the agent: %s", e)
+            return None
+        if routed is None:
+            return None
+        intent, name = routed
+        try:
+            answer = self._answer(intent, name, question)
+        except Exception as e:
+            logging.warning("Fast-path %s answer failed, falling back to the agent: %s", intent, e)
+            return None
+        if answer:
+            logging.info("Fast path answered a %s question.", intent)
+        return answer
+
+    def _answer(self, intent, name, question):
+        if intent == "plot":
+            # Name the stored title, so that the search finds the book even if the question misspelled it.
+            query = question if name.lower() in question.lower() else f"{question} ({name})"
+            return get_book_plot(query)["answer"]
+
+        query = {"details": BOOK_DETAILS, "author": BOOKS_BY_AUTHOR, "genre": TOP_RATED_IN_GENRE, "random": RANDOM_BOOK,
+                 "similar": SIMILAR_BOOKS}[intent]
+        rows = get_cypher_guard().run(query, {"e0": name} if name else {})
+        if not rows:
+            return None
+        if intent == "similar":
+            return f"Books similar to {name} in our library:\n\n" + "\n".join(_book_line(row) for row in rows)
+        if intent == "author":
+            return f"Here are the books by {name} in our library:\n\n" + "\n".join(_book_line(row) for row in rows)
+        if intent == "genre":
+            return f"These are the best rated {name} books in our library:\n\n" + "\n".join(_book_line(row) for row in rows)
+        row = rows[0]
+        if intent == "random":
+            return f"How about this one?\n\n{_book_line(row)}\n\n{row['b.summary'] or ''}".strip()
+        genres = ", ".join(row["genres"])
+        return f"{_book_line(row)}\n\nGenres: {genres}\n\n{row['b.summary'] or ''}".strip()
+
+
+def _book_line(row):
+    authors = row.get("authors") or ([row["a.name"]] if row.get("a.name") else [])
+    line = f"- **{row['b.title']}**"
+    if authors:
+        line += f" by {', '.join(authors)}"
+    details = [str(value) for value in (row.get("b.publication_year"),) if value is not None]
+    if row.get("b.rating") is not None:
+        details.append(f"rated {row['b.rating']}")
+    return line + (f" ({', '.join(details)})" if details else "")
+
+
+def _intent_classifier():
+    """
+    Builds the optional embedding classifier from a local sentence-transformers model named in
+    ROUTER_EMBEDDING_MODEL. Routing works on keywords and names alone when it is unset or unavailable.
+    """
+    model_name = os.getenv("ROUTER_EMBEDDING_MODEL")
+    if not model_name:
+        return None
+    try:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=model_name)
+    except Exception as e:
+        logging.warning("Embedding intent classifier disabled: %s", e)
+        return None
+    return EmbeddingIntentClassifier(embeddings, threshold=float(os.getenv("ROUTER_EMBEDDING_THRESHOLD", 0.8)))
+
+
+@lazy_resource
+def get_router():
+    return FastPathRouter(get_catalogue_entities(), classifier=_intent_classifier())
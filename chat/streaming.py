@@ -0,0 +1,62 @@
+import queue
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+FINAL_ANSWER = "Final Answer:"
+
+
+class AgentStreamHandler(BaseCallbackHandler):
+    """
+    Turns the callbacks of a ReAct agent run into a queue of events:
+    ("tool", message) when the agent picks a tool, and ("token", text) for every token
+    of the final answer. Tokens before the "Final Answer:" marker of an LLM call are the
+    agent's reasoning and are not emitted.
+
+    The handler runs inline with the callbacks, so with an asyncio.Queue it can feed an async consumer
+    on the same event loop.
+    """
+
+    run_inline = True
+
+    def __init__(self, events=None):
+        """
+        Args:
+            events (queue.Queue or asyncio.Queue, optional): Receives the events; a new queue.Queue by default.
+        """
+        self.events = queue.Queue() if events is None else events
+        self._buffers = {}
+        self._streaming = set()
+        self.streamed = False
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._buffers[run_id] = ""
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._buffers[run_id] = ""
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self._streaming:
+            self._emit(token)
+            return
+        buffer = self._buffers.get(run_id, "") + token
+        marker = buffer.find(FINAL_ANSWER)
+        if marker == -1:
+            self._buffers[run_id] = buffer
+            return
+        self._buffers.pop(run_id, None)
+        self._streaming.add(run_id)
+        self._emit(buffer[marker + len(FINAL_ANSWER):].lstrip())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._buffers.pop(run_id, None)
+        self._streaming.discard(run_id)
+
+    def on_agent_action(self, action, **kwargs):
+        self.events.put_nowait(("tool", f"Using {action.tool}: {action.tool_input}"))
+
+    def _emit(self, text):
+        if not self.streamed:
+            text = text.lstrip()
+        if text:
+            self.streamed = True
+            self.events.put_nowait(("token", text))
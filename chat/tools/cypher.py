@@ -1,32 +1,48 @@
-from llm import llm
-from graph import graph
+import asyncio
+import logging
+import os
+from llm import get_llm
+from graph import get_async_driver, get_graph, get_graph_schema
+from resources import lazy_resource
+from concurrency import flight_key, get_background_loop, tool_calls
+from context_packing import pack_rows
 from langchain.prompts import PromptTemplate
+from neo4j.exceptions import Neo4jError
 
-from langchain_community.chains.graph_qa.cypher import GraphCypherQAChain
+from langchain_community.chains.graph_qa.cypher import GraphCypherQAChain, extract_cypher
+from entity_index import PROPERTIES, entity_resolution_enabled, entity_stats, get_catalogue_entities
+from tools.cypher_cache import CypherTemplateCache, extract_entities, question_shape, parameterize
+from tools.cypher_guard import CypherGuard, UnsafeCypherError
 
 CYPHER_GENERATION_TEMPLATE = """
 You are an expert Neo4j Developer translating user questions into Cypher to answer questions about books and provide recommendations based on a specific schema. Convert the user's question into an appropriate Cypher query.
 
 Instructions:
 - Use only the provided node types and their properties.
-- Handle author names and genre names with the correct case sensitivity as stored in the database.
+- Handle author names and genre names with the correct case sensitivity as stored in the database. Names listed after the question are spelled as stored; use them exactly.
 - Summary is what this book is about.
 - Only use a word as a genre if it specifically denotes a recognized literary genre (ex. Fiction, Historical). Do not use "positive" or other words, that does not mean a genre.
 - Provide examples for queries like:
   1. Find books by a specific author.name only:
   ```
-  MATCH (b)-[r:WRITTEN_BY]->(a: {{name: "Author Name"}})
-  RETURN b.title, b.publication_year, b.rating, a.name, b.sammary
+  MATCH (b:Book)-[r:WRITTEN_BY]->(a:Author {{name: "Author Name"}})
+  RETURN b.title, b.publication_year, b.rating, a.name, b.summary
   ```
-  2. If you're looking for similar books in the same genre:
+  2. If you're looking for books similar to a book, use the precomputed SIMILAR_TO relationships:
+  ```
+  MATCH (b:Book {{title: "Book name"}})-[s:SIMILAR_TO]->(b2:Book)
+  RETURN b2.title, b2.publication_year, b2.rating, b2.summary
+  ORDER BY s.score DESC
+  ```
+  If you're looking for similar books in the same genre:
   ```
   MATCH (b:Book {{title: "Book name"}})-[:HAS_GENRE]->(g:Genre)<-[:HAS_GENRE]-(b2:Book)
   RETURN b2.title, b2.publication_year, b2.rating, b2.summary
   ```
   3. Find detailed information about a specific book.name:
   ```
-  MATCH (b: {{title:"Book name"}})-[r:WRITTEN_BY]->(a)
-  MATCH (b)-[h:HAS_GENRE]->(g)
+  MATCH (b:Book {{title:"Book name"}})-[r:WRITTEN_BY]->(a:Author)
+  MATCH (b)-[h:HAS_GENRE]->(g:Genre)
   RETURN b.title, b.publication_year, b.rating, b.summary, a.name, g.name
   ```
   4. Find books of a specific genre with high book.rating:
@@ -46,12 +62,11 @@ Instructions:
   LIMIT 5
   ```
 
-  6. Recommend a random book if no specific criteria are given, you have to find one random book:
+  6. Recommend a random book if no specific criteria are given, you have to find one random book (books are numbered by seq from 0 to bookCount - 1):
   ```
-  MATCH (b)
+  MATCH (m:IngestMeta {{id: "catalogue"}})
+  MATCH (b:Book {{seq: toInteger(rand() * m.bookCount)}})
   RETURN b.title, b.publication_year, b.rating
-  ORDER BY rand()
-  LIMIT 1
   ```
 
 Schema: {schema}
@@ -64,9 +79,232 @@ cypher_generation_prompt = PromptTemplate(
     input_variables=["schema", "question"],
 )
 
-cypher_qa = GraphCypherQAChain.from_llm(
-    llm,
-    graph=graph,
-    cypher_prompt=cypher_generation_prompt,
-    verbose=True
+@lazy_resource
+def get_cypher_chain():
+    """
+    Returns the Cypher QA chain, created on first use. Its prompts are used with the cached schema
+    of get_graph_schema rather than the schema the chain was built with.
+    """
+    return GraphCypherQAChain.from_llm(
+        get_llm(),
+        graph=get_graph(),
+        cypher_prompt=cypher_generation_prompt,
+        verbose=True
+    )
+
+BOOKS_BY_AUTHOR = """
+MATCH (b:Book)-[:WRITTEN_BY]->(a:Author {name: $e0})
+RETURN b.title, b.publication_year, b.rating, a.name, b.summary
+"""
+
+BOOKS_IN_SAME_GENRE = """
+MATCH (b:Book {title: $e0})-[:HAS_GENRE]->(g:Genre)<-[:HAS_GENRE]-(b2:Book)
+WHERE b2 <> b
+RETURN DISTINCT b2.title, b2.publication_year, b2.rating, b2.summary
+"""
+
+# The similar books are bound to b, so that their columns are named like those of the other book queries.
+SIMILAR_BOOKS = """
+MATCH (seed:Book {title: $e0})-[s:SIMILAR_TO]->(b:Book)
+RETURN b.title, b.publication_year, b.rating, b.summary
+ORDER BY s.score DESC
+"""
+
+BOOK_DETAILS = """
+MATCH (b:Book {title: $e0})
+OPTIONAL MATCH (b)-[:WRITTEN_BY]->(a:Author)
+OPTIONAL MATCH (b)-[:HAS_GENRE]->(g:Genre)
+RETURN b.title, b.publication_year, b.rating, b.summary, collect(DISTINCT a.name) AS authors, collect(DISTINCT g.name) AS genres
+"""
+
+TOP_RATED_IN_GENRE = """
+MATCH (b:Book)-[:HAS_GENRE]->(g:Genre {name: $e0})
+OPTIONAL MATCH (b)-[:WRITTEN_BY]->(a:Author)
+RETURN b.title, b.publication_year, b.rating, collect(a.name) AS authors
+ORDER BY b.rating DESC
+LIMIT 10
+"""
+
+# Book.seq runs densely from 0 to bookCount - 1 (see download_data/similar_books.py), so a random
+# book is an index lookup rather than a sort of every book.
+RANDOM_BOOK = """
+MATCH (m:IngestMeta {id: 'catalogue'})
+MATCH (b:Book {seq: toInteger(rand() * m.bookCount)})
+OPTIONAL MATCH (b)-[:WRITTEN_BY]->(a:Author)
+RETURN b.title, b.publication_year, b.rating, b.summary, collect(a.name) AS authors
+"""
+
+# Question shapes whose Cypher is known without asking the LLM.
+SEED_TEMPLATES = {
+    "books by {e0}": BOOKS_BY_AUTHOR,
+    "books written by {e0}": BOOKS_BY_AUTHOR,
+    "find books by {e0}": BOOKS_BY_AUTHOR,
+    "show me books by {e0}": BOOKS_BY_AUTHOR,
+    "what books did {e0} write": BOOKS_BY_AUTHOR,
+    "books like {e0}": SIMILAR_BOOKS,
+    "books similar to {e0}": SIMILAR_BOOKS,
+    "find books similar to {e0}": SIMILAR_BOOKS,
+    "books in the same genre as {e0}": BOOKS_IN_SAME_GENRE,
+}
+
+cypher_cache = CypherTemplateCache(
+    max_entries=int(os.getenv("CYPHER_CACHE_SIZE", 512)),
+    seeds=SEED_TEMPLATES,
 )
+
+@lazy_resource
+def get_cypher_guard():
+    return CypherGuard(
+        get_graph(),
+        max_rows=int(os.getenv("CYPHER_MAX_ROWS", 10)),
+        max_scan_rows=int(os.getenv("CYPHER_MAX_SCAN_ROWS", 10_000)),
+        timeout=float(os.getenv("CYPHER_TIMEOUT", 10)),
+        async_driver=get_async_driver(),
+    )
+
+def pack_cypher_rows(rows):
+    """
+    Writes result rows as a compact table of at most CYPHER_CONTEXT_ROWS rows (default 10) and
+    CYPHER_CONTEXT_TOKENS tokens (default 600) for the answering LLM; see context_packing.py.
+    """
+    return pack_rows(rows, token_budget=int(os.getenv("CYPHER_CONTEXT_TOKENS", 600)),
+                     max_rows=int(os.getenv("CYPHER_CONTEXT_ROWS", 10)))
+
+def resolve_question(question, index=None):
+    """
+    Replaces the names a question mentions with the names as stored in the graph, so that misspelled,
+    differently cased or unaccented names still match. Mentions are the spans extract_entities finds,
+    resolved by folded or fuzzy lookup in the entity index, and known names written in lowercase.
+
+    Args:
+        question (str): The user question.
+        index (EntityIndex, optional): Defaults to the index of the catalogue.
+
+    Returns:
+        tuple: The question with the stored names, its shape and slot parameters (see question_shape)
+        and the question for Cypher generation, which lists the property of every resolved name.
+    """
+    spans = extract_entities(question)
+    if not entity_resolution_enabled():
+        shape, params = question_shape(question, spans)
+        return question, shape, params, question
+    index = get_catalogue_entities().index() if index is None else index
+
+    resolved = []
+    for start, end, text in spans:
+        match = index.resolve(text)
+        entity_stats.record_mention(match)
+        resolved.append((start, end, match[1] if match else text, match[0] if match else None))
+    for start, end, kind, name in index.mentions(question):
+        # Capitalized and quoted mentions were resolved above.
+        if question[start:start + 1].islower() and not any(s < end and start < e for s, e, _, _ in resolved):
+            entity_stats.record_mention((kind, name, 1.0))
+            resolved.append((start, end, name, kind))
+    resolved.sort()
+
+    parts, position = [], 0
+    for start, end, name, _ in resolved:
+        parts += [question[position:start], name]
+        position = end
+    canonical = "".join(parts) + question[position:]
+    shape, params = question_shape(question, [(start, end, name) for start, end, name, _ in resolved])
+    hints = [f'"{name}" ({PROPERTIES[kind]})' for _, _, name, kind in resolved if kind]
+    generation_question = canonical + (f"\nNames: {', '.join(hints)}" if hints else "")
+    return canonical, shape, params, generation_question
+
+async def _arun_cached(shape, params):
+    """
+    Runs the cached query of a question shape. Returns None if there is no usable cached query
+    or if it finds nothing, so the caller falls back to generating a new one.
+    """
+    entry = cypher_cache.get(shape)
+    if entry is None:
+        return None
+    cypher_guard = await asyncio.to_thread(get_cypher_guard)
+    try:
+        cypher = entry["cypher"] if entry["validated"] else await cypher_guard.acheck(entry["cypher"], params)
+        context = await cypher_guard.arun(cypher, params)
+    except (UnsafeCypherError, Neo4jError) as e:
+        logging.warning("Dropping cached Cypher for '%s': %s", shape, e)
+        cypher_cache.discard(shape)
+        return None
+    if context and not entry["validated"]:
+        cypher_cache.put(shape, cypher)
+    logging.info("Cypher cache hit for '%s' (%d rows).", shape, len(context))
+    return context or None
+
+async def _arun_generated(question, shape, params):
+    """
+    Asks the LLM for Cypher, checks it with the guard, runs it and caches it under the question shape
+    when it is fully parameterized and returns rows. The question is the generation question of
+    resolve_question.
+    """
+    cypher_guard = await asyncio.to_thread(get_cypher_guard)
+    cypher_chain = await asyncio.to_thread(get_cypher_chain)
+    schema = await asyncio.to_thread(get_graph_schema)
+    generated = extract_cypher(await cypher_chain.cypher_generation_chain.arun(
+        {"question": question, "schema": schema}
+    ))
+    parameterized = parameterize(generated, params)
+    cypher = await cypher_guard.acheck(parameterized or generated, params)
+    logging.info("Generated Cypher for '%s':\n%s", shape, cypher)
+    context = await cypher_guard.arun(cypher, params)
+    if context and parameterized:
+        cypher_cache.put(shape, cypher)
+    return context
+
+def _record_result(shape, context):
+    entity_stats.record_query(not context)
+    if not context:
+        stats = entity_stats.as_dict()
+        logging.info("Cypher for '%s' found nothing (%d of %d queries empty).", shape, stats["empty_results"],
+                     stats["cypher_queries"])
+
+def cypher_qa(question):
+    """
+    Answer a question about books using Cypher.
+
+    The names the question mentions are first replaced with the names as stored (see resolve_question).
+    Questions are reduced to a shape with entity slots (see question_shape). If a validated query is
+    cached for the shape, it runs with the question's entities as parameters and no Cypher is generated.
+    Otherwise the LLM writes Cypher, which is explained by the CypherGuard before it runs and rejected
+    if it would scan the whole graph. Every query runs read-only with a row cap and a timeout, and
+    its rows reach the answering LLM as a compact table (see pack_cypher_rows). The work is done by
+    acypher_qa on the background event loop, so the sync and async tools share one implementation.
+
+    Args:
+        question (str): The user question.
+
+    Returns:
+        dict: The question under 'query' and the answer under 'result'.
+    """
+    return get_background_loop().run(acypher_qa(question))
+
+async def acypher_qa(question):
+    """
+    Async version of cypher_qa, which calls it. Queries run on the shared async Neo4j driver, and
+    concurrent calls with the same question share one query and answer.
+
+    Args:
+        question (str): The user question.
+
+    Returns:
+        dict: The question under 'query' and the answer under 'result'.
+    """
+    async def answer():
+        canonical, shape, params, generation_question = await asyncio.to_thread(resolve_question, question)
+        try:
+            context = await _arun_cached(shape, params)
+            if context is None:
+                context = await _arun_generated(generation_question, shape, params)
+        except UnsafeCypherError as e:
+            return {"query": question, "result": f"The query for this question was rejected because {e}. Ask a more specific question."}
+        except Neo4jError as e:
+            return {"query": question, "result": f"The query for this question failed: {e.message}"}
+        _record_result(shape, context)
+
+        qa_chain = get_cypher_chain().qa_chain
+        result = await qa_chain.ainvoke({"question": canonical, "context": pack_cypher_rows(context)})
+        return {"query": question, "result": result[qa_chain.output_key]}
+
+    return await tool_calls.do(flight_key("cypher", question), answer)
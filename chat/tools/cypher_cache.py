@@ -0,0 +1,165 @@
+import re
+import threading
+from collections import OrderedDict
+
+# Capitalized words that start a question or an instruction rather than a name.
+LEADING_WORDS = {
+    "a", "an", "any", "are", "can", "could", "do", "does", "find", "give", "how", "i", "is", "list",
+    "me", "please", "recommend", "show", "suggest", "tell", "the", "what", "when", "where", "which",
+    "who", "whose", "why", "would", "books", "book",
+}
+# Lowercase words allowed inside a capitalized name, e.g. "The Lord of the Rings".
+NAME_CONNECTORS = {"of", "the", "and", "in", "on", "de", "da", "del", "van", "von", "der", "le", "la", "&"}
+
+QUOTED = re.compile(r'"([^"]+)"|“([^”]+)”|\'([^\']{2,})\'')
+WORD = re.compile(r"[\w'’.&-]+")
+STRING_LITERAL = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"")
+
+
+def extract_entities(question):
+    """
+    Finds the spans of a question that look like names: quoted text and runs of capitalized words.
+
+    Args:
+        question (str): The user question.
+
+    Returns:
+        list: (start, end, text) tuples in order of appearance.
+    """
+    spans = []
+    for match in QUOTED.finditer(question):
+        text = next(group for group in match.groups() if group)
+        spans.append((match.start(), match.end(), text.strip()))
+
+    words = [match for match in WORD.finditer(question)
+             if not any(start <= match.start() < end for start, end, _ in spans)]
+    i = 0
+    while i < len(words):
+        word = words[i].group().strip(".")
+        # "The" opens a title in the middle of a question ("similar to The Hobbit") but not at its start.
+        opens_title = word == "The" and i > 0 and i + 1 < len(words) and words[i + 1].group()[:1].isupper()
+        if not word[:1].isupper() or (word.lower() in LEADING_WORDS and not opens_title):
+            i += 1
+            continue
+        j = i + 1
+        last = i
+        while j < len(words) and question[words[j - 1].end():words[j].start()].strip() == "":
+            next_word = words[j].group().strip(".")
+            if next_word[:1].isupper():
+                last = j
+            elif next_word.lower() not in NAME_CONNECTORS:
+                break
+            j += 1
+        start, end = words[i].start(), words[last].end()
+        spans.append((start, end, question[start:end].rstrip(".")))
+        i = last + 1
+    return sorted(spans)
+
+def question_shape(question, entities=None):
+    """
+    Reduces a question to its shape: lowercase text with every entity replaced by a numbered slot.
+    Questions that only differ in the names they mention share a shape, e.g. "Books by Stephen King?"
+    and "books by Agatha Christie" both become "books by {e0}".
+
+    Args:
+        question (str): The user question.
+        entities (list, optional): (start, end, text) spans; defaults to extract_entities(question).
+
+    Returns:
+        tuple: The shape and a dict mapping slot names to entity texts.
+    """
+    entities = extract_entities(question) if entities is None else entities
+    parts, params, position = [], {}, 0
+    for i, (start, end, text) in enumerate(entities):
+        parts.append(question[position:start].lower())
+        parts.append("{e%d}" % i)
+        params[f"e{i}"] = text
+        position = end
+    parts.append(question[position:].lower())
+    shape = " ".join("".join(parts).split()).strip(" ?!.")
+    return shape, params
+
+def parameterize(cypher, params):
+    """
+    Replaces the string literals of a generated Cypher query that hold an entity of the question
+    with the matching $slot parameter.
+
+    Args:
+        cypher (str): The generated query.
+        params (dict): Slot names mapped to entity texts.
+
+    Returns:
+        str: The parameterized query, or None if an entity does not appear as a literal,
+        in which case the query cannot be reused for other entities.
+    """
+    slots = {text.casefold(): name for name, text in params.items()}
+    used = set()
+
+    def replace(match):
+        literal = match.group(1) if match.group(1) is not None else match.group(2)
+        name = slots.get(literal.casefold())
+        if name is None:
+            return match.group(0)
+        used.add(name)
+        return f"${name}"
+
+    parameterized = STRING_LITERAL.sub(replace, cypher)
+    return parameterized if used == set(params) else None
+
+
+class CypherTemplateCache:
+    """
+    A thread-safe LRU cache of validated, parameterized Cypher queries keyed by question shape.
+    """
+
+    def __init__(self, max_entries=512, seeds=None):
+        """
+        Args:
+            max_entries (int): The maximum number of cached shapes.
+            seeds (dict, optional): Shapes mapped to parameterized queries known up front. Seeds are
+                validated by the caller on first use, like freshly generated queries.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        for shape, cypher in (seeds or {}).items():
+            self._entries[shape] = {"cypher": cypher, "validated": False}
+
+    def get(self, shape):
+        """
+        Returns the cache entry of a shape as a dict with 'cypher' and 'validated', or None.
+        """
+        with self._lock:
+            entry = self._entries.get(shape)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(shape)
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, shape, cypher):
+        """
+        Stores a validated query for a shape, evicting the least recently used shape when full.
+        """
+        with self._lock:
+            self._entries[shape] = {"cypher": cypher, "validated": True}
+            self._entries.move_to_end(shape)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, shape):
+        with self._lock:
+            self._entries.pop(shape, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,153 @@
+import re
+from itertools import islice
+
+from neo4j import Query, READ_ACCESS, unit_of_work
+
+from tracing import db_ms, query_name, span
+
+TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+)\s*$", re.IGNORECASE)
+TRAILING_PARAMETER_LIMIT = re.compile(r"\bLIMIT\s+\$\w+\s*$", re.IGNORECASE)
+UNION = re.compile(r"\bUNION\b", re.IGNORECASE)
+
+
+class UnsafeCypherError(ValueError):
+    """Raised when a generated Cypher query would scan too much of the graph."""
+
+
+def plan_operators(plan):
+    """
+    Yields (operator, estimated rows) for a query plan and all of its children.
+    """
+    yield plan["operatorType"].split("@")[0], plan.get("args", {}).get("EstimatedRows", 0)
+    for child in plan.get("children", []):
+        yield from plan_operators(child)
+
+def enforce_limit(cypher, max_rows):
+    """
+    Makes sure a query returns at most max_rows rows by appending a LIMIT or lowering an existing one.
+    A trailing LIMIT only applies to the last branch of a UNION, so a UNION query is wrapped in a subquery
+    whose rows are limited as a whole.
+    """
+    cypher = cypher.strip().rstrip(";").rstrip()
+    if UNION.search(cypher):
+        return f"CALL {{\n{cypher}\n}}\nRETURN *\nLIMIT {max_rows}"
+    match = TRAILING_LIMIT.search(cypher)
+    if match:
+        if int(match.group(1)) > max_rows:
+            cypher = cypher[:match.start(1)] + str(max_rows)
+        return cypher
+    if TRAILING_PARAMETER_LIMIT.search(cypher):
+        # A parameterized limit is capped when the rows are fetched.
+        return cypher
+    return f"{cypher}\nLIMIT {max_rows}"
+
+
+class CypherGuard:
+    """
+    Checks generated Cypher before it runs and executes it with a row cap and a transaction timeout.
+
+    A query is rejected if its plan scans all nodes, builds a cartesian product, or scans a whole
+    label that the planner estimates to hold more than max_scan_rows nodes. Queries run in read
+    transactions, so generated Cypher can never modify the graph.
+    """
+
+    def __init__(self, graph, max_rows=10, max_scan_rows=10_000, timeout=10.0, async_driver=None):
+        """
+        Args:
+            graph (Neo4jGraph): The graph whose driver is used.
+            max_rows (int): The maximum number of rows a query may return.
+            max_scan_rows (int): The largest label scan a query may plan.
+            timeout (float): The transaction timeout in seconds.
+            async_driver (AsyncDriver, optional): The driver of acheck and arun.
+        """
+        self.graph = graph
+        self.max_rows = max_rows
+        self.max_scan_rows = max_scan_rows
+        self.timeout = timeout
+        self.async_driver = async_driver
+
+    def _session(self):
+        return self.graph._driver.session(database=self.graph._database, default_access_mode=READ_ACCESS)
+
+    def _async_session(self):
+        return self.async_driver.session(database=self.graph._database, default_access_mode=READ_ACCESS)
+
+    def check(self, cypher, params=None):
+        """
+        Caps the rows of a query and explains it.
+
+        Args:
+            cypher (str): The query.
+            params (dict, optional): The query parameters.
+
+        Returns:
+            str: The query with an enforced LIMIT.
+
+        Raises:
+            UnsafeCypherError: If the plan contains an unbounded scan or a cartesian product.
+        """
+        cypher = enforce_limit(cypher, self.max_rows)
+        with span("cypher", "EXPLAIN", query=cypher) as attributes, self._session() as session:
+            summary = session.run(Query("EXPLAIN " + cypher, timeout=self.timeout), params or {}).consume()
+            attributes["db_ms"] = db_ms(summary)
+        self._check_plan(summary.plan)
+        return cypher
+
+    async def acheck(self, cypher, params=None):
+        """
+        Async version of check, using the async driver.
+        """
+        cypher = enforce_limit(cypher, self.max_rows)
+        with span("cypher", "EXPLAIN", query=cypher) as attributes:
+            async with self._async_session() as session:
+                result = await session.run(Query("EXPLAIN " + cypher, timeout=self.timeout), params or {})
+                summary = await result.consume()
+            attributes["db_ms"] = db_ms(summary)
+        self._check_plan(summary.plan)
+        return cypher
+
+    def _check_plan(self, plan):
+        for operator, estimated_rows in plan_operators(plan):
+            if operator in ("AllNodesScan", "CartesianProduct"):
+                raise UnsafeCypherError(f"the query plan contains {operator}")
+            if operator == "NodeByLabelScan" and estimated_rows > self.max_scan_rows:
+                raise UnsafeCypherError(
+                    f"the query scans about {int(estimated_rows)} nodes of a label; filter by an indexed property"
+                )
+
+    def run(self, cypher, params=None):
+        """
+        Runs a checked query in a read transaction with the configured timeout.
+
+        Returns:
+            list: The result rows as dictionaries.
+        """
+        with span("cypher", query_name(cypher), query=cypher) as attributes:
+            @unit_of_work(timeout=self.timeout)
+            def work(tx):
+                result = tx.run(cypher, params or {})
+                rows = [record.data() for record in islice(result, self.max_rows)]
+                attributes["db_ms"] = db_ms(result.consume())
+                return rows
+
+            with self._session() as session:
+                rows = session.execute_read(work)
+            attributes["rows"] = len(rows)
+            return rows
+
+    async def arun(self, cypher, params=None):
+        """
+        Async version of run, using the async driver.
+        """
+        with span("cypher", query_name(cypher), query=cypher) as attributes:
+            @unit_of_work(timeout=self.timeout)
+            async def work(tx):
+                result = await tx.run(cypher, params or {})
+                rows = [record.data() for record in await result.fetch(self.max_rows)]
+                attributes["db_ms"] = db_ms(await result.consume())
+                return rows
+
+            async with self._async_session() as session:
+                rows = await session.execute_read(work)
+            attributes["rows"] = len(rows)
+            return rows
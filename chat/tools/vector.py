@@ -1,22 +1,26 @@
-import streamlit as st
-from llm import llm, embeddings
-from graph import graph
+import asyncio
+import logging
+import os
+import re
+from llm import get_llm, get_embeddings
+from graph import get_async_driver, get_graph
+from resources import lazy_resource
+from concurrency import flight_key, tool_calls
+from context_packing import STOP_WORDS, pack_documents
+from local_index import LocalIndexRefresher, LocalPlotIndex, LocalPlotRetriever
+from neo4j import RoutingControl
+from neo4j.exceptions import ClientError
 
 from langchain_community.vectorstores.neo4j_vector import Neo4jVector
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
 
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 
-neo4jvector = Neo4jVector.from_existing_index(
-    embeddings,
-    graph=graph,
-    index_name="summaryPlots",
-    node_label="Book",
-    text_node_property="summary",
-    embedding_node_property="plotEmbeddingSummury",
-    retrieval_query="""
-    
+RETRIEVAL_QUERY = """
 RETURN
     node.summary AS text,
     score,
@@ -25,9 +29,39 @@ RETURN
         author: [(node)-[:WRITTEN_BY]-(author) | author.name]
     } AS metadata
 """
-)
 
-retriever = neo4jvector.as_retriever()
+# The same search Neo4jVector runs for the retriever, for the async path.
+VECTOR_SEARCH = """
+CALL db.index.vector.queryNodes('summaryPlots', $k, $embedding)
+YIELD node, score
+""" + RETRIEVAL_QUERY
+
+# Vector and full-text search in one round trip, merged with reciprocal rank fusion: every hit
+# scores 1 / ($rrf_k + rank) in each list it appears in. Full-text hits on an author stand for
+# their books, so "the Tolkien book about a ring" finds The Lord of the Rings by either route.
+HYBRID_SEARCH = """
+CALL {
+    CALL db.index.vector.queryNodes('summaryPlots', $candidates, $embedding)
+    YIELD node
+    WITH collect(node) AS hits
+    UNWIND range(0, size(hits) - 1) AS rank
+    RETURN hits[rank] AS node, 1.0 / ($rrf_k + rank + 1) AS rrf
+    UNION ALL
+    CALL db.index.fulltext.queryNodes('bookSearch', $text, {limit: $candidates})
+    YIELD node AS hit
+    WITH collect(hit) AS hits
+    UNWIND range(0, size(hits) - 1) AS rank
+    WITH hits[rank] AS hit, rank
+    UNWIND CASE WHEN hit:Book THEN [hit] ELSE [(hit)<-[:WRITTEN_BY]-(book:Book) | book][..$candidates] END AS node
+    RETURN node, 1.0 / ($rrf_k + rank + 1) AS rrf
+}
+WITH node, sum(rrf) AS score
+ORDER BY score DESC
+LIMIT $k
+""" + RETRIEVAL_QUERY
+
+# Lucene query syntax characters; STOP_WORDS are too common to help a full-text match.
+LUCENE_SPECIAL = re.compile(r'[+\-&|!(){}\[\]^"~*?:\\/]')
 
 instructions = (
     "Use the given context to answer the question."
@@ -42,15 +76,145 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-question_answer_chain = create_stuff_documents_chain(llm, prompt)
-plot_retriever = create_retrieval_chain(
-    retriever, 
-    question_answer_chain
-)
+def plot_retriever_mode():
+    """
+    Returns the plot search selected by PLOT_RETRIEVER: 'hybrid' (the default) combines the
+    summaryPlots vector index with the bookSearch full-text index, 'vector' uses the vector index
+    alone and 'local' the in-process index of local_index.py.
+    """
+    return os.getenv("PLOT_RETRIEVER", "hybrid").lower()
+
+def fulltext_query(text):
+    """
+    Turns a question into a Lucene query of its significant words, or an empty string if it has none.
+    """
+    words = LUCENE_SPECIAL.sub(" ", text).split()
+    return " ".join(word for word in words if word.lower() not in STOP_WORDS and word not in ("AND", "OR", "NOT"))
+
+def hybrid_search(input, embedding, k=4):
+    """
+    Returns the query and parameters of a hybrid search, or of a vector search if the input has no significant words.
+    """
+    text = fulltext_query(input)
+    if not text:
+        return VECTOR_SEARCH, {"k": k, "embedding": embedding}
+    parameters = {
+        "k": k,
+        "embedding": embedding,
+        "text": text,
+        "candidates": int(os.getenv("HYBRID_CANDIDATES", 4 * k)),
+        "rrf_k": int(os.getenv("HYBRID_RRF_K", 60)),
+    }
+    return HYBRID_SEARCH, parameters
+
+def _documents(records):
+    return [Document(page_content=record["text"], metadata=dict(record["metadata"], score=record["score"]))
+            for record in records]
+
+def pack_plots(input, documents):
+    """
+    Packs retrieved plot documents into PLOT_CONTEXT_TOKENS tokens (default 800) for the answering LLM; see context_packing.py.
+    """
+    return pack_documents(input, documents, token_budget=int(os.getenv("PLOT_CONTEXT_TOKENS", 800)))
+
+def _packed(retriever):
+    # Retrieves the documents of a retrieval chain input and packs them.
+    def retrieve(inputs):
+        return pack_plots(inputs["input"], retriever.invoke(inputs["input"]))
+
+    async def aretrieve(inputs):
+        return pack_plots(inputs["input"], await retriever.ainvoke(inputs["input"]))
+
+    return RunnableLambda(retrieve, afunc=aretrieve)
+
+class HybridPlotRetriever(BaseRetriever):
+    """
+    Retrieves plot summaries with the hybrid search of HYBRID_SEARCH. Falls back to the vector
+    index alone if the bookSearch full-text index does not exist yet.
+    """
+
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        graph = get_graph()
+        embedding = get_embeddings().embed_query(query)
+        cypher, parameters = hybrid_search(query, embedding, self.k)
+        try:
+            records, _, _ = graph._driver.execute_query(
+                cypher, parameters_=parameters, database_=graph._database, routing_=RoutingControl.READ)
+        except ClientError as e:
+            if cypher is VECTOR_SEARCH:
+                raise
+            logging.warning("Hybrid plot search failed, using the vector index alone: %s", e)
+            records, _, _ = graph._driver.execute_query(
+                VECTOR_SEARCH, parameters_={"k": self.k, "embedding": embedding}, database_=graph._database,
+                routing_=RoutingControl.READ)
+        return _documents(records)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        return await asearch_plots(query, self.k)
+
+@lazy_resource
+def get_local_plot_retriever():
+    """
+    Returns the retriever over the memory-mapped export of the plot embeddings, created on first use.
+    """
+    index = LocalPlotIndex(
+        os.getenv("PLOT_INDEX_DIR", "plot_index"),
+        similarity_function=os.getenv("SIMILARITY_FUNCTION", "cosine"),
+        hnsw_min_rows=int(os.getenv("PLOT_INDEX_HNSW_MIN_ROWS", 100_000)),
+        rescore_candidates=int(os.getenv("PLOT_INDEX_RESCORE_CANDIDATES", 4)),
+    )
+    try:
+        index.load()
+    except Exception as e:
+        # The refresher exports the index again; the vector index answers until then.
+        logging.warning("Failed to load the local plot index, using the Neo4j vector index meanwhile: %s", e)
+    refresher = LocalIndexRefresher(index, get_graph(), check_interval=int(os.getenv("PLOT_INDEX_CHECK_INTERVAL", 60)))
+    return LocalPlotRetriever(index=index, refresher=refresher, embeddings=get_embeddings(),
+                              fallback=get_vector_plot_retriever)
+
+@lazy_resource
+def get_vector_plot_retriever():
+    """
+    Returns the retriever over the summaryPlots vector index alone, created on first use.
+    """
+    return Neo4jVector.from_existing_index(
+        get_embeddings(),
+        graph=get_graph(),
+        index_name="summaryPlots",
+        node_label="Book",
+        text_node_property="summary",
+        embedding_node_property="plotEmbeddingSummury",
+        retrieval_query=RETRIEVAL_QUERY,
+    ).as_retriever()
+
+@lazy_resource
+def get_plot_retriever():
+    """
+    Returns the retrieval chain over the plot embeddings, created on first use.
+    The search is selected by PLOT_RETRIEVER; see plot_retriever_mode.
+    """
+    mode = plot_retriever_mode()
+    if mode == "local":
+        retriever = get_local_plot_retriever()
+    elif mode == "hybrid":
+        retriever = HybridPlotRetriever()
+    else:
+        retriever = get_vector_plot_retriever()
+    return create_retrieval_chain(
+        _packed(retriever),
+        get_question_answer_chain()
+    )
+
+@lazy_resource
+def get_question_answer_chain():
+    return create_stuff_documents_chain(get_llm(), prompt)
 
 def get_book_plot(input):
     """
-    Retrieve book plot summaries based on a given input query.
+    Retrieve book plot summaries based on a given input query. The summaries are packed into a
+    token budget before they are handed to the answering LLM.
 
     Args:
         input (str): The input query for retrieving book plot summaries.
@@ -58,4 +222,58 @@ def get_book_plot(input):
     Returns:
         dict: The result from the retrieval chain, including plot summaries and associated metadata.
     """
-    return plot_retriever.invoke({"input": input})
+    return get_plot_retriever().invoke({"input": input})
+
+
+async def asearch_plots(input, k=4):
+    """
+    Finds the books whose summaries best match a query with the async Neo4j driver, or in the
+    in-process index if PLOT_RETRIEVER=local.
+
+    Args:
+        input (str): The query.
+        k (int): The number of books.
+
+    Returns:
+        list: Documents with the summary as content and the title and authors as metadata.
+    """
+    mode = plot_retriever_mode()
+    if mode == "local":
+        retriever = await asyncio.to_thread(get_local_plot_retriever)
+        if await asyncio.to_thread(retriever.ready):
+            return await retriever.asearch(input, k)
+        mode = "vector"
+    # The first call opens the embedding cache and loads the projection, which must not block the loop.
+    embeddings = await asyncio.to_thread(get_embeddings)
+    embedding = await embeddings.aembed_query(input)
+    # The same database as the sync path and the rest of the chat, as chosen by Neo4jGraph.
+    database = (await asyncio.to_thread(get_graph))._database
+    vector_search = (VECTOR_SEARCH, {"k": k, "embedding": embedding})
+    cypher, parameters = hybrid_search(input, embedding, k) if mode == "hybrid" else vector_search
+    try:
+        records, _, _ = await get_async_driver().execute_query(
+            cypher, parameters_=parameters, database_=database, routing_=RoutingControl.READ)
+    except ClientError as e:
+        if cypher is VECTOR_SEARCH:
+            raise
+        logging.warning("Hybrid plot search failed, using the vector index alone: %s", e)
+        records, _, _ = await get_async_driver().execute_query(
+            VECTOR_SEARCH, parameters_=vector_search[1], database_=database, routing_=RoutingControl.READ)
+    return _documents(records)
+
+async def aget_book_plot(input):
+    """
+    Async version of get_book_plot. Concurrent calls with the same input share one search and answer.
+
+    Args:
+        input (str): The input query for retrieving book plot summaries.
+
+    Returns:
+        dict: The input, the packed documents under 'context' and the answer under 'answer'.
+    """
+    async def answer():
+        context = pack_plots(input, await asearch_plots(input))
+        result = await get_question_answer_chain().ainvoke({"input": input, "context": context})
+        return {"input": input, "context": context, "answer": result}
+
+    return await tool_calls.do(flight_key("plot", input), answer)
@@ -0,0 +1,602 @@
+"""
+Per-turn tracing of the chat service.
+
+Every chat turn records a span for each LLM call (with prompt and completion tokens and the time to
+the first token), tool call, retriever call, Cypher query (with its text and the time the database
+reported) and chat-history read or write. The spans of a turn are collected by a LangChain callback
+handler that is attached to every run started while the turn is active, by the timed Neo4j drivers of
+graph.py and by explicit spans in the code, and are exported when the turn ends:
+
+- to Prometheus histograms, served by the /metrics endpoint of the chat API;
+- to a JSON Lines file, one turn per line, if TRACE_JSONL_PATH is set;
+- to OpenTelemetry if TRACE_OTEL is set and opentelemetry is installed (configure the SDK and
+  exporter as usual, e.g. with opentelemetry-instrument);
+- to last_trace, which the Streamlit sidebar shows as a waterfall.
+
+TRACING=0 disables it.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+current_turn = ContextVar("current_turn", default=None)
+_current_span = ContextVar("current_span", default=None)
+# The callback handler of the active turn; LangChain adds it to every run configured in the context.
+_turn_handler = ContextVar("turn_handler", default=None)
+register_configure_hook(_turn_handler, inheritable=True)
+
+# Upper bounds, in seconds, of the Prometheus histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def tracing_enabled():
+    return os.getenv("TRACING", "1").lower() not in ("0", "false", "no")
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimates the number of tokens of a text, for calls whose usage the API does not report.
+    """
+    return len(text) // 4 + 1
+
+
+class TurnTrace:
+    """
+    The spans of one chat turn. Spans may be added from several threads.
+
+    A span is a dictionary with an id, the id of its parent span (or None), a kind ('llm', 'tool',
+    'retriever', 'cypher', 'history' or another step of the turn), a name, its start and duration in
+    milliseconds since the start of the turn, and attributes.
+    """
+
+    def __init__(self, question, session_id):
+        self.trace_id = uuid.uuid4().hex
+        self.question = question
+        self.session_id = session_id
+        self.started_at = time.time()
+        self.path = None
+        self.error = None
+        self.duration_ms = None
+        self.spans = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _offset_ms(self):
+        return (time.perf_counter() - self._started) * 1000
+
+    def start_span(self, kind, name, parent=None, **attributes):
+        span = {"id": uuid.uuid4().hex[:16], "parent": parent, "kind": kind, "name": name,
+                "start_ms": round(self._offset_ms(), 2), "duration_ms": None, "attributes": attributes}
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def end_span(self, span):
+        span["duration_ms"] = round(self._offset_ms() - span["start_ms"], 2)
+
+    def finish(self):
+        self.duration_ms = round(self._offset_ms(), 2)
+        with self._lock:
+            for span in self.spans:
+                if span["duration_ms"] is None:
+                    # Still open, e.g. a tool that was cancelled.
+                    self.end_span(span)
+                    span["attributes"]["unfinished"] = True
+
+    def as_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {"trace_id": self.trace_id, "session_id": self.session_id, "question": self.question,
+                "started_at": self.started_at, "duration_ms": self.duration_ms, "path": self.path,
+                "error": self.error, "spans": spans}
+
+
+@contextmanager
+def span(kind, name, **attributes):
+    """
+    Records a span of the active turn around a block; does nothing outside a turn.
+
+    Yields:
+        dict: The attributes of the span, to which the block may add.
+    """
+    trace = current_turn.get()
+    if trace is None:
+        yield {}
+        return
+    parent = _current_span.get()
+    record = trace.start_span(kind, name, parent=parent["id"] if parent else None, **attributes)
+    token = _current_span.set(record)
+    try:
+        yield record["attributes"]
+    except BaseException as e:
+        record["attributes"]["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        trace.end_span(record)
+
+
+def set_path(path):
+    """
+    Records how the active turn was answered: 'fast_path', 'cache', 'agent' or 'plan'.
+    """
+    trace = current_turn.get()
+    if trace is not None:
+        trace.path = path
+
+
+def db_ms(summary):
+    """
+    Returns the time in milliseconds Neo4j reports for producing and streaming a result, or None.
+    """
+    available = getattr(summary, "result_available_after", None)
+    consumed = getattr(summary, "result_consumed_after", None)
+    if available is None and consumed is None:
+        return None
+    return (available or 0) + (consumed or 0)
+
+
+def query_name(query):
+    """
+    A short label for a Cypher query: its first clause.
+    """
+    text = getattr(query, "text", query)
+    for line in text.strip().splitlines():
+        line = line.strip()
+        if line and not line.startswith("//"):
+            return line[:60]
+    return "query"
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records the LLM, tool and retriever runs of a turn as spans. LLM spans are named after the tool
+    they run in, or 'agent' for the ReAct reasoning, so Cypher generation and plot answers can be told apart
+    from the agent's own steps.
+    """
+
+    run_inline = True
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._spans = {}
+        self._parents = {}
+        self._tools = {}
+        self._chains = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, parent_run_id, kind, name, **attributes):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            parent = parent_run_id
+            while parent is not None and parent not in self._spans:
+                parent = self._parents.get(parent)
+            self._spans[run_id] = self.trace.start_span(
+                kind, name, parent=self._spans[parent]["id"] if parent is not None else None, **attributes)
+
+    def _end(self, run_id, **attributes):
+        with self._lock:
+            span = self._spans.get(run_id)
+        if span is not None:
+            span["attributes"].update(attributes)
+            self.trace.end_span(span)
+        return span
+
+    def _owner(self, run_id):
+        # The innermost tool the run belongs to, else 'agent' inside the agent, else the outermost chain.
+        owner = "chain"
+        with self._lock:
+            parent = self._parents.get(run_id)
+            while parent is not None:
+                if parent in self._tools:
+                    return self._tools[parent]
+                if self._chains.get(parent) == "AgentExecutor":
+                    return "agent"
+                owner = self._chains.get(parent) or owner
+                parent = self._parents.get(parent)
+        return owner
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            self._chains[run_id] = kwargs.get("name") or (serialized or {}).get("name")
+
+    def _llm_start(self, serialized, prompt, run_id, parent_run_id, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._start(run_id, parent_run_id, "llm", f"llm: {self._owner(run_id)}",
+                    model=params.get("model_name") or params.get("model"), prompt_chars=len(prompt), streamed_tokens=0)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+        self._llm_start(serialized, "".join(prompts), run_id, parent_run_id, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+        prompt = "".join(str(message.content) for batch in messages for message in batch)
+        self._llm_start(serialized, prompt, run_id, parent_run_id, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is None:
+            return
+        attributes = span["attributes"]
+        if not attributes["streamed_tokens"]:
+            attributes["first_token_ms"] = round(self.trace._offset_ms() - span["start_ms"], 2)
+        attributes["streamed_tokens"] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is None:
+            return
+        attributes = span["attributes"]
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        prompt_tokens = usage.get("prompt_tokens") or metadata.get("input_tokens")
+        completion_tokens = usage.get("completion_tokens") or metadata.get("output_tokens")
+        estimated = prompt_tokens is None or completion_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = attributes["prompt_chars"] // 4 + 1
+        if completion_tokens is None:
+            completion_tokens = attributes["streamed_tokens"] or estimate_tokens(generation.text if generation else "")
+        self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, tokens_estimated=estimated)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        with self._lock:
+            self._tools[run_id] = name
+        self._start(run_id, parent_run_id, "tool", name, input=input_str)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "retriever", kwargs.get("name") or "retriever", query=query)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+
+def _start_cypher_span(query):
+    # The span of a query run in a session of a traced driver, or None outside a turn or inside a block
+    # that already records the query, such as the EXPLAIN of the Cypher guard.
+    trace = current_turn.get()
+    parent = _current_span.get()
+    if trace is None or (parent is not None and parent["kind"] == "cypher"):
+        return None
+    return trace, trace.start_span("cypher", query_name(query), parent=parent["id"] if parent else None,
+                                   query=getattr(query, "text", query))
+
+
+class _TracedResult:
+    """
+    A result of a traced session. Its span ends when the rows have been iterated or the result is
+    consumed, or else when the session closes.
+    """
+
+    def __init__(self, result, trace, span):
+        self._wrapped = result
+        self._trace = trace
+        self._span = span
+        self._rows = None
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __iter__(self):
+        self._rows = 0
+        for record in self._wrapped:
+            self._rows += 1
+            yield record
+        self._finish(self._wrapped.consume())
+
+    def consume(self):
+        summary = self._wrapped.consume()
+        self._finish(summary)
+        return summary
+
+    def _finish(self, summary=None, error=None):
+        if self._span["duration_ms"] is not None:
+            return
+        attributes = self._span["attributes"]
+        if self._rows is not None:
+            attributes["rows"] = self._rows
+        if summary is not None:
+            attributes["db_ms"] = db_ms(summary)
+        if error is not None:
+            attributes["error"] = type(error).__name__
+        self._trace.end_span(self._span)
+
+
+class _TracedAsyncResult(_TracedResult):
+    """
+    The async counterpart of _TracedResult.
+    """
+
+    async def __aiter__(self):
+        self._rows = 0
+        async for record in self._wrapped:
+            self._rows += 1
+            yield record
+        self._finish(await self._wrapped.consume())
+
+    async def consume(self):
+        summary = await self._wrapped.consume()
+        self._finish(summary)
+        return summary
+
+
+class _TracedSession:
+    """
+    A session of a traced driver whose run records a 'cypher' span like execute_query does. Neo4jGraph.query,
+    Neo4jVector and the other LangChain integrations query through sessions rather than execute_query.
+    """
+
+    _result = _TracedResult
+
+    def __init__(self, session):
+        self._wrapped = session
+        self._results = []
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __enter__(self):
+        self._wrapped.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._finish(exc_info[1])
+        return self._wrapped.__exit__(*exc_info)
+
+    def close(self):
+        self._finish()
+        return self._wrapped.close()
+
+    def _finish(self, error=None):
+        # Results that were read some other way, e.g. with data() or single(), end with the session.
+        for result in self._results:
+            result._finish(error=error)
+        self._results = []
+
+    def run(self, query, *args, **kwargs):
+        started = _start_cypher_span(query)
+        if started is None:
+            return self._wrapped.run(query, *args, **kwargs)
+        try:
+            result = self._result(self._wrapped.run(query, *args, **kwargs), *started)
+        except BaseException as e:
+            started[1]["attributes"]["error"] = type(e).__name__
+            started[0].end_span(started[1])
+            raise
+        self._results.append(result)
+        return result
+
+
+class _TracedAsyncSession(_TracedSession):
+    """
+    The async counterpart of _TracedSession.
+    """
+
+    _result = _TracedAsyncResult
+
+    async def __aenter__(self):
+        await self._wrapped.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._finish(exc_info[1])
+        return await self._wrapped.__aexit__(*exc_info)
+
+    async def close(self):
+        self._finish()
+        return await self._wrapped.close()
+
+    async def run(self, query, *args, **kwargs):
+        started = _start_cypher_span(query)
+        if started is None:
+            return await self._wrapped.run(query, *args, **kwargs)
+        try:
+            result = self._result(await self._wrapped.run(query, *args, **kwargs), *started)
+        except BaseException as e:
+            started[1]["attributes"]["error"] = type(e).__name__
+            started[0].end_span(started[1])
+            raise
+        self._results.append(result)
+        return result
+
+
+class TracedDriver:
+    """
+    Wraps a synchronous Neo4j driver so that execute_query, and run in its sessions, record a 'cypher' span
+    with the query text, the row count and the time the database reported. Everything else is passed through.
+    """
+
+    _session = _TracedSession
+
+    def __init__(self, driver):
+        self._wrapped = driver
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def session(self, *args, **kwargs):
+        return self._session(self._wrapped.session(*args, **kwargs))
+
+    def execute_query(self, query, *args, **kwargs):
+        with span("cypher", query_name(query), query=getattr(query, "text", query)) as attributes:
+            result = self._wrapped.execute_query(query, *args, **kwargs)
+            attributes.update(rows=len(result[0]), db_ms=db_ms(result[1]))
+        return result
+
+
+class TracedAsyncDriver(TracedDriver):
+    """
+    The async counterpart of TracedDriver.
+    """
+
+    _session = _TracedAsyncSession
+
+    async def execute_query(self, query, *args, **kwargs):
+        with span("cypher", query_name(query), query=getattr(query, "text", query)) as attributes:
+            result = await self._wrapped.execute_query(query, *args, **kwargs)
+            attributes.update(rows=len(result[0]), db_ms=db_ms(result[1]))
+        return result
+
+
+class TraceMetrics:
+    """
+    Prometheus histograms of turn and span durations by kind and path, and counters of LLM tokens.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(lambda: [[0] * len(BUCKETS), 0, 0.0])
+        self._tokens = defaultdict(int)
+
+    def _observe(self, name, labels, seconds):
+        buckets, _, _ = histogram = self._histograms[(name, labels)]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+
+    def record(self, trace):
+        with self._lock:
+            self._observe("chatbot_turn_seconds", (("path", trace.path or "unknown"),), trace.duration_ms / 1000)
+            for span in trace.spans:
+                self._observe("chatbot_span_seconds", (("kind", span["kind"]),), span["duration_ms"] / 1000)
+                if span["kind"] == "llm":
+                    for kind in ("prompt", "completion"):
+                        self._tokens[kind] += span["attributes"].get(f"{kind}_tokens") or 0
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for (name, labels), (buckets, count, total) in sorted(self._histograms.items()):
+                label = ",".join(f'{key}="{value}"' for key, value in labels)
+                for bound, observed in zip(BUCKETS, buckets):
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {observed}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f"{name}_count{{{label}}} {count}")
+                lines.append(f"{name}_sum{{{label}}} {total}")
+            for kind, count in sorted(self._tokens.items()):
+                lines.append(f'chatbot_llm_tokens_total{{type="{kind}"}} {count}')
+        return "".join(line + "\n" for line in lines)
+
+
+metrics = TraceMetrics()
+_recent = OrderedDict()
+_recent_lock = threading.Lock()
+_jsonl_lock = threading.Lock()
+
+
+def last_trace(session_id):
+    """
+    Returns the trace of the last turn of a session as a dictionary, or None.
+    """
+    with _recent_lock:
+        return _recent.get(session_id)
+
+
+def _export_jsonl(path, trace):
+    with _jsonl_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(trace, default=str) + "\n")
+
+
+def _export_otel(trace):
+    tracer = otel_trace.get_tracer("library-chatbot")
+    started_ns = int(trace["started_at"] * 1e9)
+    root = tracer.start_span("chat turn", start_time=started_ns, attributes={
+        "chat.session_id": trace["session_id"], "chat.path": trace["path"] or "unknown"})
+    contexts = {None: otel_trace.set_span_in_context(root)}
+    for record in trace["spans"]:
+        attributes = {key: value for key, value in record["attributes"].items()
+                      if isinstance(value, (str, bool, int, float))}
+        child = tracer.start_span(record["name"], context=contexts.get(record["parent"], contexts[None]),
+                                  start_time=started_ns + int(record["start_ms"] * 1e6),
+                                  attributes=dict(attributes, **{"chat.kind": record["kind"]}))
+        contexts[record["id"]] = otel_trace.set_span_in_context(child)
+        child.end(end_time=started_ns + int((record["start_ms"] + record["duration_ms"]) * 1e6))
+    root.end(end_time=started_ns + int(trace["duration_ms"] * 1e6))
+
+
+def export(trace):
+    """
+    Sends a finished turn to the configured sinks. Sink failures are logged, never raised.
+    """
+    record = trace.as_dict()
+    with _recent_lock:
+        _recent[trace.session_id] = record
+        _recent.move_to_end(trace.session_id)
+        while len(_recent) > int(os.getenv("TRACE_RECENT_SESSIONS", 1000)):
+            _recent.popitem(last=False)
+    try:
+        metrics.record(trace)
+        path = os.getenv("TRACE_JSONL_PATH")
+        if path:
+            _export_jsonl(path, record)
+        if otel_trace is not None and os.getenv("TRACE_OTEL"):
+            _export_otel(record)
+    except Exception as e:
+        logging.warning("Failed to export the trace of a turn: %s", e)
+
+
+@contextmanager
+def turn(question, session_id):
+    """
+    Traces a chat turn: LangChain runs, timed driver queries and spans started inside the block
+    belong to it, including those in tasks and threads started from it. The trace is exported when
+    the block ends.
+
+    Yields:
+        TurnTrace: The trace, or None if tracing is disabled.
+    """
+    if not tracing_enabled():
+        yield None
+        return
+    trace = TurnTrace(question, session_id)
+    tokens = (current_turn.set(trace), _turn_handler.set(TracingCallbackHandler(trace)))
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        try:
+            _turn_handler.reset(tokens[1])
+            current_turn.reset(tokens[0])
+        except ValueError:
+            # An async generator closed from another context; the context it ran in is gone anyway.
+            pass
+        trace.finish()
+        export(trace)
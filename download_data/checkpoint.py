@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+import uuid
+
+
+class IngestionCheckpoint:
+    def __init__(self, path, fingerprint):
+        """
+        Tracks which CSV chunks an ingestion run has fully written, so that an interrupted run can resume.
+
+        The checkpoint file stores the run identifier and the start rows of completed chunks. It is only reused
+        when its fingerprint (CSV size and modification time, embedding model, chunk size) matches, otherwise
+        a new run is started.
+
+        Parameters:
+        - path (str): The path of the checkpoint file.
+        - fingerprint (dict): Describes the source the checkpoint belongs to.
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.completed = set()
+        self.run_id = None
+        self._lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("fingerprint") == fingerprint:
+                self.run_id = state["run_id"]
+                self.completed = set(state["completed"])
+                logging.info("Resuming ingestion run %s, %d chunks already loaded.", self.run_id, len(self.completed))
+            else:
+                logging.info("Ignoring checkpoint %s of a different source.", path)
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            logging.warning("Ignoring unreadable checkpoint %s: %s", path, e)
+
+        if self.run_id is None:
+            self.run_id = uuid.uuid4().hex
+            self._save()
+
+    @property
+    def resumed(self):
+        return bool(self.completed)
+
+    def is_done(self, chunk_start):
+        with self._lock:
+            return int(chunk_start) in self.completed
+
+    def mark_done(self, chunk_start):
+        """
+        Records a chunk as completely written and persists the checkpoint atomically.
+        """
+        with self._lock:
+            self.completed.add(int(chunk_start))
+            self._save()
+
+    def clear(self):
+        """
+        Removes the checkpoint file after a successful run.
+        """
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "run_id": self.run_id, "completed": sorted(self.completed)}, f)
+        os.replace(temp_path, self.path)
+
+
+def checkpoint_path(file_book_path):
+    """
+    Returns the path of the checkpoint file that belongs to a books CSV file.
+    """
+    root, _ = os.path.splitext(file_book_path)
+    return f"{root}.checkpoint.json"
+
+def source_fingerprint(file_book_path, model, chunk_size):
+    """
+    Describes a CSV file and the ingestion settings a checkpoint is valid for.
+    """
+    stat = os.stat(file_book_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "model": model, "chunk_size": chunk_size}
@@ -0,0 +1,372 @@
+import logging
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from checkpoint import IngestionCheckpoint, checkpoint_path, source_fingerprint
+from embedding_store import EmbeddingSidecar, sidecar_path, summary_key
+from pipeline import Pipeline, Stage
+from similar_books import SimilarBooksBuilder
+from utils import content_hash, parse_embeddings, parse_genres
+from shared.embedding_projection import encode_rescore_vector, load_or_fit_projection, projection_path
+
+
+class ChunkJob:
+    """
+    A chunk of CSV rows travelling through the ingestion pipeline together with its sidecar window.
+    Rows whose content hash matches the graph are moved from rows to unchanged by the embed stage, and the
+    titles of rows that could not be parsed or embedded are collected in failed.
+    """
+
+    def __init__(self, chunk, window, rows, keys):
+        self.start = int(chunk.index[0])
+        self.chunk = chunk
+        self.window = window
+        self.rows = rows
+        self.keys = keys
+        self.unchanged = []
+        self.failed = []
+
+    def __len__(self):
+        return len(self.rows) + len(self.unchanged)
+
+
+class DataLoader:
+    def __init__(self, neo4j_connection, openai_connection, file_book_path, vector_dimensions, similarity_function,
+                 batch_size=500, chunk_size=1000, embed_workers=2, write_workers=1, queue_size=4, similar_books_k=10,
+                 similar_books_block_size=1024, embedding_reduction=None, stored_dimensions=None, projection_file=None,
+                 projection_sample_size=10_000, rescore_precision=None):
+        """
+        Initializes DataLoader with connections to Neo4j, OpenAI, and the file path for CSV operations.
+        The CSV file is streamed chunk_size rows at a time and books are written batch_size rows per transaction.
+        Chunks are embedded by embed_workers threads and written by write_workers threads; at most queue_size
+        chunks wait between two stages. Concurrent writers MERGE the same authors and genres, which only stays free
+        of duplicates under the uniqueness constraints of ensure_schema, so one writer is the default. When the
+        catalogue changed, every book is linked to its similar_books_k most similar books (0 disables it), comparing
+        similar_books_block_size books at once.
+
+        With an embedding_reduction ('truncate' or 'pca'), the vectors written to Neo4j and indexed are projected
+        from vector_dimensions to stored_dimensions; a PCA is fitted on the first projection_sample_size summaries.
+        The projection is saved to projection_file (next to the CSV by default), which the chat app loads to
+        project its questions the same way. With a rescore_precision ('int8' or 'float16'), every book also gets
+        its full-width embedding in that precision, for the rescoring of the chat app's local plot index.
+        """
+        self.neo4j = neo4j_connection
+        self.openai = openai_connection
+        self.file_book_path = file_book_path
+        self.vector_dimensions = int(vector_dimensions)
+        self.similarity_function = similarity_function
+        self.batch_size = int(batch_size)
+        self.chunk_size = int(chunk_size)
+        self.embed_workers = int(embed_workers)
+        self.write_workers = int(write_workers)
+        self.queue_size = int(queue_size)
+        self.similar_books_k = int(similar_books_k)
+        self.similar_books_block_size = int(similar_books_block_size)
+        self.embedding_reduction = embedding_reduction or None
+        if self.embedding_reduction and not stored_dimensions:
+            raise ValueError("An embedding reduction needs the number of stored dimensions.")
+        self.stored_dimensions = int(stored_dimensions) if self.embedding_reduction else self.vector_dimensions
+        self.projection_file = projection_file or projection_path(file_book_path)
+        self.projection_sample_size = int(projection_sample_size)
+        self.rescore_precision = rescore_precision or None
+        self.projection = None
+        self.vector_model = None
+        self.counts = {}
+        self.failed_titles = set()
+        self._lock = threading.Lock()
+
+    def parse_chunk(self, chunk, sidecar, run_id):
+        """
+        Parses a CSV chunk into book rows and opens the chunk's sidecar window. Rows that cannot be parsed
+        are logged and skipped.
+        """
+        rows, keys, failed = [], [], []
+        for index, row in zip(chunk.index, chunk.to_dict('records')):
+            try:
+                book = {
+                    'index': index,
+                    'title': row['Title'],
+                    'author': row['Author'],
+                    'lang': row['Language'],
+                    'rating': row['Ratings'],
+                    'summary': row['Summary'],
+                    'year': row['Publication Year'],
+                    'genres': parse_genres(row['Genre']),
+                    'run_id': run_id,
+                }
+                key = summary_key(self.openai.model, row['Summary'])
+                # The stored vector depends on the projection too, so its hash does.
+                stored_key = key if self.vector_model == self.openai.model else summary_key(self.vector_model, row['Summary'])
+                book['content_hash'] = content_hash(self.vector_model, book)
+                book['summary_hash'] = f"{stored_key:016x}" if stored_key else None
+                rows.append(book)
+                keys.append(key)
+            except Exception as e:
+                logging.error(f"Failed to load data for '{row['Title']}' at index {index}: {e}")
+                failed.append(row['Title'])
+        window = sidecar.window([row['index'] for row in rows], keys)
+        job = ChunkJob(chunk, window, rows, keys)
+        job.failed = failed
+        self._fail(failed)
+        return job
+
+    def embed_chunk(self, job):
+        """
+        Compares the rows of a chunk with the hashes stored in the graph and prepares the changed ones:
+        unchanged rows are set aside, and only rows whose summary changed (or that have no vector yet)
+        get a vector. Vectors come from the sidecar when it is up to date, from the legacy 'Embeddings'
+        column when the CSV has one, and from OpenAI otherwise. Rows whose summary OpenAI rejects fail alone.
+        """
+        existing = self.neo4j.fetch_book_hashes([row['title'] for row in job.rows]) if job.rows else {}
+        changed, changed_keys = [], []
+        for row, key in zip(job.rows, job.keys):
+            stored = existing.get(row['title'])
+            if stored and stored['contentHash'] == row['content_hash'] and (stored['hasVector'] or not key):
+                job.unchanged.append(row)
+                continue
+            row['status'] = 'updated' if stored else 'inserted'
+            row['needs_vector'] = bool(key) and not (
+                stored and stored['hasVector'] and stored['summaryHash'] == row['summary_hash']
+            )
+            changed.append(row)
+            changed_keys.append(key if row['needs_vector'] else 0)
+        job.rows, job.keys = changed, changed_keys
+
+        positions = [row['index'] for row, key in zip(job.rows, job.keys) if key]
+        keys = [key for key in job.keys if key]
+        stale = set(job.window.rows_to_embed(positions, keys).tolist()) if positions else set()
+        if stale:
+            pending = [(row, key) for row, key in zip(job.rows, job.keys) if row['index'] in stale]
+            if 'Embeddings' in job.chunk.columns:
+                vectors = [parse_embeddings(job.chunk.loc[row['index']]) for row, _ in pending]
+            else:
+                vectors = self.openai.get_embeddings([row['summary'] for row, _ in pending])
+            rejected = [row for (row, _), vector in zip(pending, vectors) if vector is None]
+            if rejected:
+                for row in rejected:
+                    logging.error(f"Failed to embed the summary of '{row['title']}' at index {row['index']}.")
+                job.failed.extend(row['title'] for row in rejected)
+                self._fail([row['title'] for row in rejected])
+                rejected_positions = {row['index'] for row in rejected}
+                kept = [(row, key) for row, key in zip(job.rows, job.keys) if row['index'] not in rejected_positions]
+                job.rows, job.keys = [row for row, _ in kept], [key for _, key in kept]
+                embedded = [(item, vector) for item, vector in zip(pending, vectors) if vector is not None]
+                pending, vectors = [item for item, _ in embedded], [vector for _, vector in embedded]
+            if pending:
+                job.window.write([row['index'] for row, _ in pending], vectors, [key for _, key in pending])
+            self._count('embedded', len(pending))
+        job.chunk = None
+        return job
+
+    def write_chunk(self, job, checkpoint):
+        """
+        Writes the changed books of a chunk, with the vectors from its sidecar window, to Neo4j, marks the
+        unchanged ones as seen and records the chunk in the checkpoint once every row succeeded.
+        """
+        try:
+            for row in job.rows:
+                row['embeddings'] = job.window.get(row['index']) if row.pop('needs_vector') else None
+            self.store_vectors(job.rows)
+            failed = self.neo4j.load_books_batch(job.rows, batch_size=self.batch_size) if job.rows else []
+            if job.unchanged:
+                self.neo4j.mark_books_seen([row['title'] for row in job.unchanged], job.unchanged[0]['run_id'])
+        finally:
+            job.window.close()
+
+        failed_titles = {row['title'] for row, _ in failed}
+        for row in job.rows:
+            if row['title'] not in failed_titles:
+                self._count(row['status'])
+        self._fail([row['title'] for row, _ in failed])
+        self._count('skipped', len(job.unchanged))
+        if not failed and not job.failed:
+            checkpoint.mark_done(job.start)
+        return job
+
+    def store_vectors(self, rows):
+        """
+        Replaces the full-width embeddings of rows by the projected vectors that are written to Neo4j,
+        and adds their compact rescore vectors. Does nothing without a projection or rescore precision.
+        """
+        rows = [row for row in rows if row['embeddings'] is not None]
+        if not rows or not (self.projection or self.rescore_precision):
+            return
+        vectors = np.asarray([row['embeddings'] for row in rows], dtype=np.float32)
+        stored = self.projection.transform(vectors).tolist() if self.projection else None
+        for i, row in enumerate(rows):
+            if self.rescore_precision:
+                row['rescore'] = encode_rescore_vector(vectors[i], self.rescore_precision)
+            if stored is not None:
+                row['embeddings'] = stored[i]
+
+    def projection_sample(self, sidecar):
+        """
+        Returns the embeddings of the first projection_sample_size summaries of the CSV to fit a PCA on.
+        Missing ones are embedded and stored in the sidecar, where the pipeline finds them again.
+        """
+        sample = pd.read_csv(self.file_book_path, nrows=self.projection_sample_size)
+        keys = [summary_key(self.openai.model, summary) for summary in sample['Summary']]
+        positions = [i for i, key in enumerate(keys) if key]
+        window = sidecar.window(positions, [keys[i] for i in positions])
+        try:
+            stale = window.rows_to_embed(positions, [keys[i] for i in positions]).tolist() if positions else []
+            if stale:
+                if 'Embeddings' in sample.columns:
+                    vectors = [parse_embeddings(sample.loc[i]) for i in stale]
+                else:
+                    vectors = self.openai.get_embeddings([sample['Summary'][i] for i in stale])
+                rejected = {i for i, vector in zip(stale, vectors) if vector is None}
+                stale = [i for i in stale if i not in rejected]
+                if stale:
+                    window.write(stale, [vector for vector in vectors if vector is not None], [keys[i] for i in stale])
+                self._count('embedded', len(stale))
+                # Rejected summaries fail again in the pipeline; the sample just does without them.
+                positions = [i for i in positions if i not in rejected]
+            return window.read(positions)
+        finally:
+            window.close()
+
+    def _prepare_projection(self, sidecar):
+        """
+        Loads or fits the embedding projection and derives the model name the content hashes are built with.
+        """
+        self.projection = None
+        if self.embedding_reduction:
+            self.projection = load_or_fit_projection(self.projection_file, self.embedding_reduction, self.stored_dimensions,
+                                                     self.vector_dimensions, lambda: self.projection_sample(sidecar))
+        elif os.path.exists(self.projection_file):
+            # The chat app projects its questions whenever the file exists, so it must go with the reduction.
+            os.remove(self.projection_file)
+            logging.info("Removed embedding projection %s; vectors are stored at full width.", self.projection_file)
+        parts = [self.openai.model]
+        if self.projection:
+            parts.append(f"{self.projection.method}-{self.projection.fingerprint()}")
+        if self.rescore_precision:
+            parts.append(f"rescore-{self.rescore_precision}")
+        self.vector_model = "/".join(parts)
+        bytes_per_book = self.stored_dimensions * 4 + (
+            {"int8": 5 + self.vector_dimensions, "float16": 1 + 2 * self.vector_dimensions}[self.rescore_precision]
+            if self.rescore_precision else 0)
+        logging.info("Storing %d-dimensional vectors, %d bytes per book.", self.stored_dimensions, bytes_per_book)
+
+    def _abandon_chunk(self, job, error):
+        """
+        Counts the rows of a chunk that a pipeline stage could not process as failed and releases its window.
+        """
+        if isinstance(job, ChunkJob):
+            for row in job.rows + job.unchanged:
+                logging.error(f"Failed to load data for '{row['title']}' at index {row['index']}: {error}")
+            self._fail([row['title'] for row in job.rows + job.unchanged])
+            if job.window.vectors is not None:
+                job.window.close()
+        else:
+            logging.error("Failed to parse a chunk of %d rows: %s", len(job), error)
+            self._fail(job['Title'].tolist() if 'Title' in job.columns else [None] * len(job))
+
+    def _count(self, key, count=1):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def _fail(self, titles):
+        """
+        Counts rows as failed and remembers their titles, so that their books are kept at the end of the run.
+        """
+        with self._lock:
+            self.counts['failed'] = self.counts.get('failed', 0) + len(titles)
+            self.failed_titles.update(title for title in titles if isinstance(title, str))
+
+    def _keep_failed_books(self, run_id):
+        """
+        Marks the books of failed rows as seen in the run, so that they keep their previous version instead of
+        being removed as missing from the CSV. Their content hash is unchanged, so the next run retries them.
+
+        Returns:
+        - bool: Whether the books could be marked; if not, books missing from the CSV must not be removed.
+        """
+        titles = sorted(self.failed_titles)
+        try:
+            for start in range(0, len(titles), self.batch_size):
+                self.neo4j.mark_books_seen(titles[start:start + self.batch_size], run_id)
+            return True
+        except Exception as e:
+            logging.error("Failed to keep the books of failed rows: %s", e)
+            return False
+
+    def load_books_from_csv(self):
+        """
+        Loads books from a CSV file into the database, retrieving embeddings if necessary.
+        The file is streamed in chunks and embeddings are kept in a memory-mapped binary sidecar next to the CSV.
+        Chunks flow through a parse -> embed -> write pipeline connected by bounded queues, so OpenAI requests
+        and Neo4j writes overlap while only a few chunks are held in memory.
+
+        Ingestion is incremental: rows whose content hash is unchanged are skipped, only changed summaries are
+        re-embedded and books that are no longer in the CSV are removed. Completed chunks are recorded in a
+        checkpoint file, so an interrupted run resumes where it stopped. A run that changed any book records a
+        new catalogue version, which invalidates the caches of the chat app.
+
+        Returns:
+        - dict: The row counts of the run (inserted, updated, skipped, removed, resumed, failed, embedded)
+        and the per-stage statistics under 'stages'.
+        """
+        try:
+            logging.info("Starting to load data from CSV.")
+            chunks = pd.read_csv(self.file_book_path, chunksize=self.chunk_size)
+        except Exception as e:
+            logging.error(f'Error reading csv file: {e}')
+            raise
+
+        self.counts = {key: 0 for key in ('inserted', 'updated', 'skipped', 'removed', 'resumed', 'failed', 'embedded')}
+        self.failed_titles = set()
+        sidecar = EmbeddingSidecar(sidecar_path(self.file_book_path), self.vector_dimensions)
+        self._prepare_projection(sidecar)
+        checkpoint = IngestionCheckpoint(
+            checkpoint_path(self.file_book_path),
+            source_fingerprint(self.file_book_path, self.vector_model, self.chunk_size),
+        )
+
+        self.neo4j.ensure_schema()
+        if not self.neo4j.check_index(self.stored_dimensions):
+            self.neo4j.create_index(self.stored_dimensions, self.similarity_function)
+        self.neo4j.create_fulltext_index()
+
+        def pending_chunks():
+            for chunk in chunks:
+                if checkpoint.is_done(chunk.index[0]):
+                    self._count('resumed', len(chunk))
+                    continue
+                yield chunk
+
+        pipeline = Pipeline([
+            Stage("parse", lambda chunk: self.parse_chunk(chunk, sidecar, checkpoint.run_id), on_error=self._abandon_chunk),
+            Stage("embed", self.embed_chunk, workers=self.embed_workers, on_error=self._abandon_chunk),
+            Stage("write", lambda job: self.write_chunk(job, checkpoint), workers=self.write_workers,
+                  on_error=self._abandon_chunk),
+        ], queue_size=self.queue_size)
+        stages = pipeline.run(pending_chunks())
+
+        if not self._keep_failed_books(checkpoint.run_id):
+            logging.warning("%d books could not be loaded; keeping the checkpoint and skipping the removal of "
+                            "books missing from the CSV until a run succeeds.", self.counts['failed'])
+        else:
+            self.counts['removed'] = self.neo4j.remove_books_not_in_run(checkpoint.run_id)
+            checkpoint.clear()
+            if self.counts['failed']:
+                logging.warning("%d books could not be loaded; they keep their previous version and are retried "
+                                "by the next run.", self.counts['failed'])
+            else:
+                if not self.counts['resumed']:
+                    # Every summary of the CSV went through a window, so unused vectors can go.
+                    sidecar.compact()
+                logging.info("All data has been successfully loaded into the database.")
+
+        if self.counts['inserted'] or self.counts['updated'] or self.counts['removed']:
+            if self.similar_books_k:
+                SimilarBooksBuilder(self.neo4j, self.stored_dimensions, k=self.similar_books_k,
+                                    block_size=self.similar_books_block_size).build()
+            self.neo4j.update_catalogue_version(checkpoint.run_id)
+
+        logging.info("Rows inserted: %(inserted)d, updated: %(updated)d, skipped: %(skipped)d, removed: %(removed)d, "
+                     "resumed: %(resumed)d, failed: %(failed)d, summaries embedded: %(embedded)d.", self.counts)
+        return dict(self.counts, stages=stages)
@@ -0,0 +1,52 @@
+from shared.embedding_cache import normalize_text
+
+
+class CachedEmbeddingConnection:
+    """
+    Wraps an OpenAIEmbeddingConnecton so that only texts missing from the cache are sent to OpenAI.
+    """
+
+    def __init__(self, connection, cache, dimensions=None):
+        """
+        Parameters:
+        - connection (OpenAIEmbeddingConnecton): The connection used for cache misses.
+        - cache (EmbeddingCache): The cache to read from and write to.
+        - dimensions (int): The embedding dimensions, part of the cache key.
+        """
+        self.connection = connection
+        self.cache = cache
+        self.dimensions = dimensions
+        self.model = connection.model
+
+    def get_embedding(self, text):
+        """
+        Retrieves an embedding for the given text, from the cache when possible.
+        """
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts):
+        """
+        Retrieves embeddings for many texts, embedding only the cache misses.
+        Empty texts get None as their embedding.
+        """
+        texts = [text if isinstance(text, str) and text.strip() else None for text in texts]
+        present = [i for i, text in enumerate(texts) if text is not None]
+        embeddings = [None] * len(texts)
+
+        cached = self.cache.get_many(self.model, self.dimensions, [texts[i] for i in present])
+        missing = []
+        for i, vector in zip(present, cached):
+            if vector is None:
+                missing.append(i)
+            else:
+                embeddings[i] = vector
+
+        if missing:
+            # Texts that only differ in whitespace are embedded once.
+            unique_texts = list({normalize_text(texts[i]): texts[i] for i in missing}.values())
+            vectors = self.connection.get_embeddings(unique_texts)
+            self.cache.put_many(self.model, self.dimensions, unique_texts, vectors)
+            by_text = {normalize_text(text): vector for text, vector in zip(unique_texts, vectors)}
+            for i in missing:
+                embeddings[i] = by_text[normalize_text(texts[i])]
+        return embeddings
@@ -0,0 +1,269 @@
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+def summary_key(model, summary):
+    """
+    Returns a non-zero 64-bit hash of the embedding model and a summary.
+    It identifies which text a stored vector belongs to; 0 marks a row without a vector.
+    """
+    if not isinstance(summary, str) or not summary.strip():
+        return 0
+    payload = f"{model}\x00{' '.join(summary.split())}".encode("utf-8")
+    key = int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "little")
+    return key or 1
+
+def sidecar_path(file_book_path):
+    """
+    Returns the path of the embedding sidecar that belongs to a books CSV file.
+    """
+    root, _ = os.path.splitext(file_book_path)
+    return f"{root}.embeddings.npy"
+
+
+class EmbeddingSidecar:
+    """
+    Binary storage for the summary embeddings of a books CSV file, found by summary rather than by row.
+
+    A .npy file holds float32 vectors and a second .npy file the summary_key of every vector (0 marks a
+    free row). The keys are loaded into a sorted index when the sidecar is opened, so a vector is reused
+    wherever its summary moves in the CSV, and an edited summary simply gets a new row. New summaries are
+    appended, growing both files in place; compact() drops the rows that a complete run did not use.
+
+    The files are never mapped as a whole: callers work on one window of rows at a time, which
+    is memory-mapped on demand and released afterwards, so memory use does not grow with the file.
+    """
+
+    def __init__(self, path, dimensions, capacity=1024):
+        """
+        Opens the sidecar at the given path, creating it if it is missing or holds other dimensions.
+
+        Parameters:
+        - path (str): The path of the vectors file; the keys are stored next to it.
+        - dimensions (int): The number of dimensions of each vector.
+        - capacity (int): The number of rows a new sidecar is created with.
+        """
+        self.path = path
+        self.keys_path = path[:-len(".npy")] + ".keys.npy" if path.endswith(".npy") else path + ".keys.npy"
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        try:
+            vectors_shape, self._vectors_offset = _read_header(self.path, np.float32)
+            keys_shape, self._keys_offset = _read_header(self.keys_path, np.uint64)
+            if len(vectors_shape) != 2 or vectors_shape[1] != dimensions or keys_shape != vectors_shape[:1]:
+                raise ValueError(f"sidecar shape {vectors_shape} does not match {dimensions} dimensions")
+            self.capacity = vectors_shape[0]
+            keys = np.load(self.keys_path, mmap_mode="r")
+            stored = np.flatnonzero(keys)
+            self.used = int(stored[-1]) + 1 if len(stored) else 0
+            order = np.argsort(keys[stored], kind="stable")
+            self._index_keys = np.array(keys[stored][order])
+            self._index_rows = stored[order].astype(np.int64)
+            del keys
+            logging.info("Reusing embedding sidecar %s (%d vectors).", self.path, len(stored))
+        except (OSError, ValueError) as e:
+            logging.info("Creating embedding sidecar %s (%s).", self.path, e)
+            self._create(self.path, self.keys_path, capacity)
+            self.capacity, self.used = capacity, 0
+            self._index_keys = np.zeros(0, dtype=np.uint64)
+            self._index_rows = np.zeros(0, dtype=np.int64)
+        self._recent_keys = np.zeros(0, dtype=np.uint64)
+        self._recent_rows = np.zeros(0, dtype=np.int64)
+        self._referenced = np.zeros(self.capacity, dtype=bool)
+
+    def _lookup(self, keys):
+        # Rows appended in this run are in a second, smaller sorted index until it is merged into the first.
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        for index_keys, index_rows in ((self._index_keys, self._index_rows), (self._recent_keys, self._recent_rows)):
+            if len(index_keys):
+                at = np.minimum(np.searchsorted(index_keys, keys), len(index_keys) - 1)
+                found = (keys != 0) & (index_keys[at] == keys)
+                rows[found] = index_rows[at[found]]
+        return rows
+
+    def _remember(self, keys, rows):
+        keys = np.concatenate([self._recent_keys, keys])
+        rows = np.concatenate([self._recent_rows, rows])
+        if len(keys) > max(65536, len(self._index_keys) // 4):
+            keys = np.concatenate([self._index_keys, keys])
+            rows = np.concatenate([self._index_rows, rows])
+            order = np.argsort(keys, kind="stable")
+            self._index_keys, self._index_rows = keys[order], rows[order]
+            keys, rows = keys[:0], rows[:0]
+        else:
+            order = np.argsort(keys, kind="stable")
+            keys, rows = keys[order], rows[order]
+        self._recent_keys, self._recent_rows = keys, rows
+
+    def _create(self, path, keys_path, rows):
+        # open_memmap only writes the header and sizes the (sparse) files.
+        open_memmap(path, mode="w+", dtype=np.float32, shape=(rows, self.dimensions)).flush()
+        open_memmap(keys_path, mode="w+", dtype=np.uint64, shape=(rows,)).flush()
+        _, self._vectors_offset = _read_header(path, np.float32)
+        _, self._keys_offset = _read_header(keys_path, np.uint64)
+
+    def _grow(self, rows):
+        """
+        Extends both files to at least rows rows, rewriting their headers in place. Windows that are
+        already mapped stay valid, since the data of existing rows does not move.
+        """
+        capacity = max(rows, self.capacity * 2)
+        _resize(self.path, np.float32, (capacity, self.dimensions), self._vectors_offset)
+        _resize(self.keys_path, np.uint64, (capacity,), self._keys_offset)
+        self._referenced = np.concatenate([self._referenced, np.zeros(capacity - self.capacity, dtype=bool)])
+        self.capacity = capacity
+
+    def window(self, positions, keys):
+        """
+        Finds the rows of the summary keys of a chunk, appending rows for new summaries, and
+        memory-maps the range of rows they span.
+
+        Parameters:
+        - positions (list): The CSV row numbers of the chunk's books, which the window is addressed by.
+        - keys (list): The summary_key of every book; books with key 0 have no vector.
+
+        Returns:
+        - SidecarWindow: The window.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        with self._lock:
+            rows = self._lookup(keys)
+            new = (keys != 0) & (rows < 0)
+            if new.any():
+                # A summary that appears several times gets one row.
+                distinct, inverse = np.unique(keys[new], return_inverse=True)
+                if self.used + len(distinct) > self.capacity:
+                    self._grow(self.used + len(distinct))
+                rows[new] = self.used + inverse
+                self._remember(distinct, self.used + np.arange(len(distinct), dtype=np.int64))
+                self.used += len(distinct)
+            self._referenced[rows[rows >= 0]] = True
+
+        mapped = rows[rows >= 0]
+        start, stop = (int(mapped.min()), int(mapped.max()) + 1) if len(mapped) else (0, 0)
+        vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(stop - start, self.dimensions),
+                            offset=self._vectors_offset + start * self.dimensions * 4) if stop else None
+        stored_keys = np.memmap(self.keys_path, dtype=np.uint64, mode="r+", shape=(stop - start,),
+                                offset=self._keys_offset + start * 8) if stop else None
+        offsets = {position: int(row) - start for position, row in zip(positions, rows) if row >= 0}
+        return SidecarWindow(offsets, vectors, stored_keys)
+
+    def compact(self, min_free=1024):
+        """
+        Rewrites the sidecar without the rows that no window of this sidecar used, if there are at
+        least min_free of them. Only call it after a run that opened a window for every book of the
+        CSV and closed them all.
+
+        The files are rebuilt next to the old ones and swapped in; the vectors file is swapped first,
+        and a crash between the two swaps leaves files of different lengths, which the next run
+        discards rather than pairing vectors with the wrong keys.
+
+        Returns:
+        - int: The number of rows dropped.
+        """
+        keys = np.load(self.keys_path, mmap_mode="r")
+        live = np.flatnonzero(self._referenced[:self.used] & (keys[:self.used] != 0))
+        dropped = self.used - len(live)
+        if dropped < min_free:
+            return 0
+        vectors = np.load(self.path, mmap_mode="r")
+        path, keys_path = self.path + ".tmp", self.keys_path + ".tmp"
+        capacity = max(len(live), 1)
+        new_vectors = open_memmap(path, mode="w+", dtype=np.float32, shape=(capacity, self.dimensions))
+        new_keys = open_memmap(keys_path, mode="w+", dtype=np.uint64, shape=(capacity,))
+        for start in range(0, len(live), 65536):
+            block = live[start:start + 65536]
+            new_vectors[start:start + len(block)] = vectors[block]
+            new_keys[start:start + len(block)] = keys[block]
+        new_vectors.flush()
+        new_keys.flush()
+        del vectors, keys, new_vectors, new_keys
+        os.replace(path, self.path)
+        os.replace(keys_path, self.keys_path)
+        logging.info("Compacted embedding sidecar %s: dropped %d unused vectors, kept %d.", self.path, dropped, len(live))
+        self.__init__(self.path, self.dimensions)
+        return dropped
+
+
+class SidecarWindow:
+    """
+    The memory-mapped sidecar rows of a chunk. Positions are absolute CSV row numbers.
+    """
+
+    def __init__(self, offsets, vectors, keys):
+        self.offsets = offsets
+        self.vectors = vectors
+        self.keys = keys
+
+    def rows_to_embed(self, positions, keys):
+        """
+        Returns the positions whose stored vector does not belong to the expected key yet.
+        """
+        positions = np.asarray(positions)
+        keys = np.asarray(keys, dtype=np.uint64)
+        offsets = [self.offsets[position] for position in positions.tolist()]
+        return positions[self.keys[offsets] != keys]
+
+    def write(self, positions, vectors, keys):
+        """
+        Stores vectors and their keys at the rows of the given positions.
+        """
+        offsets = [self.offsets[position] for position in positions]
+        self.vectors[offsets] = np.asarray(vectors, dtype=np.float32)
+        self.keys[offsets] = np.asarray(keys, dtype=np.uint64)
+
+    def get(self, position):
+        """
+        Returns the vector of a row as a list of floats, or None if the row has no vector.
+        """
+        offset = self.offsets.get(position)
+        if offset is None or self.keys[offset] == 0:
+            return None
+        return self.vectors[offset].tolist()
+
+    def read(self, positions):
+        """
+        Returns the vectors of the given positions, which must all have one, as a float32 array.
+        """
+        return np.array(self.vectors[[self.offsets[position] for position in positions]])
+
+    def close(self):
+        """
+        Writes pending changes to disk and releases the memory maps.
+        """
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.keys.flush()
+        self.vectors = self.keys = self.offsets = None
+
+
+def _read_header(path, dtype):
+    """
+    Returns the shape and the data offset of a C-ordered .npy file of the given dtype.
+    """
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, file_dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, file_dtype = np.lib.format.read_array_header_2_0(f)
+        if fortran_order or file_dtype != np.dtype(dtype):
+            raise ValueError(f"unexpected layout of {path}")
+        return shape, f.tell()
+
+
+def _resize(path, dtype, shape, offset):
+    """
+    Rewrites the header of a .npy file with a larger shape and extends the (sparse) file to match.
+    The header keeps its length, so the data stays where it is.
+    """
+    with open(path, "r+b") as f:
+        np.lib.format.write_array_header_1_0(f, {"descr": np.dtype(dtype).str, "fortran_order": False, "shape": shape})
+        if f.tell() != offset:
+            raise ValueError(f"the header of {path} cannot grow in place")
+        f.truncate(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize)
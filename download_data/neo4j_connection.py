@@ -1,6 +1,12 @@
 from neo4j import GraphDatabase
 import logging
-from neo4j_queries import create_summary, create_vector_index, check_index_exists, create_book_node
+from neo4j_queries import (create_summary, create_vector_index, create_fulltext_index, check_index_exists,
+                           create_book_node, create_books_batch, fetch_book_hashes, mark_books_seen,
+                           delete_books_not_in_run, delete_orphaned_nodes, update_catalogue_version,
+                           fetch_book_seqs, set_book_seqs, update_book_count, fetch_book_vectors,
+                           replace_similar_books, drop_vector_index)
+from neo4j_schema import SchemaManager
+from utils import batched
 
 class Neo4jConnection:
     def __init__(self, uri, user, password):
@@ -61,23 +67,210 @@ class Neo4jConnection:
                 logging.error("Failed to create summary: %s", e)
                 raise
 
-    def check_index(self):
+    def load_books_batch(self, rows, batch_size=500):
         """
-        Checks if a vector index exists in the Neo4j database. Logs the result and returns a boolean indicating the presence of an index.
+        Loads books, their authors, genres and summary vectors into the Neo4j database in batches.
+        Each batch is written in a single UNWIND transaction. If a batch fails, its rows are retried
+        one per transaction so that a single bad row does not lose the whole batch, and every row that
+        still fails is logged individually.
+        
+        Parameters:
+        - rows (iterable): Book dictionaries as accepted by create_books_batch. An optional 'index' key
+        is used to identify the source row in error messages.
+        - batch_size (int): The number of books written per transaction.
+        
+        Returns:
+        - list: (row, exception) tuples for the rows that could not be loaded.
+        """
+        failed = []
+        with self.driver.session() as session:
+            for batch in batched(rows, batch_size):
+                try:
+                    session.execute_write(create_books_batch, batch)
+                except Exception as e:
+                    logging.warning("Failed to load a batch of %d books, retrying row by row: %s", len(batch), e)
+                    failed.extend(self._load_rows_individually(session, batch))
+        return failed
+
+    def _load_rows_individually(self, session, rows):
+        """
+        Writes each row in its own transaction and returns the rows that failed together with their errors.
+        """
+        failed = []
+        for row in rows:
+            try:
+                session.execute_write(create_books_batch, [row])
+            except Exception as e:
+                logging.error("Failed to load data for '%s' at index %s: %s", row.get('title'), row.get('index'), e)
+                failed.append((row, e))
+        return failed
+
+    def fetch_book_hashes(self, titles):
+        """
+        Fetches the content and summary hashes of the existing books with the given titles.
+        If the query fails, it logs the error and raises an exception.
+        
+        Parameters:
+        - titles (list): The book titles to look up.
+        
+        Returns:
+        - dict: Maps each existing title to its contentHash, summaryHash and hasVector values.
+        """
+        with self.driver.session() as session:
+            try:
+                return session.execute_read(fetch_book_hashes, titles)
+            except Exception as e:
+                logging.error("Failed to fetch book hashes: %s", e)
+                raise
+
+    def mark_books_seen(self, titles, run_id):
+        """
+        Marks unchanged books as present in the given ingestion run.
+        If the operation fails, it logs the error and raises an exception.
+        
+        Parameters:
+        - titles (list): The titles of the unchanged books.
+        - run_id (str): The identifier of the ingestion run.
+        """
+        with self.driver.session() as session:
+            try:
+                session.execute_write(mark_books_seen, titles, run_id)
+            except Exception as e:
+                logging.error("Failed to mark books as seen: %s", e)
+                raise
+
+    def remove_books_not_in_run(self, run_id, batch_size=1000):
+        """
+        Removes every book that is no longer part of the source, i.e. that was not touched by the given
+        ingestion run, in transactions of batch_size books. Authors and genres left without books are removed too.
+        If the operation fails, it logs the error and raises an exception.
+        
+        Parameters:
+        - run_id (str): The identifier of the ingestion run.
+        - batch_size (int): The number of books deleted per transaction.
+        
+        Returns:
+        - int: The number of removed books.
+        """
+        removed = 0
+        with self.driver.session() as session:
+            try:
+                while True:
+                    deleted = session.execute_write(delete_books_not_in_run, run_id, batch_size)
+                    removed += deleted
+                    if deleted < batch_size:
+                        break
+                session.execute_write(delete_orphaned_nodes)
+            except Exception as e:
+                logging.error("Failed to remove books: %s", e)
+                raise
+        return removed
+
+    def update_catalogue_version(self, version):
+        """
+        Records that the catalogue changed, which invalidates the caches of the chat app.
+        If the operation fails, it logs the error and raises an exception.
+        
+        Parameters:
+        - version (str): The new catalogue version.
+        """
+        with self.driver.session() as session:
+            try:
+                session.execute_write(update_catalogue_version, version)
+            except Exception as e:
+                logging.error("Failed to update the catalogue version: %s", e)
+                raise
+
+    def fetch_book_seqs(self):
+        """
+        Fetches the title and sequence number of every book.
+        If the operation fails, it logs the error and raises an exception.
+        
+        Returns:
+        - list: (title, seq) tuples; seq is None for books that have none yet.
+        """
+        with self.driver.session() as session:
+            try:
+                return session.execute_read(fetch_book_seqs)
+            except Exception as e:
+                logging.error("Failed to fetch book sequence numbers: %s", e)
+                raise
+
+    def set_book_seqs(self, rows, count, batch_size=1000):
+        """
+        Sets the sequence numbers of books in transactions of batch_size books and records the number of books.
+        If the operation fails, it logs the error and raises an exception.
+        
+        Parameters:
+        - rows (list): Dictionaries with the title and the new seq of a book.
+        - count (int): The number of books.
+        - batch_size (int): The number of books updated per transaction.
+        """
+        with self.driver.session() as session:
+            try:
+                for batch in batched(rows, batch_size):
+                    session.execute_write(set_book_seqs, batch)
+                session.execute_write(update_book_count, count)
+            except Exception as e:
+                logging.error("Failed to set book sequence numbers: %s", e)
+                raise
+
+    def fetch_book_vectors(self, start, stop):
+        """
+        Fetches the summary embeddings and current similar books of the books whose seq is in [start, stop).
+        If the operation fails, it logs the error and raises an exception.
+        
+        Returns:
+        - list: (seq, vector, stale, neighbours) tuples; see neo4j_queries.fetch_book_vectors.
+        """
+        with self.driver.session() as session:
+            try:
+                return session.execute_read(fetch_book_vectors, start, stop)
+            except Exception as e:
+                logging.error("Failed to fetch book embeddings: %s", e)
+                raise
+
+    def replace_similar_books(self, rows):
+        """
+        Replaces the SIMILAR_TO relationships of books with their new nearest neighbours.
+        If the operation fails, it logs the error and raises an exception.
+        
+        Parameters:
+        - rows (list): Dictionaries with the seq of a book and its neighbours, as dictionaries with seq and score.
+        """
+        with self.driver.session() as session:
+            try:
+                session.execute_write(replace_similar_books, rows)
+            except Exception as e:
+                logging.error("Failed to write similar books: %s", e)
+                raise
+
+    def check_index(self, vector_dimensions=None):
+        """
+        Checks if the vector index exists in the Neo4j database. Logs the result and returns a boolean indicating the presence of an index.
+        An index of another width than vector_dimensions could not index the stored vectors, so it is dropped and
+        False is returned, which makes the caller create it again.
         If the check fails, it logs the error and raises an exception.
         
+        Parameters:
+        - vector_dimensions (int, optional): The width of the stored vectors; not checked if None.
+        
         Returns:
-        - bool: True if the vector index exists, otherwise False.
+        - bool: True if a vector index of the right width exists, otherwise False.
         """
         with self.driver.session() as session:
             try:
-                index_exists = session.execute_write(check_index_exists)
-                if index_exists:
-                    logging.info("Vector index already exists. No action taken.")
-                    return True
-                else:
+                index_dimensions = session.execute_read(check_index_exists)
+                if index_dimensions is None:
                     logging.info("No vector index found.")
                     return False
+                if vector_dimensions is not None and index_dimensions != int(vector_dimensions):
+                    logging.warning("Vector index has %d dimensions but the stored vectors have %d. Recreating it.",
+                                    index_dimensions, int(vector_dimensions))
+                    session.execute_write(drop_vector_index)
+                    return False
+                logging.info("Vector index already exists. No action taken.")
+                return True
             except Exception as e:
                 logging.error("Failed to check index: %s", e)
                 raise
@@ -99,3 +292,30 @@ class Neo4jConnection:
             except Exception as e:
                 logging.error("Failed to create index: %s", e)
                 raise
+
+    def create_fulltext_index(self):
+        """
+        Creates the bookSearch full-text index over book titles and summaries and author names, if it does not exist.
+        If the creation fails, it logs the error and raises an exception.
+        """
+        with self.driver.session() as session:
+            try:
+                session.execute_write(create_fulltext_index)
+                logging.info("Full-text index bookSearch is in place.")
+            except Exception as e:
+                logging.error("Failed to create full-text index: %s", e)
+                raise
+
+    def ensure_schema(self):
+        """
+        Creates the uniqueness constraints and indexes the ingestion queries rely on, if they do not exist yet,
+        and logs their population state. If the operation fails, it logs the error and raises an exception.
+        
+        Returns:
+        - list: The state of every index in the database.
+        """
+        try:
+            return SchemaManager(self.driver).ensure_schema()
+        except Exception as e:
+            logging.error("Failed to create schema: %s", e)
+            raise
@@ -40,20 +40,29 @@ def create_summary(tx, title, embeddings):
 
 def check_index_exists(tx):
     """
-    Checks if a vector index exists in the database.
-    This function queries the database to see if there's an existing vector index on book summaries.
+    Checks if the summaryPlots vector index exists in the database and returns its width.
     
     Parameters:
     - tx (Transaction): The Neo4j transaction.
     
     Returns:
-    - bool: True if the index exists, False otherwise.
+    - int: The vector.dimensions of the index, or None if it does not exist.
     """
     query = """
-    SHOW INDEXES YIELD id, name, type, state, populationPercent WHERE type = "VECTOR"
+    SHOW INDEXES YIELD name, type, options WHERE type = "VECTOR" AND name = "summaryPlots"
+    RETURN options.indexConfig['vector.dimensions'] AS dimensions
     """
-    result = tx.run(query)
-    return result.single() is not None
+    record = tx.run(query).single()
+    return None if record is None else int(record["dimensions"])
+
+def drop_vector_index(tx):
+    """
+    Drops the summaryPlots vector index, e.g. before it is recreated for another vector width.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    """
+    tx.run("DROP INDEX summaryPlots IF EXISTS")
 
 def create_vector_index(tx, vector_dimensions, similarity_function):
     """
@@ -78,3 +87,241 @@ def create_vector_index(tx, vector_dimensions, similarity_function):
     """
     tx.run(query, vector_dimensions=vector_dimensions, similarity_function=similarity_function)
 
+def create_fulltext_index(tx):
+    """
+    Creates the bookSearch full-text index over book titles and summaries and author names, if it does not exist.
+    The chat plot search combines it with the vector index, so exact titles, character names and
+    author names are found even when their embeddings are not close to the question.
+
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    """
+    query = """
+    CREATE FULLTEXT INDEX bookSearch IF NOT EXISTS
+    FOR (n:Book|Author)
+    ON EACH [n.title, n.summary, n.name]
+    """
+    tx.run(query)
+
+def create_books_batch(tx, rows):
+    """
+    Creates book nodes, their author and genre relationships and summary vectors for a whole batch of books
+    in a single transaction. Rows are sent as one list parameter and expanded server side with UNWIND,
+    so the cost of a batch is one round trip instead of two transactions per book.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - rows (list): A list of dictionaries with the keys title, author, lang, rating, year, summary,
+    genres, embeddings, content_hash, summary_hash and run_id, and optionally rescore, the encoded full-width
+    embedding. Rows whose embeddings are None keep their current vector properties. Existing author and genre
+    relationships are replaced.
+    """
+    query = """
+    UNWIND $rows AS row
+    MERGE (b:Book {title: row.title})
+    SET b += {language: row.lang, rating: row.rating, publication_year: row.year, summary: row.summary,
+              contentHash: row.content_hash, summaryHash: row.summary_hash, ingestRun: row.run_id}
+    WITH b, row
+    CALL {
+        WITH b
+        OPTIONAL MATCH (b)-[old:WRITTEN_BY|HAS_GENRE]->()
+        DELETE old
+    }
+    MERGE (a:Author {name: row.author})
+    MERGE (b)-[:WRITTEN_BY]->(a)
+    WITH b, row
+    UNWIND row.genres AS genreName
+        MERGE (g:Genre {name: genreName})
+        MERGE (b)-[:HAS_GENRE]->(g)
+    """
+    tx.run(query, rows=rows)
+
+    vectors = [
+        {"title": row["title"], "embeddings": row["embeddings"], "rescore": row.get("rescore")}
+        for row in rows if row.get("embeddings") is not None
+    ]
+    if vectors:
+        query = """
+        UNWIND $vectors AS vector
+        MATCH (b:Book {title: vector.title})
+        SET b.plotEmbeddingRescore = vector.rescore
+        WITH b, vector
+        CALL db.create.setNodeVectorProperty(b, 'plotEmbeddingSummury', vector.embeddings)
+        """
+        tx.run(query, vectors=vectors)
+
+def fetch_book_hashes(tx, titles):
+    """
+    Fetches the content and summary hashes stored on existing book nodes.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - titles (list): The titles of the books to look up.
+    
+    Returns:
+    - dict: Maps the title of every existing book to a dictionary with contentHash, summaryHash and hasVector.
+    """
+    query = """
+    UNWIND $titles AS title
+    MATCH (b:Book {title: title})
+    RETURN b.title AS title, b.contentHash AS contentHash, b.summaryHash AS summaryHash,
+           b.plotEmbeddingSummury IS NOT NULL AS hasVector
+    """
+    return {record["title"]: record.data() for record in tx.run(query, titles=titles)}
+
+def mark_books_seen(tx, titles, run_id):
+    """
+    Marks unchanged books as present in the given ingestion run so that they are not removed at its end.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - titles (list): The titles of the books.
+    - run_id (str): The identifier of the ingestion run.
+    """
+    query = """
+    UNWIND $titles AS title
+    MATCH (b:Book {title: title})
+    SET b.ingestRun = $run_id
+    """
+    tx.run(query, titles=titles, run_id=run_id)
+
+def delete_books_not_in_run(tx, run_id, limit):
+    """
+    Deletes up to limit books that were neither written nor marked by the given ingestion run.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - run_id (str): The identifier of the ingestion run.
+    - limit (int): The maximum number of books deleted in this transaction.
+    
+    Returns:
+    - int: The number of deleted books.
+    """
+    query = """
+    MATCH (b:Book)
+    WHERE b.ingestRun IS NULL OR b.ingestRun <> $run_id
+    WITH b LIMIT $limit
+    DETACH DELETE b
+    RETURN count(*) AS deleted
+    """
+    return tx.run(query, run_id=run_id, limit=limit).single()["deleted"]
+
+def delete_orphaned_nodes(tx):
+    """
+    Deletes authors and genres that no longer have any books.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    """
+    for label, relationship in (("Author", "WRITTEN_BY"), ("Genre", "HAS_GENRE")):
+        tx.run(f"MATCH (n:{label}) WHERE NOT (n)<-[:{relationship}]-() DELETE n")
+
+def update_catalogue_version(tx, version):
+    """
+    Records a new version of the catalogue on the IngestMeta node, so caches built on the graph
+    content (such as the chat response cache) can tell that it changed.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - version (str): The new catalogue version, e.g. the ingestion run id.
+    """
+    query = """
+    MERGE (m:IngestMeta {id: 'catalogue'})
+    SET m.version = $version, m.updatedAt = datetime()
+    """
+    tx.run(query, version=version)
+
+def fetch_book_seqs(tx):
+    """
+    Fetches the title and sequence number of every book.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    
+    Returns:
+    - list: (title, seq) tuples; seq is None for books that have none yet.
+    """
+    query = """
+    MATCH (b:Book)
+    RETURN b.title AS title, b.seq AS seq
+    """
+    return [(record["title"], record["seq"]) for record in tx.run(query)]
+
+def set_book_seqs(tx, rows):
+    """
+    Sets the sequence number of books.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - rows (list): Dictionaries with the title and the new seq of a book.
+    """
+    query = """
+    UNWIND $rows AS row
+    MATCH (b:Book {title: row.title})
+    SET b.seq = row.seq
+    """
+    tx.run(query, rows=rows)
+
+def update_book_count(tx, count):
+    """
+    Records the number of books on the IngestMeta node; book sequence numbers run from 0 to count - 1,
+    so a random book is a lookup of a random seq.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - count (int): The number of books.
+    """
+    query = """
+    MERGE (m:IngestMeta {id: 'catalogue'})
+    SET m.bookCount = $count
+    """
+    tx.run(query, count=count)
+
+def fetch_book_vectors(tx, start, stop):
+    """
+    Fetches the summary embeddings and current similar books of the books whose seq is in [start, stop).
+    A book is stale when its embedding changed since its similar books were computed.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - start (int): The first seq.
+    - stop (int): The seq after the last one.
+    
+    Returns:
+    - list: (seq, vector, stale, neighbours) tuples; vector is None for books without an embedding and
+      neighbours is a list of [seq, score] pairs.
+    """
+    query = """
+    MATCH (b:Book)
+    WHERE b.seq >= $start AND b.seq < $stop
+    RETURN b.seq AS seq, b.plotEmbeddingSummury AS vector,
+           b.similarHash IS NULL OR b.similarHash <> coalesce(b.summaryHash, '') AS stale,
+           [(b)-[r:SIMILAR_TO]->(other) | [other.seq, r.score]] AS neighbours
+    """
+    return [(record["seq"], record["vector"], record["stale"], record["neighbours"])
+            for record in tx.run(query, start=start, stop=stop)]
+
+def replace_similar_books(tx, rows):
+    """
+    Replaces the SIMILAR_TO relationships of books with their new nearest neighbours, and records the
+    summaryHash they were computed for. Books without neighbours just lose their relationships.
+    
+    Parameters:
+    - tx (Transaction): The Neo4j transaction.
+    - rows (list): Dictionaries with the seq of a book and its neighbours, as dictionaries with seq and score.
+    """
+    query = """
+    UNWIND $rows AS row
+    MATCH (b:Book {seq: row.seq})
+    CALL {
+        WITH b
+        MATCH (b)-[old:SIMILAR_TO]->()
+        DELETE old
+    }
+    SET b.similarHash = coalesce(b.summaryHash, '')
+    WITH b, row
+    UNWIND row.neighbours AS neighbour
+    MATCH (other:Book {seq: neighbour.seq})
+    CREATE (b)-[:SIMILAR_TO {score: neighbour.score}]->(other)
+    """
+    tx.run(query, rows=rows)
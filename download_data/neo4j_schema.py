@@ -0,0 +1,235 @@
+import collections
+import logging
+import os
+import sys
+
+from neo4j_queries import (create_books_batch, fetch_book_hashes, mark_books_seen, delete_books_not_in_run,
+                           delete_orphaned_nodes, update_catalogue_version, fetch_book_seqs, set_book_seqs,
+                           update_book_count, fetch_book_vectors, replace_similar_books)
+
+# Constraints and indexes the ingestion and chat queries rely on. Uniqueness constraints are
+# backed by range indexes, which turns every MERGE on these keys into an index seek.
+SCHEMA_STATEMENTS = [
+    ("book_title", "CREATE CONSTRAINT book_title IF NOT EXISTS FOR (b:Book) REQUIRE b.title IS UNIQUE"),
+    ("author_name", "CREATE CONSTRAINT author_name IF NOT EXISTS FOR (a:Author) REQUIRE a.name IS UNIQUE"),
+    ("genre_name", "CREATE CONSTRAINT genre_name IF NOT EXISTS FOR (g:Genre) REQUIRE g.name IS UNIQUE"),
+    ("ingest_meta_id", "CREATE CONSTRAINT ingest_meta_id IF NOT EXISTS FOR (m:IngestMeta) REQUIRE m.id IS UNIQUE"),
+    # Random books are picked by a random seq, and the similar-books build reads embeddings by seq range.
+    ("book_seq", "CREATE INDEX book_seq IF NOT EXISTS FOR (b:Book) ON (b.seq)"),
+    # Chat sessions are looked up by id on every turn.
+    ("session_id", "CREATE CONSTRAINT session_id IF NOT EXISTS FOR (s:Session) REQUIRE s.id IS UNIQUE"),
+]
+
+# Plan operators that touch every node of a label (or of the graph) or build cross products.
+FORBIDDEN_OPERATORS = {"AllNodesScan", "NodeByLabelScan", "CartesianProduct"}
+
+# The example queries of the chat Cypher prompt, in their labelled and parameterized form.
+# Queries that are not on a hot path are reported but never fail the check.
+EXAMPLE_QUERIES = [
+    ("books_by_author", True, """
+    MATCH (b:Book)-[:WRITTEN_BY]->(a:Author {name: $name})
+    RETURN b.title, b.publication_year, b.rating, a.name, b.summary
+    """, {"name": "Author Name"}),
+    ("similar_books", True, """
+    MATCH (b:Book {title: $title})-[s:SIMILAR_TO]->(b2:Book)
+    RETURN b2.title, b2.publication_year, b2.rating, b2.summary, s.score
+    ORDER BY s.score DESC
+    """, {"title": "Book name"}),
+    ("similar_books_by_genre", True, """
+    MATCH (b:Book {title: $title})-[:HAS_GENRE]->(g:Genre)<-[:HAS_GENRE]-(b2:Book)
+    RETURN b2.title, b2.publication_year, b2.rating, b2.summary
+    """, {"title": "Book name"}),
+    ("book_details", True, """
+    MATCH (b:Book {title: $title})-[:WRITTEN_BY]->(a:Author)
+    MATCH (b)-[:HAS_GENRE]->(g:Genre)
+    RETURN b.title, b.publication_year, b.rating, b.summary, a.name, g.name
+    """, {"title": "Book name"}),
+    ("top_rated_in_genre", True, """
+    MATCH (b:Book)-[:HAS_GENRE]->(g:Genre {name: $genre})
+    WHERE b.rating >= 4.0
+    RETURN b.title, b.publication_year, b.rating
+    ORDER BY b.rating DESC
+    LIMIT 10
+    """, {"genre": "Genre Name"}),
+    ("authors_sharing_genres", False, """
+    MATCH (a1:Author)-[:WRITTEN_BY]-(b:Book)-[:HAS_GENRE]-(g:Genre)-[:HAS_GENRE]-(b2:Book)-[:WRITTEN_BY]-(a2:Author)
+    WHERE a1.name <> a2.name
+    RETURN a1.name, a2.name, collect(g.name) AS shared_genres, count(g) AS genre_count
+    ORDER BY genre_count DESC
+    LIMIT 5
+    """, {}),
+    ("random_book", True, """
+    MATCH (m:IngestMeta {id: 'catalogue'})
+    MATCH (b:Book {seq: toInteger(rand() * m.bookCount)})
+    RETURN b.title, b.publication_year, b.rating
+    """, {}),
+]
+
+
+def ingestion_queries(vector_dimensions):
+    """
+    Returns the ingestion transaction functions with sample arguments, as (name, hot_path, function, args).
+    """
+    sample_row = {
+        "index": 0, "title": "Book name", "author": "Author Name", "lang": "English", "rating": 4.0,
+        "summary": "Summary", "year": 2000, "genres": ["Fiction"], "embeddings": [0.0] * vector_dimensions,
+        "content_hash": "0", "summary_hash": "0", "run_id": "0",
+    }
+    return [
+        ("create_books_batch", True, create_books_batch, ([sample_row],)),
+        ("fetch_book_hashes", True, fetch_book_hashes, (["Book name"],)),
+        ("mark_books_seen", True, mark_books_seen, (["Book name"], "0")),
+        ("delete_books_not_in_run", False, delete_books_not_in_run, ("0", 1000)),
+        ("delete_orphaned_nodes", False, delete_orphaned_nodes, ()),
+        ("update_catalogue_version", False, update_catalogue_version, ("0",)),
+        ("fetch_book_seqs", False, fetch_book_seqs, ()),
+        ("set_book_seqs", True, set_book_seqs, ([{"title": "Book name", "seq": 0}],)),
+        ("update_book_count", False, update_book_count, (1,)),
+        ("fetch_book_vectors", True, fetch_book_vectors, (0, 2000)),
+        ("replace_similar_books", True, replace_similar_books, ([{"seq": 0, "neighbours": [{"seq": 1, "score": 1.0}]}],)),
+    ]
+
+
+class _ExplainedResult:
+    """
+    Stands in for the result of a query that was only explained: it has no records.
+    """
+
+    def __iter__(self):
+        return iter(())
+
+    def single(self):
+        return collections.defaultdict(int)
+
+
+class _ExplainingTransaction:
+    """
+    A transaction stand-in that prefixes every query with EXPLAIN and keeps the resulting plans,
+    so that the transaction functions in neo4j_queries can be checked without executing them.
+    """
+
+    def __init__(self, tx):
+        self.tx = tx
+        self.plans = []
+
+    def run(self, query, parameters=None, **kwargs):
+        summary = self.tx.run("EXPLAIN " + query, parameters, **kwargs).consume()
+        self.plans.append((query, summary.plan))
+        return _ExplainedResult()
+
+
+def plan_operators(plan):
+    """
+    Returns the operator names of a query plan and all of its children.
+    """
+    operators = [plan["operatorType"].split("@")[0]]
+    for child in plan.get("children", []):
+        operators.extend(plan_operators(child))
+    return operators
+
+
+class SchemaManager:
+    def __init__(self, driver):
+        """
+        Manages the constraints and indexes of the book graph and checks the plans of the queries that use them.
+
+        Parameters:
+        - driver (Driver): The Neo4j driver.
+        """
+        self.driver = driver
+
+    def ensure_schema(self, await_seconds=300):
+        """
+        Idempotently creates the constraints and indexes in SCHEMA_STATEMENTS and waits until they are online.
+
+        Parameters:
+        - await_seconds (int): How long to wait for index population.
+
+        Returns:
+        - list: The name, type, state and population percentage of every index in the database.
+        """
+        with self.driver.session() as session:
+            for name, statement in SCHEMA_STATEMENTS:
+                try:
+                    session.run(statement).consume()
+                except Exception as e:
+                    logging.error("Failed to create %s: %s", name, e)
+                    raise
+            session.run("CALL db.awaitIndexes($seconds)", seconds=await_seconds).consume()
+        state = self.schema_state()
+        for index in state:
+            logging.info("Index %s (%s on %s %s): %s, %.0f%% populated.", index["name"], index["type"],
+                         index["labelsOrTypes"], index["properties"], index["state"], index["populationPercent"] or 0)
+        return state
+
+    def schema_state(self):
+        """
+        Returns the name, type, entity, properties, state and population percentage of every index.
+        """
+        query = """
+        SHOW INDEXES YIELD name, type, labelsOrTypes, properties, state, populationPercent
+        WHERE type <> "LOOKUP"
+        """
+        with self.driver.session() as session:
+            return [record.data() for record in session.run(query)]
+
+    def explain(self, vector_dimensions):
+        """
+        Explains every ingestion and example query.
+
+        Returns:
+        - list: One dictionary per query with its name, hot_path flag, operators and forbidden operators.
+        """
+        reports = []
+        with self.driver.session() as session:
+            for name, hot_path, func, args in ingestion_queries(vector_dimensions):
+                tx = _ExplainingTransaction(session)
+                func(tx, *args)
+                for query, plan in tx.plans:
+                    reports.append(self._report(name, hot_path, plan))
+            for name, hot_path, query, params in EXAMPLE_QUERIES:
+                plan = session.run("EXPLAIN " + query, params).consume().plan
+                reports.append(self._report(name, hot_path, plan))
+        return reports
+
+    def check_query_plans(self, vector_dimensions):
+        """
+        Explains every ingestion and example query and logs the forbidden operators found in their plans.
+
+        Returns:
+        - bool: True if no hot-path query plans a label scan, all-nodes scan or cartesian product.
+        """
+        ok = True
+        for report in self.explain(vector_dimensions):
+            if not report["forbidden"]:
+                logging.info("Plan of %s is fine.", report["name"])
+            elif report["hot_path"]:
+                ok = False
+                logging.error("Plan of hot-path query %s contains %s.", report["name"], ", ".join(report["forbidden"]))
+            else:
+                logging.warning("Plan of %s contains %s (not on a hot path).", report["name"], ", ".join(report["forbidden"]))
+        return ok
+
+    @staticmethod
+    def _report(name, hot_path, plan):
+        operators = plan_operators(plan)
+        return {
+            "name": name,
+            "hot_path": hot_path,
+            "operators": operators,
+            "forbidden": sorted(set(operators) & FORBIDDEN_OPERATORS),
+        }
+
+
+if __name__ == "__main__":
+    from neo4j import GraphDatabase
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    driver = GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+    try:
+        manager = SchemaManager(driver)
+        manager.ensure_schema()
+        plans_ok = manager.check_query_plans(int(os.getenv("DIMENSIONS", 1536)))
+    finally:
+        driver.close()
+    sys.exit(0 if plans_ok else 1)
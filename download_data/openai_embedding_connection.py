@@ -1,27 +1,132 @@
-from openai import OpenAI
+from openai import OpenAI, BadRequestError, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
-import json
+import random
+import time
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
 
 class OpenAIEmbeddingConnecton:
-    def __init__(self, openAIkey, embedding_model):
+    def __init__(self, openAIkey, embedding_model, base_url=None, max_workers=4,
+                 max_batch_size=2048, max_batch_tokens=100_000, max_retries=6, backoff_base=1.0, backoff_max=60.0):
         """
         Initializes a connection to OpenAI using the specified API key and embedding model.
+
+        Parameters:
+        - openAIkey (str): The OpenAI API key.
+        - embedding_model (str): The embedding model name.
+        - base_url (str): An alternative API base URL, e.g. a local fake embeddings server. Defaults to OpenAI.
+        - max_workers (int): The maximum number of embedding requests in flight at once.
+        - max_batch_size (int): The maximum number of inputs packed into one request.
+        - max_batch_tokens (int): The estimated token budget of one request.
+        - max_retries (int): How many times a rate limited or failed request is retried.
+        - backoff_base (float): The initial retry delay in seconds, doubled after every attempt.
+        - backoff_max (float): The upper bound of a single retry delay in seconds.
         """
         try:
-            self.client = OpenAI(api_key=openAIkey)
+            # Retries are handled by _embed_batch so that backoff is shared by all callers.
+            self.client = OpenAI(api_key=openAIkey, base_url=base_url, max_retries=0)
             self.model = embedding_model
         except Exception as e:
             logging.error("Failed to initialize OpenAI client: %s", e)
             raise ConnectionError("Failed to connect to OpenAI with provided API key.")
-            
+        self.max_workers = max_workers
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
     def get_embedding(self, text):
         """
         Retrieves an embedding for the given text using the configured model.
         """
-        text = text.replace("\n", " ")
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts):
+        """
+        Retrieves embeddings for many texts at once. Texts are packed into requests that respect
+        max_batch_size and max_batch_tokens, and up to max_workers requests are sent concurrently.
+        Empty texts are not sent and get None as their embedding.
+
+        Parameters:
+        - texts (iterable): The texts to embed.
+
+        Returns:
+        - list: The embedding vectors in the same order as the input texts.
+        """
+        texts = [text.replace("\n", " ") if isinstance(text, str) and text.strip() else None for text in texts]
+        embeddings = [None] * len(texts)
+        batches = self._pack(texts)
+        if not batches:
+            return embeddings
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            futures = {pool.submit(self._embed_batch, [texts[i] for i in batch]): batch for batch in batches}
+            for future in as_completed(futures):
+                for i, embedding in zip(futures[future], future.result()):
+                    embeddings[i] = embedding
+        return embeddings
+
+    def _pack(self, texts):
+        """
+        Groups the indices of non-empty texts into request sized batches.
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            if text is None:
+                continue
+            tokens = estimate_tokens(text)
+            if batch and (len(batch) >= self.max_batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(self, inputs):
+        """
+        Sends one embedding request, retrying rate limited and transient failures with exponential backoff.
+        A rejected request is split in halves so that one invalid input (e.g. a text above the model's
+        token limit) only costs its own embedding, which is returned as None.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.embeddings.create(input=inputs, model=self.model)
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    logging.error("Error getting embeddings after %d attempts: %s", attempt + 1, e)
+                    raise
+                delay = self._retry_delay(attempt, e)
+                logging.warning("Embedding request failed (%s), retrying in %.1f s.", e, delay)
+                time.sleep(delay)
+            except BadRequestError as e:
+                if len(inputs) == 1:
+                    logging.error("Embedding request rejected for a text of %d characters: %s", len(inputs[0]), e)
+                    return [None]
+                middle = len(inputs) // 2
+                return self._embed_batch(inputs[:middle]) + self._embed_batch(inputs[middle:])
+            except Exception as e:
+                logging.error("Error getting embedding: %s", e)
+                raise
+
+    def _retry_delay(self, attempt, error):
+        """
+        Returns the delay before the next attempt, honouring a Retry-After header when the server sends one.
+        """
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
         try:
-            response = self.client.embeddings.create(input=[text], model=self.model)
-            return response.data[0].embedding
-        except Exception as e:
-            logging.error("Error getting embedding: %s", e)
-            raise
+            return min(float(retry_after), self.backoff_max)
+        except (TypeError, ValueError):
+            delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+            return delay / 2 + random.uniform(0, delay / 2)
+
+def estimate_tokens(text):
+    """
+    Roughly estimates the number of tokens of a text (about four characters per token for English).
+    """
+    return len(text) // 4 + 1
@@ -0,0 +1,162 @@
+import logging
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, func, workers=1, on_error=None):
+        """
+        Describes one step of a Pipeline.
+
+        Parameters:
+        - name (str): The name used in logs and in the run report.
+        - func (callable): Called with an item, returns the item handed to the next stage or None to drop it.
+        - workers (int): The number of threads running func concurrently.
+        - on_error (callable): Called with the item and the exception when func fails, e.g. to release resources.
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(int(workers), 1)
+        self.on_error = on_error
+
+
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.rows = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, rows, busy, failed=False):
+        with self._lock:
+            self.items += 1
+            self.rows += rows
+            self.busy += busy
+            self.errors += failed
+
+    def as_dict(self):
+        wall = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "rows": self.rows,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy, 3),
+            "wall_seconds": round(wall, 3),
+            "rows_per_sec": round(self.rows / wall, 1) if wall > 0 else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages, each on its own pool of worker threads.
+
+    Stages are connected by bounded queues, so a slow stage applies backpressure to the stages
+    before it and at most queue_size items wait between two stages. The source iterable is consumed
+    on the calling thread and reported as the 'read' stage.
+    """
+
+    def __init__(self, stages, queue_size=4, size=len):
+        """
+        Parameters:
+        - stages (list): The Stage objects, in order.
+        - queue_size (int): The capacity of each queue between stages.
+        - size (callable): Returns the number of rows an item represents, used for rows/sec reporting.
+        """
+        self.stages = stages
+        self.queue_size = max(int(queue_size), 1)
+        self.size = size
+
+    def run(self, source):
+        """
+        Feeds every item of source through the stages and blocks until all of them are processed.
+
+        Returns:
+        - list: One statistics dictionary per stage, starting with the 'read' stage.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        stats = [StageStats(stage.name, stage.workers) for stage in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+
+        def work(index):
+            stage, inbox, stage_stats = self.stages[index], queues[index], stats[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            try:
+                while True:
+                    item = inbox.get()
+                    if item is _DONE:
+                        break
+                    if stage_stats.started is None:
+                        stage_stats.started = time.perf_counter()
+                    rows = self.size(item)
+                    started = time.perf_counter()
+                    try:
+                        result = stage.func(item)
+                    except Exception as e:
+                        logging.error("Pipeline stage '%s' failed: %s", stage.name, e)
+                        stage_stats.record(rows, time.perf_counter() - started, failed=True)
+                        if stage.on_error:
+                            try:
+                                stage.on_error(item, e)
+                            except Exception as handler_error:
+                                logging.error("Error handler of pipeline stage '%s' failed: %s", stage.name, handler_error)
+                        continue
+                    stage_stats.record(rows, time.perf_counter() - started)
+                    if outbox is not None and result is not None:
+                        outbox.put(result)
+            finally:
+                # Even a worker that died must count itself out, or the next stage never gets its _DONE.
+                with remaining_lock:
+                    remaining[index] -= 1
+                    last = remaining[index] == 0
+                if last:
+                    stage_stats.finished = time.perf_counter()
+                    if outbox is not None:
+                        for _ in range(self.stages[index + 1].workers):
+                            outbox.put(_DONE)
+
+        threads = [
+            threading.Thread(target=work, args=(index,), name=f"{stage.name}-{worker}", daemon=True)
+            for index, stage in enumerate(self.stages)
+            for worker in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        read_stats = StageStats("read", 1)
+        read_stats.started = time.perf_counter()
+        try:
+            iterator = iter(source)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                read_stats.record(self.size(item), time.perf_counter() - started)
+                queues[0].put(item)
+        finally:
+            read_stats.finished = time.perf_counter()
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+
+        report = [read_stats.as_dict()] + [stage_stats.as_dict() for stage_stats in stats]
+        for entry in report:
+            logging.info(
+                "Stage %-8s workers=%d items=%d rows=%d errors=%d busy=%.1fs wall=%.1fs rows/sec=%.1f",
+                entry["stage"], entry["workers"], entry["items"], entry["rows"], entry["errors"],
+                entry["busy_seconds"], entry["wall_seconds"], entry["rows_per_sec"],
+            )
+        return report
@@ -0,0 +1,253 @@
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from utils import batched
+
+
+def compact_seqs(books):
+    """
+    Assigns every book a sequence number so that they run densely from 0 to the number of books - 1.
+    Books that already hold a free number in that range keep it; new books, books holding a duplicate and books
+    beyond the range (left behind by removed books) take the free numbers, so only those are written.
+
+    Parameters:
+    - books (list): (title, seq) tuples; seq is None for books that have none yet.
+
+    Returns:
+    - list: Dictionaries with the title and new seq of every book whose number changes.
+    """
+    count = len(books)
+    taken = set()
+    moved = []
+    for title, seq in books:
+        if isinstance(seq, int) and 0 <= seq < count and seq not in taken:
+            taken.add(seq)
+        else:
+            moved.append(title)
+    free = (seq for seq in range(count) if seq not in taken)
+    return [{"title": title, "seq": seq} for title, seq in zip(moved, free)]
+
+
+def top_k_neighbours(vectors, valid, k, block_size, queries=None):
+    """
+    Finds the k most similar rows of every query row by cosine similarity, one block of rows at a time.
+    Only a block_size x block_size score matrix and the running top k of one block are held in
+    memory besides the vectors, which may be a memory-mapped array.
+
+    Parameters:
+    - vectors (ndarray): The unit-normalized vectors, one row per book.
+    - valid (ndarray): A boolean mask of the rows that have a vector.
+    - k (int): The number of neighbours per row.
+    - block_size (int): The number of rows compared at once.
+    - queries (ndarray, optional): The sorted rows to find neighbours for; all rows by default.
+
+    Yields:
+    - tuple: The rows of a block, and the neighbour rows and scores of its rows, best first, as
+      (block, k) arrays. Missing neighbours have row -1. Blocks without any vector are skipped.
+    """
+    rows = len(vectors)
+    k = min(k, rows - 1)
+    queries = np.arange(rows) if queries is None else np.asarray(queries, dtype=np.int64)
+    for start in range(0, len(queries), block_size):
+        block = queries[start:start + block_size]
+        if not valid[block].any():
+            continue
+        # Consecutive rows are read as a slice, which is cheaper on a memory-mapped array.
+        contiguous = block[-1] - block[0] == len(block) - 1
+        query_vectors = np.asarray(vectors[block[0]:block[-1] + 1] if contiguous else vectors[block])
+        best_scores = np.full((len(block), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(block), k), -1, dtype=np.int64)
+        for candidate_start in range(0, rows, block_size):
+            candidate_stop = min(candidate_start + block_size, rows)
+            scores = query_vectors @ np.asarray(vectors[candidate_start:candidate_stop]).T
+            scores[:, ~valid[candidate_start:candidate_stop]] = -np.inf
+            # A book is not its own neighbour.
+            own = np.flatnonzero((block >= candidate_start) & (block < candidate_stop))
+            scores[own, block[own] - candidate_start] = -np.inf
+            # Only rows with a candidate better than their current k-th neighbour need merging, and
+            # they take the block's own top k first, so at most 2k candidates per row are compared.
+            improving = np.flatnonzero((scores > best_scores.min(axis=1, keepdims=True)).any(axis=1))
+            if not len(improving):
+                continue
+            scores = scores[improving]
+            block_k = min(k, scores.shape[1])
+            top = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+            merged_scores = np.concatenate([best_scores[improving], np.take_along_axis(scores, top, axis=1)], axis=1)
+            merged_rows = np.concatenate([best_rows[improving], top + candidate_start], axis=1)
+            keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores[improving] = np.take_along_axis(merged_scores, keep, axis=1)
+            best_rows[improving] = np.take_along_axis(merged_rows, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_rows[~np.isfinite(best_scores)] = -1
+        yield block, best_rows, best_scores
+
+
+def rows_to_update(vectors, valid, stale, neighbours, degree, kth_score, k, block_size):
+    """
+    Finds the books whose similar books must be computed again after some embeddings changed:
+    - stale books, whose embedding changed, appeared or became invalid since the last build;
+    - books with another number of neighbours than k, e.g. because a neighbour was removed;
+    - books with a stale neighbour, whose score is out of date;
+    - books that a new or changed embedding is more similar to than their current k-th neighbour.
+    The last check compares the books not found by the others with the changed embeddings only, block by block,
+    so it costs nothing on a first build, where every book is stale.
+
+    Parameters:
+    - vectors (ndarray): The unit-normalized vectors, one row per book.
+    - valid (ndarray): A boolean mask of the rows that have a vector.
+    - stale (ndarray): A boolean mask of the rows whose embedding changed since the last build.
+    - neighbours (ndarray): The current neighbour rows of every row, -1 where there is none.
+    - degree (ndarray): The current number of neighbours of every row.
+    - kth_score (ndarray): The score of the least similar current neighbour of every row.
+    - k (int): The number of neighbours per row.
+    - block_size (int): The number of rows compared at once.
+
+    Returns:
+    - ndarray: A boolean mask of the rows to update.
+    """
+    update = stale | (valid & (degree != k)) | (~valid & (degree > 0))
+    update |= (stale[np.maximum(neighbours, 0)] & (neighbours >= 0)).any(axis=1)
+    changed = np.flatnonzero(stale & valid)
+    if not len(changed):
+        return update
+    # Pending rows are not stale, so none of them is compared with itself.
+    pending = np.flatnonzero(valid & ~update)
+    for start in range(0, len(pending), block_size):
+        rows = pending[start:start + block_size]
+        row_vectors = np.asarray(vectors[rows])
+        best = np.full(len(rows), -np.inf, dtype=np.float32)
+        for candidate_start in range(0, len(changed), block_size):
+            candidates = changed[candidate_start:candidate_start + block_size]
+            best = np.maximum(best, (row_vectors @ np.asarray(vectors[candidates]).T).max(axis=1))
+        update[rows] |= best > kth_score[rows]
+    return update
+
+
+class SimilarBooksBuilder:
+    def __init__(self, neo4j_connection, vector_dimensions, k=10, block_size=1024, read_batch_size=2000, write_batch_size=500,
+                 directory=None):
+        """
+        Builds the k-nearest-neighbour graph of the books over their summary embeddings: every book gets
+        SIMILAR_TO {score} relationships to its k most similar books, and a dense Book.seq so that a
+        random book is an index lookup.
+
+        The embeddings are read once, in seq order, into a memory-mapped float32 matrix on disk, and the
+        neighbours are computed block by block, so memory stays bounded by the block size and not by the
+        square of the number of books. Only the books whose embedding changed since the last build and
+        the books whose neighbours they affect are computed again (see rows_to_update); books without a
+        valid embedding lose their relationships.
+
+        Parameters:
+        - neo4j_connection (Neo4jConnection): The connection to Neo4j.
+        - vector_dimensions (int): The number of dimensions of the embeddings.
+        - k (int): The number of similar books per book.
+        - block_size (int): The number of books compared at once.
+        - read_batch_size (int): The number of embeddings read per query.
+        - write_batch_size (int): The number of books whose relationships are replaced per transaction.
+        - directory (str, optional): Where the temporary matrix is stored; the system temporary directory by default.
+        """
+        self.neo4j = neo4j_connection
+        self.vector_dimensions = int(vector_dimensions)
+        self.k = int(k)
+        self.block_size = int(block_size)
+        self.read_batch_size = int(read_batch_size)
+        self.write_batch_size = int(write_batch_size)
+        self.directory = directory
+
+    def assign_seqs(self):
+        """
+        Makes Book.seq dense and records the number of books.
+
+        Returns:
+        - int: The number of books.
+        """
+        books = self.neo4j.fetch_book_seqs()
+        moved = compact_seqs(books)
+        self.neo4j.set_book_seqs(moved, len(books))
+        logging.info("Book sequence numbers: %d books, %d renumbered.", len(books), len(moved))
+        return len(books)
+
+    def build(self):
+        """
+        Renumbers the books and brings the SIMILAR_TO relationships up to date.
+
+        Returns:
+        - dict: The number of books, the number of books whose neighbours were computed again, the number
+          of books linked among them and the time taken in seconds.
+        """
+        started = time.perf_counter()
+        count = self.assign_seqs()
+        if count < 2 or self.k <= 0:
+            return {"books": count, "updated": 0, "linked": 0, "seconds": time.perf_counter() - started}
+
+        handle, path = tempfile.mkstemp(suffix=".npy", dir=self.directory)
+        os.close(handle)
+        try:
+            vectors = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32,
+                                                shape=(count, self.vector_dimensions))
+            valid = np.zeros(count, dtype=bool)
+            stale = np.zeros(count, dtype=bool)
+            neighbours = np.full((count, self.k), -1, dtype=np.int32)
+            degree = np.zeros(count, dtype=np.int32)
+            kth_score = np.full(count, -np.inf, dtype=np.float32)
+            for start in range(0, count, self.read_batch_size):
+                for seq, vector, is_stale, links in self.neo4j.fetch_book_vectors(start, start + self.read_batch_size):
+                    stale[seq] = is_stale
+                    degree[seq] = len(links)
+                    if links:
+                        neighbours[seq, :min(len(links), self.k)] = [other for other, _ in links[:self.k]]
+                        kth_score[seq] = min(score for _, score in links)
+                    if vector is None or len(vector) != self.vector_dimensions:
+                        continue
+                    vector = np.asarray(vector, dtype=np.float32)
+                    norm = np.linalg.norm(vector)
+                    if norm:
+                        vectors[seq] = vector / norm
+                        valid[seq] = True
+            vectors.flush()
+
+            k = min(self.k, int(valid.sum()) - 1)
+            update = rows_to_update(vectors, valid, stale, neighbours, degree, kth_score, k, self.block_size)
+            # Books without a valid embedding only lose their relationships.
+            batch = [{"seq": int(seq), "neighbours": []} for seq in np.flatnonzero(update & ~valid)]
+            for rows_batch in batched(batch, self.write_batch_size):
+                self.neo4j.replace_similar_books(rows_batch)
+
+            linked = 0
+            for block, rows, scores in top_k_neighbours(vectors, valid, self.k, self.block_size,
+                                                        queries=np.flatnonzero(update & valid)):
+                batch = []
+                for offset, seq in enumerate(block.tolist()):
+                    links = [{"seq": int(row), "score": round(float(score), 6)}
+                             for row, score in zip(rows[offset], scores[offset]) if row >= 0]
+                    batch.append({"seq": seq, "neighbours": links})
+                for rows_batch in batched(batch, self.write_batch_size):
+                    self.neo4j.replace_similar_books(rows_batch)
+                linked += len(batch)
+            del vectors
+        finally:
+            os.remove(path)
+
+        seconds = time.perf_counter() - started
+        updated = int(update.sum())
+        logging.info("Similar books: updated %d of %d books, linking %d to their %d nearest neighbours, in %.1fs.",
+                     updated, count, linked, self.k, seconds)
+        return {"books": count, "updated": updated, "linked": linked, "seconds": seconds}
+
+
+if __name__ == "__main__":
+    from neo4j_connection import Neo4jConnection
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    connection = Neo4jConnection(os.getenv("NEO4J_URI"), os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))
+    try:
+        SimilarBooksBuilder(connection, os.getenv("DIMENSIONS", 1536), k=os.getenv("SIMILAR_BOOKS_K", 10),
+                            block_size=os.getenv("SIMILAR_BOOKS_BLOCK_SIZE", 1024)).build()
+    finally:
+        connection.close()
@@ -1,13 +1,64 @@
+import hashlib
+import unicodedata
+import pandas as pd
+
 def parse_embeddings(row):
     """
     Parses the 'Embeddings' field from a CSV row into a list of floats.
+    Rows whose embeddings were just retrieved already hold a list and are returned as is.
     """
-    embeddings = row['Embeddings'].strip("[]").split(',')
+    embeddings = row['Embeddings']
+    if not isinstance(embeddings, str):
+        return embeddings
+    embeddings = embeddings.strip("[]").split(',')
     return list(map(float, embeddings))
 
+def normalize_genre(genre):
+    """
+    Normalizes the spelling of one genre: Unicode is composed (NFC), whitespace collapsed, and a genre
+    written in all lowercase gets capitalized words, e.g. "science  fiction" becomes "Science Fiction".
+    Other genres keep their case, so acronyms such as "LGBTQ+" survive.
+    """
+    genre = " ".join(unicodedata.normalize("NFC", genre).split())
+    if genre.islower():
+        genre = " ".join(word[:1].upper() + word[1:].lower() for word in genre.split())
+    return genre
+
 def parse_genres(genres):
     """
-    Splits and standardizes the genre data from a CSV string into individual genres.
+    Splits and standardizes the genre data from a CSV string into individual genres. Genres are normalized
+    with normalize_genre, empty ones are dropped and repeated ones, compared without case, are kept once,
+    so the graph gets one Genre node per genre however the CSV spells it.
     """
+    if not isinstance(genres, str):
+        return []
     standardized = genres.replace('/', ',')
-    return [part.strip() for part in standardized.split(',')]
+    parsed, seen = [], set()
+    for part in standardized.split(','):
+        genre = normalize_genre(part)
+        if genre and genre.casefold() not in seen:
+            seen.add(genre.casefold())
+            parsed.append(genre)
+    return parsed
+
+def batched(iterable, batch_size):
+    """
+    Yields successive lists of at most batch_size items from any iterable without materializing it.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def content_hash(model, row):
+    """
+    Returns a hash of everything that is written to Neo4j for a book row, including the embedding model,
+    so that a row only has to be written again when this hash changes.
+    """
+    fields = [model] + [str(row[key]) for key in ('title', 'author', 'lang', 'rating', 'year', 'summary')]
+    fields += sorted(row['genres'])
+    return hashlib.sha256("\x00".join(fields).encode("utf-8")).hexdigest()
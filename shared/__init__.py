@@ -0,0 +1,4 @@
+"""
+Modules used by both applications (chat and download_data). Both put the repository root, or the
+directory their container mounts this package in, on PYTHONPATH.
+"""
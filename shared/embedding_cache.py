@@ -0,0 +1,193 @@
+"""
+The persistent embedding cache shared by ingestion and the chat app.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+
+def normalize_text(text):
+    """
+    Normalizes a text before hashing so that whitespace-only differences share a cache entry.
+    """
+    return " ".join(text.split())
+
+def cache_key(model, dimensions, text):
+    """
+    Returns the content address of an embedding: a hash of the model, the dimensions and the normalized text.
+    """
+    payload = f"{model}\x00{dimensions or ''}\x00{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed embedding cache stored in SQLite.
+
+    Vectors are stored as float32 blobs keyed by (model, dimensions, normalized text hash).
+    The cache is bounded to max_entries and evicts the least recently used entries.
+    It is safe to use from several threads and processes at once: every thread has its own
+    connection and the database runs in WAL mode.
+
+    Ingestion (download_data/embedding_cache.py) and chat (chat/embedding_cache.py) both wrap this class,
+    so they can use the same cache file.
+
+    Hits update the last access time of their entries in memory; the times are written in one statement
+    with the next insert, or once touch_batch of them are pending or touch_interval seconds have passed,
+    so that lookups do not turn into SQLite writes.
+    """
+
+    def __init__(self, path, max_entries=1_000_000, touch_batch=256, touch_interval=60.0):
+        """
+        Opens (or creates) the cache at the given path.
+
+        Parameters:
+        - path (str): The SQLite database file.
+        - max_entries (int): The maximum number of vectors kept before the least recently used are evicted.
+        - touch_batch (int): The number of pending last access times that triggers a write.
+        - touch_interval (float): The seconds after which pending last access times are written anyway.
+        """
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}
+        self._touched_since = time.monotonic()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+            self._entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model, dimensions, texts):
+        """
+        Looks up the embeddings of several texts.
+
+        Returns:
+        - list: A vector (list of floats) for every cached text and None for every miss, in input order.
+        """
+        keys = [cache_key(model, dimensions, text) for text in texts]
+        found = {}
+        conn = self._connection()
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+
+        results = [found.get(key) for key in keys]
+        hits = sum(result is not None for result in results)
+        now = time.time()
+        with self._lock:
+            self.hits += hits
+            self.misses += len(results) - hits
+            self._touched.update((key, now) for key in found)
+            due = len(self._touched) >= self.touch_batch or (
+                self._touched and time.monotonic() - self._touched_since > self.touch_interval)
+        if due:
+            with conn:
+                self._write_touches(conn)
+        return results
+
+    def _write_touches(self, conn):
+        """
+        Writes the pending last access times in the open transaction of conn.
+        """
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_since = time.monotonic()
+        if touched:
+            conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                             [(when, key) for key, when in touched.items()])
+
+    def flush(self):
+        """
+        Writes the pending last access times.
+        """
+        conn = self._connection()
+        with conn:
+            self._write_touches(conn)
+
+    def put_many(self, model, dimensions, texts, vectors):
+        """
+        Stores embeddings for several texts. Texts without a vector are ignored.
+        """
+        now = time.time()
+        rows = [
+            (cache_key(model, dimensions, text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors) if vector is not None
+        ]
+        if not rows:
+            return
+        conn = self._connection()
+        with conn:
+            self._write_touches(conn)
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows)
+            inserted = conn.total_changes - before
+        with self._lock:
+            self._entries += inserted
+            over_limit = self._entries > self.max_entries
+        if over_limit:
+            self._evict()
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache is a tenth below its limit.
+        """
+        conn = self._connection()
+        with conn:
+            self._write_touches(conn)
+            entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            excess = entries - int(self.max_entries * 0.9)
+            if excess > 0:
+                conn.execute("""
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_access LIMIT ?
+                    )
+                """, (excess,))
+                logging.info("Evicted %d least recently used embeddings from the cache.", excess)
+            entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        with self._lock:
+            self._entries = entries
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of this process and the number of cached vectors.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._entries,
+            }
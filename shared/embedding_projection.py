@@ -0,0 +1,218 @@
+"""
+The embedding projection shared by ingestion and the chat app.
+
+Ingestion fits it and projects the plot vectors it stores in Neo4j; the chat app loads the saved file and
+projects its question embeddings the same way (see chat/embedding_projection.py). The rescore vectors
+ingestion stores are encoded and decoded here too.
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+REDUCTIONS = ("truncate", "pca")
+RESCORE_PRECISIONS = ("int8", "float16")
+
+# The first byte of an encoded rescore vector names its layout.
+INT8_TAG = b"\x01"
+FLOAT16_TAG = b"\x02"
+RESCORE_TAGS = {INT8_TAG[0]: "int8", FLOAT16_TAG[0]: "float16"}
+
+
+def projection_path(file_book_path):
+    """
+    Returns the default path of the embedding projection that belongs to a books CSV file.
+    """
+    root, _ = os.path.splitext(file_book_path)
+    return f"{root}.projection.npz"
+
+
+class EmbeddingProjection:
+    def __init__(self, method, dimensions, source_dimensions, mean=None, components=None):
+        """
+        Maps full-width summary embeddings to the narrower vectors stored in Neo4j and indexed by summaryPlots.
+
+        'truncate' keeps the first dimensions of every vector. Models trained Matryoshka-style, such as
+        OpenAI's text-embedding-3 family, put the most information there, so a prefix is a usable embedding
+        on its own. 'pca' subtracts the mean and projects onto the principal components of a sample of the
+        catalogue, which also works for models without that property. Projected vectors are unit-normalized.
+
+        The projection is saved next to the catalogue and loaded by the chat app, which applies it to the
+        question embeddings so that they match the stored vectors.
+
+        Parameters:
+        - method (str): 'truncate' or 'pca'.
+        - dimensions (int): The number of dimensions of the stored vectors.
+        - source_dimensions (int): The number of dimensions of the embeddings.
+        - mean (ndarray, optional): The mean of the sample, for 'pca'.
+        - components (ndarray, optional): The (dimensions, source_dimensions) principal components, for 'pca'.
+        """
+        if method not in REDUCTIONS:
+            raise ValueError(f"Unknown embedding reduction '{method}', expected one of {', '.join(REDUCTIONS)}.")
+        if not 0 < int(dimensions) <= int(source_dimensions):
+            raise ValueError(f"Cannot reduce {source_dimensions} dimensions to {dimensions}.")
+        self.method = method
+        self.dimensions = int(dimensions)
+        self.source_dimensions = int(source_dimensions)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.components = None if components is None else np.asarray(components, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, method, dimensions, vectors):
+        """
+        Creates a projection for a sample of embeddings; 'truncate' only needs their width.
+
+        Parameters:
+        - method (str): 'truncate' or 'pca'.
+        - dimensions (int): The number of dimensions of the stored vectors.
+        - vectors (ndarray): The sample, one embedding per row.
+
+        Returns:
+        - EmbeddingProjection: The projection.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if method != "pca":
+            return cls(method, dimensions, vectors.shape[1])
+        if len(vectors) < dimensions:
+            raise ValueError(f"PCA to {dimensions} dimensions needs at least as many sample vectors, got {len(vectors)}.")
+        mean = vectors.mean(axis=0)
+        # The right singular vectors of the centred sample are its principal components, largest first.
+        _, _, components = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(method, dimensions, vectors.shape[1], mean, components[:dimensions])
+
+    def transform(self, vectors):
+        """
+        Projects embeddings to the stored width.
+
+        Parameters:
+        - vectors (ndarray): One embedding per row.
+
+        Returns:
+        - ndarray: The unit-normalized float32 projections, one per row.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.method == "pca":
+            projected = (vectors - self.mean) @ self.components.T
+        else:
+            projected = vectors[:, :self.dimensions]
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        return projected / np.where(norms > 0, norms, 1.0)
+
+    def fingerprint(self):
+        """
+        Returns a short hash of the projection. It is part of the content hash of every book, so books
+        are written again when the projection changes.
+        """
+        digest = hashlib.sha256(f"{self.method}\x00{self.dimensions}\x00{self.source_dimensions}".encode())
+        if self.components is not None:
+            digest.update(self.mean.tobytes())
+            digest.update(self.components.tobytes())
+        return digest.hexdigest()[:16]
+
+    def save(self, path):
+        """
+        Writes the projection to an .npz file atomically.
+        """
+        arrays = {"method": np.array(self.method), "dimensions": np.array(self.dimensions),
+                  "source_dimensions": np.array(self.source_dimensions)}
+        if self.components is not None:
+            arrays.update(mean=self.mean, components=self.components)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp.npz"
+        np.savez(temporary, **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a projection written by save.
+
+        Returns:
+        - EmbeddingProjection: The projection.
+        """
+        with np.load(path) as arrays:
+            return cls(str(arrays["method"]), int(arrays["dimensions"]), int(arrays["source_dimensions"]),
+                       arrays["mean"] if "mean" in arrays else None,
+                       arrays["components"] if "components" in arrays else None)
+
+
+def load_or_fit_projection(path, method, dimensions, source_dimensions, sample):
+    """
+    Returns the projection saved at path if it was made with the same settings, otherwise fits a new one
+    and saves it. Reusing it keeps the stored vectors of earlier runs valid, so an incremental run only
+    writes the books that changed.
+
+    Parameters:
+    - path (str): The .npz file of the projection.
+    - method (str): 'truncate' or 'pca'.
+    - dimensions (int): The number of dimensions of the stored vectors.
+    - source_dimensions (int): The number of dimensions of the embeddings.
+    - sample (callable): Returns the sample to fit a PCA on; only called when a new PCA is needed.
+
+    Returns:
+    - EmbeddingProjection: The projection.
+    """
+    try:
+        projection = EmbeddingProjection.load(path)
+        if (projection.method, projection.dimensions, projection.source_dimensions) == (method, dimensions, source_dimensions):
+            logging.info("Reusing %s embedding projection %s to %d dimensions.", method, path, dimensions)
+            return projection
+        logging.info("Replacing embedding projection %s made with other settings.", path)
+    except FileNotFoundError:
+        pass
+    vectors = sample() if method == "pca" else np.zeros((0, source_dimensions), dtype=np.float32)
+    projection = EmbeddingProjection.fit(method, dimensions, vectors)
+    projection.save(path)
+    logging.info("Saved %s embedding projection %s from %d to %d dimensions.", method, path, source_dimensions, dimensions)
+    return projection
+
+
+def encode_rescore_vector(vector, precision):
+    """
+    Encodes a full-width embedding compactly for the in-process rescoring of the chat app's local plot index.
+    'int8' stores a float32 scale and one byte per dimension, 'float16' two bytes per dimension. Neo4j keeps
+    the bytes as a byte array property, which costs no more than that.
+
+    Parameters:
+    - vector (list): The embedding.
+    - precision (str): 'int8' or 'float16'.
+
+    Returns:
+    - bytes: The encoded vector.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    vector = vector / (np.linalg.norm(vector) or 1.0)
+    if precision == "float16":
+        return FLOAT16_TAG + vector.astype("<f2").tobytes()
+    if precision != "int8":
+        raise ValueError(f"Unknown rescore precision '{precision}', expected one of {', '.join(RESCORE_PRECISIONS)}.")
+    scale = float(np.abs(vector).max()) / 127 or 1.0
+    quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return INT8_TAG + np.float32(scale).astype("<f4").tobytes() + quantized.tobytes()
+
+
+def decode_rescore_vectors(blobs):
+    """
+    Decodes the rescore vectors of several books, which must share one precision and width.
+
+    Parameters:
+    - blobs (list): The byte strings written by encode_rescore_vector.
+
+    Returns:
+    - tuple: The precision ('int8' or 'float16'), the (books, dimensions) matrix in that precision and,
+      for int8, the float32 scale of every row (None for float16).
+    """
+    precision = RESCORE_TAGS[blobs[0][0]]
+    if precision == "float16":
+        return precision, np.stack([np.frombuffer(blob, dtype="<f2", offset=1) for blob in blobs]), None
+    scales = np.array([np.frombuffer(blob, dtype="<f4", count=1, offset=1)[0] for blob in blobs], dtype=np.float32)
+    return precision, np.stack([np.frombuffer(blob, dtype=np.int8, offset=5) for blob in blobs]), scales
+
+
+def rescore_precision(blob):
+    """
+    Returns the precision of a stored rescore vector, or None if the book has none.
+    """
+    return RESCORE_TAGS.get(blob[0]) if blob else None